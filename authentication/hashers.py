@@ -0,0 +1,31 @@
+"""
+Password hashers whose cost is read from the settings, so it can be tuned per
+environment (AUTH_PBKDF2_ITERATIONS, AUTH_ARGON2_*). Django rehashes a password
+on the next successful login whenever its algorithm or cost differs from the
+first entry of PASSWORD_HASHERS.
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, PBKDF2PasswordHasher
+
+
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+
+    @property
+    def iterations(self):
+        return settings.AUTH_PBKDF2_ITERATIONS
+
+
+class TunableArgon2PasswordHasher(Argon2PasswordHasher):
+    # Needs the argon2-cffi package
+
+    @property
+    def time_cost(self):
+        return settings.AUTH_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.AUTH_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.AUTH_ARGON2_PARALLELISM
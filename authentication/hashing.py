@@ -0,0 +1,39 @@
+"""
+Caps the number of passwords hashed at the same time in a process.
+
+Hashing is CPU bound and deliberately slow, so a burst of logins could otherwise
+occupy every worker thread. Requests wait up to AUTH_HASHING_TIMEOUT seconds for
+one of the AUTH_HASHING_CONCURRENCY slots and are answered 503 after that, which
+leaves the remaining threads free for the rest of the API.
+"""
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class HashingUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins in progress, try again shortly.'
+    default_code = 'hashing_unavailable'
+    # Sent as Retry-After by DRF's exception handler
+    wait = 1
+
+
+@lru_cache
+def _slots(concurrency):
+    return threading.BoundedSemaphore(concurrency)
+
+
+@contextmanager
+def hashing_slot():
+    slots = _slots(settings.AUTH_HASHING_CONCURRENCY)
+    if not slots.acquire(timeout=settings.AUTH_HASHING_TIMEOUT):
+        raise HashingUnavailable()
+    try:
+        yield
+    finally:
+        slots.release()
@@ -0,0 +1,21 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from authentication.tokens import revoke_user_tokens
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Revoke every token issued so far to the given users.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='+')
+
+    def handle(self, *args, **options):
+        users = dict(User.objects.filter(username__in=options['usernames']).values_list('username', 'pk'))
+        missing = set(options['usernames']) - set(users)
+        if missing:
+            raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+        for user_id in users.values():
+            revoke_user_tokens(user_id)
+        self.stdout.write(self.style.SUCCESS(f'Revoked the tokens of {len(users)} users.'))
@@ -1,14 +1,22 @@
 # Create your tests here.
-from django.test import TestCase
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
+from rest_framework.throttling import SimpleRateThrottle
 from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.tokens import AccessToken
+from backend.testing import QueryBudgetTestCase
+from .hashing import _slots
+from .tokens import revoke_user_tokens, tokens_for_user
 
 User = get_user_model()
 
 class AuthenticationTest(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.register_url = reverse('user-registration')
         self.login_url = reverse('user-login')
@@ -37,6 +45,7 @@ class AuthenticationTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('access', response.data)
         self.assertIn('refresh', response.data)
+        self.assertNotIn('_auth_user_id', self.client.session)
 
     def test_invalid_user_login(self):
         # Attempt login with invalid credentials
@@ -47,6 +56,125 @@ class AuthenticationTest(TestCase):
         response = self.client.post(self.login_url, login_data, format='json')
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+class StatelessJWTAuthenticationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader', password='testpassword')
+        self.client = APIClient()
+        # Not cached, and answered with a single query
+        self.url = reverse('job-list-create')
+
+    def authorize(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens_for_user(user)['access']}")
+
+    def test_tokens_carry_user_claims(self):
+        token = AccessToken(tokens_for_user(self.user)['access'])
+        self.assertEqual(token['user_id'], self.user.pk)
+        self.assertEqual(token['username'], 'reader')
+        self.assertFalse(token['is_staff'])
+
+    def test_user_is_not_loaded_from_database(self):
+        self.authorize(self.user)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.wsgi_request.user.pk, self.user.pk)
+
+    def test_revoked_tokens_are_refused(self):
+        self.authorize(self.user)
+        revoke_user_tokens(self.user.pk)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(AUTH_JWT_CHECK_REVOCATION=False)
+    def test_revocation_check_can_be_disabled(self):
+        self.authorize(self.user)
+        revoke_user_tokens(self.user.pk)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(AUTH_JWT_USER_CACHE_TIMEOUT=60)
+    def test_cached_user(self):
+        self.authorize(self.user)
+        self.client.get(self.url)
+        # The user row is only read on the first request
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertIsInstance(response.wsgi_request.user, User)
+        self.assertEqual(response.wsgi_request.user.username, self.user.username)
+        # The password hash is not cached, and is read back from the row when used
+        self.assertNotIn('password', cache.get(f'auth:user:{self.user.pk}'))
+        self.assertEqual(response.wsgi_request.user.password, self.user.password)
+
+        # Deactivated users are refused once their cache entry is gone
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        cache.delete(f'auth:user:{self.user.pk}')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+class PasswordHashingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.login_url = reverse('user-login')
+        self.login_data = {'username': 'hasher', 'password': 'testpassword'}
+
+    def test_password_is_rehashed_on_login_when_cost_changes(self):
+        with self.settings(AUTH_PBKDF2_ITERATIONS=1000):
+            User.objects.create_user(**self.login_data)
+        self.assertTrue(User.objects.get().password.startswith('pbkdf2_sha256$1000$'))
+
+        with self.settings(AUTH_PBKDF2_ITERATIONS=2000):
+            response = self.client.post(self.login_url, self.login_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(User.objects.get().password.startswith('pbkdf2_sha256$2000$'))
+
+    @override_settings(AUTH_HASHING_CONCURRENCY=1, AUTH_HASHING_TIMEOUT=0)
+    def test_login_is_refused_when_every_hashing_slot_is_busy(self):
+        slots = _slots(1)
+        slots.acquire()
+        try:
+            response = self.client.post(self.login_url, self.login_data, format='json')
+        finally:
+            slots.release()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+
+@override_settings(AUTH_PBKDF2_ITERATIONS=1000)
+class LoginThrottleTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.login_url = reverse('user-login')
+        User.objects.create_user(username='target', password='testpassword')
+
+    def login(self, username, **extra):
+        return self.client.post(self.login_url, {'username': username, 'password': 'wrong'}, format='json', **extra)
+
+    @mock.patch.dict(SimpleRateThrottle.THROTTLE_RATES, {'login_username': '2/min'})
+    def test_logins_are_throttled_per_username(self):
+        # Different addresses, the same (case insensitive) username
+        self.assertEqual(self.login('target', REMOTE_ADDR='10.0.0.1').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.login('TARGET', REMOTE_ADDR='10.0.0.2').status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.login('target', REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.login('someone-else').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @mock.patch.dict(SimpleRateThrottle.THROTTLE_RATES, {'login_ip': '2/min'})
+    def test_logins_are_throttled_per_ip(self):
+        self.assertEqual(self.login('first').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.login('second').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.login('third').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.login('third', REMOTE_ADDR='10.0.0.9').status_code, status.HTTP_401_UNAUTHORIZED)
+
+class AuthenticationQueryBudgetTest(QueryBudgetTestCase):
+    def test_user_registration_queries(self):
+        self.assertEndpointQueries('user-registration', 2)
+
+    def test_user_login_queries(self):
+        self.assertEndpointQueries('user-login', 1)
+
 # {
 #     "username": "testuser",
 #     "password": "testpassword"
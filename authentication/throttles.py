@@ -0,0 +1,44 @@
+import hashlib
+
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class ScopedIdentThrottle(SimpleRateThrottle):
+    """
+    Counts requests per scope and per identifier in the default cache, with the
+    rates of REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'].
+    """
+
+    def get_ident_value(self, request):
+        return self.get_ident(request)
+
+    @classmethod
+    def cache_key_for(cls, ident):
+        return cls.cache_format % {'scope': cls.scope, 'ident': ident}
+
+    def get_cache_key(self, request, view):
+        ident = self.get_ident_value(request)
+        return None if ident is None else self.cache_key_for(ident)
+
+
+class LoginIPThrottle(ScopedIdentThrottle):
+    scope = 'login_ip'
+
+
+class LoginUsernameThrottle(ScopedIdentThrottle):
+    scope = 'login_username'
+
+    def get_ident_value(self, request):
+        username = request.data.get('username')
+        if not isinstance(username, str) or not username:
+            return None
+        return username
+
+    @classmethod
+    def cache_key_for(cls, ident):
+        # Usernames may contain characters that are not valid in cache keys
+        return super().cache_key_for(hashlib.sha256(ident.lower().encode()).hexdigest())
+
+
+class RegistrationThrottle(ScopedIdentThrottle):
+    scope = 'registration'
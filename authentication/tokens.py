@@ -0,0 +1,96 @@
+"""
+Stateless JWT authentication.
+
+Access tokens carry the claims the API needs about their user (id, username and
+staff flags), so StatelessJWTAuthentication builds a TokenUser from the verified
+token instead of loading the user row on every request. What the claims cannot
+tell is covered by two optional cache lookups, done in one round trip:
+
+- with AUTH_JWT_CHECK_REVOCATION, tokens issued before revoke_user_tokens() was
+  called for their user are refused;
+- with AUTH_JWT_USER_CACHE_TIMEOUT > 0, requests get the real User instead, kept
+  in the cache for that many seconds (one query on a miss), so a deactivated
+  user is refused within that delay. Only USER_CACHE_FIELDS are cached, never the
+  password hash; the other fields of a cached user are loaded if they are used.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+# What the request path reads from the user
+USER_CACHE_FIELDS = ('id', 'username', 'is_active', 'is_staff', 'is_superuser')
+
+
+def revoked_cache_key(user_id):
+    return f'auth:revoked:{user_id}'
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def tokens_for_user(user):
+    refresh = RefreshToken.for_user(user)
+    # Custom claims are copied into the access token and read back by TokenUser
+    refresh['username'] = user.username
+    refresh['is_staff'] = user.is_staff
+    refresh['is_superuser'] = user.is_superuser
+    return {'refresh': str(refresh), 'access': str(refresh.access_token)}
+
+
+def revoke_user_tokens(user_id):
+    """
+    Refuses every token issued to the user so far. "iat" only has a precision of
+    one second, so tokens issued in the same second as the revocation are refused
+    too. The marker is kept as long as a revoked token could still be valid.
+    """
+    lifetime = max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME)
+    cache.set(revoked_cache_key(user_id), math.ceil(time.time()), timeout=int(lifetime.total_seconds()))
+    cache.delete(user_cache_key(user_id))
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        keys = []
+        if settings.AUTH_JWT_CHECK_REVOCATION:
+            keys.append(revoked_cache_key(user_id))
+        if settings.AUTH_JWT_USER_CACHE_TIMEOUT:
+            keys.append(user_cache_key(user_id))
+        cached = cache.get_many(keys) if keys else {}
+
+        revoked_at = cached.get(revoked_cache_key(user_id))
+        if revoked_at is not None and validated_token.get('iat', 0) < revoked_at:
+            raise AuthenticationFailed(_('Token has been revoked'), code='token_revoked')
+
+        if not settings.AUTH_JWT_USER_CACHE_TIMEOUT:
+            return TokenUser(validated_token)
+
+        fields = cached.get(user_cache_key(user_id))
+        if not isinstance(fields, dict):
+            # Refuses missing and inactive users, which are therefore never cached
+            user = super().get_user(validated_token)
+            fields = {name: getattr(user, name) for name in USER_CACHE_FIELDS}
+            cache.set(user_cache_key(user_id), fields, timeout=settings.AUTH_JWT_USER_CACHE_TIMEOUT)
+            return user
+        # The fields that are not cached are deferred, so saving the user cannot blank them.
+        # from_db() takes the values in the order of the model's fields.
+        User = get_user_model()
+        names = [field.attname for field in User._meta.concrete_fields if field.attname in fields]
+        return User.from_db(DEFAULT_DB_ALIAS, names, [fields[name] for name in names])
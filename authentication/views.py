@@ -1,35 +1,37 @@
 from django.contrib.auth import get_user_model
-from django.contrib.auth import authenticate, login
+from django.contrib.auth import authenticate
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
+from .hashing import hashing_slot
 from .serializers import UserSerializer
+from .throttles import LoginIPThrottle, LoginUsernameThrottle, RegistrationThrottle
+from .tokens import tokens_for_user
 
 User = get_user_model()
 
 class UserRegistrationView(APIView):
+    throttle_classes = [RegistrationThrottle]
+
     def post(self, request):
         serializer = UserSerializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save()
-            refresh = RefreshToken.for_user(user)
-            return Response({
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-            }, status=status.HTTP_201_CREATED)
+            with hashing_slot():
+                user = serializer.save()
+            return Response(tokens_for_user(user), status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class UserLoginView(APIView):
+    # Throttles are checked before the password is hashed
+    throttle_classes = [LoginIPThrottle, LoginUsernameThrottle]
+
     def post(self, request):
         username = request.data.get('username')
         password = request.data.get('password')
-        user = authenticate(request, username=username, password=password)
+        # Also rehashes the password when the configured hasher or its cost changed
+        with hashing_slot():
+            user = authenticate(request, username=username, password=password)
         if user:
-            login(request, user)
-            refresh = RefreshToken.for_user(user)
-            return Response({
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-            }, status=status.HTTP_200_OK)
-        return Response({'detail': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+            # No session is created: the API is authenticated by the returned tokens only
+            return Response(tokens_for_user(user), status=status.HTTP_200_OK)
+        return Response({'detail': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,203 @@
+"""
+In-process request metrics exposed in the Prometheus text format.
+
+RequestMetricsMiddleware records, per URL name, the wall time, number of database
+queries, time spent in the database, cache hits and misses and response size of
+every request into histograms kept in memory (one set per process), and logs the
+requests that go over REQUEST_QUERY_BUDGET or REQUEST_LATENCY_BUDGET_MS.
+The histograms are served by metrics_view at /metrics, to scrapers sending
+METRICS_TOKEN as a bearer token.
+"""
+import contextvars
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('Wall time of the request.', LATENCY_BUCKETS),
+    'http_request_db_queries': ('Number of database queries run by the request.', QUERY_COUNT_BUCKETS),
+    'http_request_db_duration_seconds': ('Time spent in database queries.', LATENCY_BUCKETS),
+    'http_response_size_bytes': ('Size of the response body.', SIZE_BUCKETS),
+}
+COUNTERS = {
+    'http_requests_total': 'Number of requests.',
+    'http_request_cache_hits_total': 'Cache hits during requests.',
+    'http_request_cache_misses_total': 'Cache misses during requests.',
+}
+
+_current_stats = contextvars.ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('start', 'queries', 'db_time', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def record(self, view, status_code, wall_time, stats, size):
+        observations = {
+            'http_request_duration_seconds': wall_time,
+            'http_request_db_queries': stats.queries,
+            'http_request_db_duration_seconds': stats.db_time,
+        }
+        if size is not None:
+            observations['http_response_size_bytes'] = size
+
+        with self.lock:
+            for name, value in observations.items():
+                histogram = self.histograms.get((name, view))
+                if histogram is None:
+                    histogram = self.histograms[(name, view)] = Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+            for name, labels, value in (
+                ('http_requests_total', (view, status_code), 1),
+                ('http_request_cache_hits_total', (view,), stats.cache_hits),
+                ('http_request_cache_misses_total', (view,), stats.cache_misses),
+            ):
+                self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (help_text, buckets) in HISTOGRAMS.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (metric, view), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(list(buckets) + ['+Inf'], histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{view="{view}"}} {histogram.sum}')
+                    lines.append(f'{name}_count{{view="{view}"}} {histogram.count}')
+            for name, help_text in COUNTERS.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for (metric, labels), value in sorted(self.counters.items()):
+                    if metric != name:
+                        continue
+                    label_text = f'view="{labels[0]}"'
+                    if len(labels) > 1:
+                        label_text += f',status="{labels[1]}"'
+                    lines.append(f'{name}{{{label_text}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def record_cache_access(hits=0, misses=0):
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.cache_hits += hits
+        stats.cache_misses += misses
+
+
+def _count_query(execute, sql, params, many, context):
+    stats = _current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - start
+
+
+def install_query_counter(connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(install_query_counter)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match.url_name or 'unnamed'
+
+
+class RequestMetricsMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        # Connections opened before this module was imported don't have the counter yet
+        for connection in connections.all(initialized_only=True):
+            install_query_counter(connection)
+        request._metrics = RequestStats()
+        _current_stats.set(request._metrics)
+
+    def process_response(self, request, response):
+        stats = getattr(request, '_metrics', None)
+        if stats is None:
+            return response
+        _current_stats.set(None)
+
+        wall_time = time.perf_counter() - stats.start
+        size = None if response.streaming else len(response.content)
+        view = _view_name(request)
+        registry.record(view, response.status_code, wall_time, stats, size)
+
+        if stats.queries > settings.REQUEST_QUERY_BUDGET or wall_time * 1000 > settings.REQUEST_LATENCY_BUDGET_MS:
+            logger.warning(
+                'Request over budget: %s %s (%s) took %.1f ms with %d queries (%.1f ms in the database)',
+                request.method, request.path, view, wall_time * 1000, stats.queries, stats.db_time * 1000,
+            )
+        return response
+
+
+def metrics_view(request):
+    # Disabled without a token
+    if not settings.METRICS_TOKEN:
+        raise Http404
+    expected = f'Bearer {settings.METRICS_TOKEN}'
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected.encode()):
+        response = HttpResponse('Send METRICS_TOKEN as a bearer token.', status=401, content_type='text/plain')
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -10,12 +10,17 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 
+def env_bool(name, default=False):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/3.1/howto/deployment/checklist/
 
@@ -45,10 +50,43 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authentication.tokens.StatelessJWTAuthentication',
     ),
+    # Login and registration attempts, counted in the default (Redis) cache; see authentication/throttles.py
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': os.environ.get('AUTH_LOGIN_IP_RATE', '30/min'),
+        'login_username': os.environ.get('AUTH_LOGIN_USERNAME_RATE', '10/min'),
+        'registration': os.environ.get('AUTH_REGISTRATION_RATE', '10/min'),
+    },
 }
 
+# Request users are built from the access token claims (authentication/tokens.py).
+# Refuse tokens revoked with revoke_user_tokens(), at the cost of one cache read per request
+AUTH_JWT_CHECK_REVOCATION = env_bool('AUTH_JWT_CHECK_REVOCATION', True)
+# Seconds to cache the real User for, instead of trusting the claims; 0 disables it
+AUTH_JWT_USER_CACHE_TIMEOUT = int(os.environ.get('AUTH_JWT_USER_CACHE_TIMEOUT', 0))
+
+# Password hashing (authentication/hashers.py). AUTH_PASSWORD_HASHER=argon2 needs argon2-cffi;
+# passwords hashed with another algorithm or cost are rehashed on the next login
+AUTH_PASSWORD_HASHER = os.environ.get('AUTH_PASSWORD_HASHER', 'pbkdf2')
+AUTH_PBKDF2_ITERATIONS = int(os.environ.get('AUTH_PBKDF2_ITERATIONS', 390000))
+AUTH_ARGON2_TIME_COST = int(os.environ.get('AUTH_ARGON2_TIME_COST', 2))
+AUTH_ARGON2_MEMORY_COST = int(os.environ.get('AUTH_ARGON2_MEMORY_COST', 102400))  # KiB
+AUTH_ARGON2_PARALLELISM = int(os.environ.get('AUTH_ARGON2_PARALLELISM', 8))
+_PASSWORD_HASHERS = {
+    'pbkdf2': 'authentication.hashers.TunablePBKDF2PasswordHasher',
+    'argon2': 'authentication.hashers.TunableArgon2PasswordHasher',
+}
+PASSWORD_HASHERS = [
+    _PASSWORD_HASHERS[AUTH_PASSWORD_HASHER],
+    *(hasher for name, hasher in _PASSWORD_HASHERS.items() if name != AUTH_PASSWORD_HASHER),
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+# Passwords hashed at the same time per process, and seconds to wait for a free slot before answering 503
+AUTH_HASHING_CONCURRENCY = int(os.environ.get('AUTH_HASHING_CONCURRENCY', 2))
+AUTH_HASHING_TIMEOUT = float(os.environ.get('AUTH_HASHING_TIMEOUT', 2))
+
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 CACHES = {
@@ -61,10 +99,36 @@ CACHES = {
     }
 }
 
+# Cached book API responses are invalidated on write, so they can be kept for long
+BOOKS_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Maximum number of items accepted by the section and subsection bulk endpoints
+BOOKS_BULK_MAX_ITEMS = 5000
+
+# Background jobs (books/jobs.py), run by `python manage.py run_jobs`
+BOOKS_JOB_OUTPUT_DIR = os.environ.get('BOOKS_JOB_OUTPUT_DIR', BASE_DIR / 'job_output')
+BOOKS_JOB_MAX_ATTEMPTS = 3
+# Seconds before the first retry, doubled for every further attempt
+BOOKS_JOB_RETRY_DELAY = 30
+# Seconds result files of finished jobs (exports) are kept for
+BOOKS_JOB_RESULT_TTL = 7 * 24 * 60 * 60
+# Seconds between the heartbeats of a worker running a job
+BOOKS_JOB_HEARTBEAT_INTERVAL = 30
+# Seconds without a heartbeat after which a running job is assumed lost and queued again
+BOOKS_JOB_TIMEOUT = 5 * 60
+# Books with more subsections than this are deleted by a background job
+BOOKS_SYNC_DELETE_MAX_NODES = 5000
+# Books with more subsections than this are duplicated by a background job
+BOOKS_SYNC_DUPLICATE_MAX_NODES = 5000
+
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "default"
 
+# Runs the tests against a local-memory cache instead of the Redis database above
+TEST_RUNNER = 'backend.testing.TestRunner'
+
 MIDDLEWARE = [
+    'backend.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,6 +138,12 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Requests above these budgets are logged by backend.metrics.RequestMetricsMiddleware
+REQUEST_QUERY_BUDGET = 50
+REQUEST_LATENCY_BUDGET_MS = 500
+# Bearer token required to read /metrics, which is disabled without one
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
@@ -98,12 +168,35 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Set DB_ENGINE=postgresql to use PostgreSQL, SQLite stays the default
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'books'),
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Keep connections open between requests instead of reconnecting every time
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+            'CONN_HEALTH_CHECKS': env_bool('DB_CONN_HEALTH_CHECKS', True),
+            # Transaction pooling (DB_POOLER=pgbouncer) cannot keep server side cursors open across transactions
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_POOLER') == 'pgbouncer',
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
     }
-}
 
 
 # Password validation
@@ -0,0 +1,96 @@
+"""
+Query-count guards for the test suite.
+
+QueryBudgetTestCase seeds a realistic dataset once per test class (many books,
+sections, collaborators and a deep subsection tree, see books/benchmark.py) and
+provides assertMaxQueries(). Budgets are constants checked against that dataset,
+so a query that starts running once per row (an N+1) goes over the budget instead
+of slipping through with a one-book fixture.
+
+TestRunner swaps the configured cache for a local-memory one, so the cache.clear()
+calls in setUp never flush the Redis database holding the runtime cache and
+sessions, and the suite runs without Redis.
+"""
+import re
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import TestCase
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext, override_settings
+
+NUMBER_RE = re.compile(r"\b\d+\b|'[^']*'")
+
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'},
+}
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_caches = override_settings(CACHES=TEST_CACHES)
+        self.test_caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_caches.disable()
+        super().teardown_test_environment(**kwargs)
+
+
+def normalize_sql(sql):
+    # Collapses literals so the same query run for different rows is counted together
+    return NUMBER_RE.sub('?', sql)
+
+
+class _AssertMaxQueriesContext(CaptureQueriesContext):
+    def __init__(self, test_case, limit, connection):
+        self.test_case = test_case
+        self.limit = limit
+        super().__init__(connection)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None or len(self) <= self.limit:
+            return
+
+        repeated = Counter(normalize_sql(query['sql']) for query in self.captured_queries)
+        lines = [f'{len(self)} queries executed, at most {self.limit} expected.', 'Repeated queries:']
+        lines += [f'  {count} x {sql}' for sql, count in repeated.most_common() if count > 1] or ['  (none)']
+        lines.append('Captured queries were:')
+        lines += [f'{i}. {query["sql"]}' for i, query in enumerate(self.captured_queries, start=1)]
+        self.test_case.fail('\n'.join(lines))
+
+
+class QueryBudgetMixin:
+    def assertMaxQueries(self, limit, using=DEFAULT_DB_ALIAS):
+        return _AssertMaxQueriesContext(self, limit, connections[using])
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    # Each author owns three books and collaborates on several more
+    fixture_scale = {'users': 4, 'books': 12, 'collaborators': 2, 'sections': 4, 'depth': 3, 'width': 3}
+
+    @classmethod
+    def setUpTestData(cls):
+        from books.benchmark import seed_benchmark_data
+        cls.seeded = seed_benchmark_data(**cls.fixture_scale)
+
+    def setUp(self):
+        from books.benchmark import BenchmarkContext
+        cache.clear()
+        self.context = BenchmarkContext()
+
+    def assertEndpointQueries(self, name, limit):
+        """
+        Runs the benchmark case `name` once and checks it stays within `limit` queries.
+        """
+        from books.benchmark import BENCHMARKS
+        func, setup = BENCHMARKS[name]
+        request = func(self.context, **(setup(self.context) if setup else {}))
+        with self.assertMaxQueries(limit):
+            response = request()
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, name)
+        return response
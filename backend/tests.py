@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from books.models import Book
+from .metrics import registry
+
+
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='author', password='password123')
+        self.book = Book.objects.create(title='Test Book', author=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def test_metrics_are_recorded_per_url_name(self):
+        self.client.get(f'/api/books/{self.book.id}/')
+        self.client.get('/api/books/')
+        self.client.get('/api/books/')
+
+        with self.settings(METRICS_TOKEN='scraper'):
+            metrics = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scraper').content.decode()
+        self.assertIn('http_request_duration_seconds_count{view="book-detail"} 1', metrics)
+        self.assertIn('http_requests_total{view="book-list-create",status="200"} 2', metrics)
+        self.assertIn('http_request_db_queries_count{view="book-list-create"} 2', metrics)
+        # The second book list request is served from the cache
+        self.assertIn('http_request_cache_hits_total{view="book-list-create"} 1', metrics)
+        self.assertIn('http_request_db_queries_bucket{view="book-detail",le="+Inf"} 1', metrics)
+
+    def test_query_count_is_recorded(self):
+        self.client.get(f'/api/books/{self.book.id}/')
+        histogram = registry.histograms[('http_request_db_queries', 'book-detail')]
+        self.assertEqual(histogram.count, 1)
+        self.assertGreater(histogram.sum, 0)
+
+    def test_metrics_require_the_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with self.settings(METRICS_TOKEN='scraper'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer guess').status_code, 401)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scraper').status_code, 200)
+
+    @override_settings(REQUEST_QUERY_BUDGET=0)
+    def test_requests_over_budget_are_logged(self):
+        with self.assertLogs('backend.metrics', level='WARNING') as logs:
+            self.client.get(f'/api/books/{self.book.id}/')
+        self.assertIn('book-detail', logs.output[0])
@@ -0,0 +1,123 @@
+"""
+Async variants of the read endpoints, for deployments running under an ASGI server.
+
+DRF's APIView is synchronous, so these are plain Django async views that reuse
+the configured DRF authentication classes and the same role checks as the
+synchronous views. Django's async ORM still runs each query in a worker thread,
+so work that needs several queries (building a list page) is done in a single
+hop to a thread instead of one per query.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import JsonResponse
+from django.views import View
+from rest_framework import exceptions, status
+from rest_framework.settings import api_settings
+from .cache import aget_cached, amake_cache_key, aset_cached
+from .conditional import book_validators, not_modified, set_validators
+from .listing import book_list_page
+from .models import Book, Section, Subsection
+from .permissions import aresolve_book_role
+from .serializers import BookSerializer, SectionSerializer, SubsectionSerializer
+from .tree import book_sections, book_subsections, nest_book_tree
+
+User = get_user_model()
+
+
+class AsyncAPIView(View):
+    http_method_names = ['get', 'head', 'options']
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            user = await sync_to_async(self.authenticate)(request)
+        except exceptions.AuthenticationFailed as e:
+            return JsonResponse({'detail': str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+        if user is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=status.HTTP_401_UNAUTHORIZED)
+        request.user = user
+
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as e:
+            return JsonResponse(e.detail if isinstance(e.detail, dict) else {'detail': str(e.detail)}, status=e.status_code)
+
+    def authenticate(self, request):
+        for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+            result = authentication_class().authenticate(request)
+            if result is not None:
+                return result[0]
+        return None
+
+    async def check_book_permission(self, request, book_id):
+        if await aresolve_book_role(request, book_id) is None:
+            raise exceptions.PermissionDenied()
+
+    async def get_or_404(self, queryset, pk):
+        try:
+            return await queryset.aget(pk=pk)
+        except queryset.model.DoesNotExist:
+            raise exceptions.NotFound()
+
+
+async def prefetch_collaborators(book):
+    # Only loaded once the response is known to be needed
+    await sync_to_async(prefetch_related_objects)([book], Prefetch('collaborators', queryset=User.objects.only('id')))
+
+
+class AsyncBookListView(AsyncAPIView):
+    async def get(self, request):
+        # Same cache as BookListCreateView, but its own entries: the key and the page's links use this URL
+        cache_key = await amake_cache_key('book_list', request.user, request.build_absolute_uri())
+        data = await aget_cached(cache_key)
+        if data is None:
+            try:
+                data = await sync_to_async(book_list_page)(request.user, request.GET, request.build_absolute_uri())
+            except exceptions.ValidationError as e:
+                return JsonResponse(e.detail, status=status.HTTP_400_BAD_REQUEST)
+            await aset_cached(cache_key, data)
+        return JsonResponse(data)
+
+
+class AsyncBookDetailView(AsyncAPIView):
+    async def get(self, request, pk):
+        book = await self.get_or_404(Book.objects.all(), pk)
+        await self.check_book_permission(request, book.pk)
+        validators = book_validators(book)
+        response = not_modified(request, validators)
+        if response is not None:
+            return set_validators(response, validators)
+
+        await prefetch_collaborators(book)
+        return set_validators(JsonResponse(BookSerializer(book).data), validators)
+
+
+class AsyncBookTreeView(AsyncAPIView):
+    async def get(self, request, pk):
+        book = await self.get_or_404(Book.objects.all(), pk)
+        await self.check_book_permission(request, book.pk)
+        validators = book_validators(book)
+        response = not_modified(request, validators)
+        if response is not None:
+            return set_validators(response, validators)
+
+        await prefetch_collaborators(book)
+        sections = [section async for section in book_sections(book)]
+        subsections = [subsection async for subsection in book_subsections(book)]
+        return set_validators(JsonResponse(nest_book_tree(BookSerializer(book).data, sections, subsections)), validators)
+
+
+class AsyncSectionDetailView(AsyncAPIView):
+    async def get(self, request, pk):
+        section = await self.get_or_404(Section.objects.select_related('book'), pk)
+        await self.check_book_permission(request, section.book_id)
+        validators = book_validators(section.book)
+        return set_validators(not_modified(request, validators) or JsonResponse(SectionSerializer(section).data), validators)
+
+
+class AsyncSubsectionDetailView(AsyncAPIView):
+    async def get(self, request, pk):
+        subsection = await self.get_or_404(Subsection.objects.select_related('section__book'), pk)
+        await self.check_book_permission(request, subsection.section.book_id)
+        validators = book_validators(subsection.section.book)
+        return set_validators(not_modified(request, validators) or JsonResponse(SubsectionSerializer(subsection).data), validators)
@@ -0,0 +1,402 @@
+"""
+Synthetic data and benchmark cases for the books and authentication APIs.
+
+seed_benchmark_data() builds a dataset of a given shape with bulk inserts.
+Every function registered with @benchmark measures one endpoint. It receives the
+BenchmarkContext and returns a callable that performs a single request; an
+optional `setup` creates whatever each run consumes (e.g. the object a DELETE
+removes) outside of the measured time. run_benchmarks() runs them all and
+returns machine-readable results (see the `benchmark` management command).
+"""
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from authentication.throttles import LoginIPThrottle, LoginUsernameThrottle, RegistrationThrottle
+from .bulk import create_subsections
+from .cache import bump_generation
+from .jobs import enqueue
+from .models import Book, Section, Subsection
+from .ordering import POSITION_GAP
+from .search import index_objects
+
+User = get_user_model()
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+BENCHMARKS = {}
+
+
+def benchmark(name, setup=None):
+    def register(func):
+        BENCHMARKS[name] = (func, setup)
+        return func
+    return register
+
+
+def seed_benchmark_data(users=10, books=20, collaborators=3, sections=5, depth=3, width=2, seed=0):
+    """
+    Creates `users` users and `books` books spread over them, each book with
+    `collaborators` collaborators and `sections` sections. Every section holds a
+    subsection tree `depth` levels deep where each node has `width` children.
+    """
+    rng = random.Random(seed)
+    password = make_password(BENCHMARK_PASSWORD)
+    created_users = User.objects.bulk_create([
+        User(username=f'bench-user-{i}', email=f'bench-user-{i}@example.com', password=password)
+        for i in range(users)
+    ])
+
+    created_books = Book.objects.bulk_create([
+        Book(title=f'Benchmark book {i}', author=created_users[i % users])
+        for i in range(books)
+    ])
+    Through = Book.collaborators.through
+    Through.objects.bulk_create([
+        Through(book_id=book.pk, user_id=user.pk)
+        for book in created_books
+        for user in rng.sample([u for u in created_users if u.pk != book.author_id], min(collaborators, users - 1))
+    ])
+
+    created_sections = Section.objects.bulk_create([
+        Section(title=f'Section {i} of book {book.pk}', book=book, position=(i + 1) * POSITION_GAP)
+        for book in created_books
+        for i in range(sections)
+    ])
+
+    subsections = []
+    for section in created_sections:
+        level = [None]
+        for current_depth in range(depth):
+            next_level = []
+            for parent in level:
+                for i in range(width):
+                    subsection = Subsection(title=f'Subsection {current_depth}.{i} of section {section.pk}', section=section)
+                    subsection._batch_depth = current_depth
+                    subsection._parent_ref = parent
+                    next_level.append(subsection)
+            subsections.extend(next_level)
+            level = next_level
+    create_subsections(subsections)
+
+    index_objects(created_books)
+    index_objects(created_sections)
+    index_objects(subsections)
+    bump_generation()
+
+    return {
+        'users': len(created_users),
+        'books': len(created_books),
+        'sections': len(created_sections),
+        'subsections': len(subsections),
+    }
+
+
+class BenchmarkContext:
+    def __init__(self):
+        self.author = User.objects.filter(books__isnull=False).order_by('pk').first()
+        self.book = Book.objects.filter(author=self.author).order_by('pk').first()
+        self.section = Section.objects.filter(book=self.book).order_by('pk').first()
+        self.subsection = Subsection.objects.filter(section=self.section).order_by('-depth', 'pk').first()
+        self.outsider = User.objects.exclude(pk=self.author.pk).exclude(collaborating_books=self.book).order_by('pk').first()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.author).access_token}')
+        self.anonymous_client = APIClient()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def run_benchmark(name, context, iterations):
+    func, setup = BENCHMARKS[name]
+    durations = []
+    queries = []
+    status_codes = set()
+    for _ in range(iterations):
+        kwargs = setup(context) if setup else {}
+        request = func(context, **kwargs)
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = request()
+            # Streaming responses are only produced while being consumed
+            if getattr(response, 'streaming', False):
+                for _ in response.streaming_content:
+                    pass
+            durations.append(time.perf_counter() - start)
+        queries.append(len(captured.captured_queries))
+        status_codes.add(response.status_code)
+
+    total = sum(durations)
+    return {
+        'name': name,
+        'iterations': iterations,
+        'status_codes': sorted(status_codes),
+        'throughput_rps': iterations / total if total else None,
+        'latency_ms': {
+            'mean': statistics.mean(durations) * 1000,
+            'p50': percentile(durations, 0.5) * 1000,
+            'p90': percentile(durations, 0.9) * 1000,
+            'p99': percentile(durations, 0.99) * 1000,
+            'max': max(durations) * 1000,
+        },
+        'queries': {'min': min(queries), 'max': max(queries), 'mean': statistics.mean(queries)},
+    }
+
+
+def run_benchmarks(iterations=20, names=None):
+    context = BenchmarkContext()
+    return [run_benchmark(name, context, iterations) for name in BENCHMARKS if not names or name in names]
+
+
+def _new_section(context):
+    return {'section': Section.objects.create(title='Disposable section', book=context.book)}
+
+
+def _new_book(context):
+    book = Book.objects.create(title='Disposable book', author=context.author)
+    section = Section.objects.create(title='Disposable section', book=book)
+    parent = Subsection.objects.create(title='Disposable subsection', section=section)
+    Subsection.objects.create(title='Disposable child', section=section, parent_subsection=parent)
+    return {'book': book}
+
+
+def _new_subsection(context):
+    return {'subsection': Subsection.objects.create(title='Disposable subsection', section=context.section)}
+
+
+def _new_job(context):
+    return {'job': enqueue('warm_cache', context.author, {'url': 'http://testserver/api/books/'})}
+
+
+def _new_collaborator(context):
+    context.book.collaborators.remove(context.outsider)
+    return {}
+
+
+def _existing_collaborator(context):
+    context.book.collaborators.add(context.outsider)
+    return {}
+
+
+def _reset_throttles(context):
+    # Every iteration comes from the same client, which the auth throttles would otherwise stop
+    cache.delete_many([
+        LoginIPThrottle.cache_key_for('127.0.0.1'),
+        LoginUsernameThrottle.cache_key_for(context.author.username),
+        RegistrationThrottle.cache_key_for('127.0.0.1'),
+    ])
+    return {}
+
+
+def _new_user(context):
+    _new_user.counter = getattr(_new_user, 'counter', 0) + 1
+    _reset_throttles(context)
+    return {'username': f'bench-registered-{_new_user.counter}'}
+
+
+@benchmark('book-list-create:get')
+def book_list(context):
+    return lambda: context.client.get('/api/books/')
+
+
+@benchmark('book-list-create:get-role')
+def book_list_role(context):
+    return lambda: context.client.get('/api/books/', {'role': 'any'})
+
+
+@benchmark('book-list-create:post')
+def book_create(context):
+    return lambda: context.client.post('/api/books/', {'title': 'Benchmark book'})
+
+
+@benchmark('library-export')
+def library_export(context):
+    return lambda: context.client.get('/api/books/export/')
+
+
+@benchmark('book-detail:get')
+def book_detail(context):
+    return lambda: context.client.get(f'/api/books/{context.book.pk}/')
+
+
+@benchmark('book-detail:put')
+def book_update(context):
+    return lambda: context.client.put(f'/api/books/{context.book.pk}/', {'title': context.book.title, 'author': context.author.pk})
+
+
+@benchmark('book-detail:delete', setup=_new_book)
+def book_delete(context, book):
+    return lambda: context.client.delete(f'/api/books/{book.pk}/')
+
+
+@benchmark('book-duplicate')
+def book_duplicate(context):
+    return lambda: context.client.post(f'/api/books/{context.book.pk}/duplicate/', {}, format='json')
+
+
+@benchmark('book-export')
+def book_export(context):
+    return lambda: context.client.get(f'/api/books/{context.book.pk}/export/')
+
+
+@benchmark('book-tree')
+def book_tree(context):
+    return lambda: context.client.get(f'/api/books/{context.book.pk}/tree/')
+
+
+@benchmark('book-changes')
+def book_changes(context):
+    # A full page of changes, whatever the benchmarks before it wrote
+    return lambda: context.client.get(f'/api/books/{context.book.pk}/changes/', {'since': 0})
+
+
+@benchmark('section-list-create')
+def section_create(context):
+    return lambda: context.client.post('/api/sections/', {'book': context.book.pk, 'title': 'Benchmark section'})
+
+
+@benchmark('section-bulk')
+def section_bulk(context):
+    creates = [{'book': context.book.pk, 'title': f'Bulk section {i}'} for i in range(50)]
+    return lambda: context.client.post('/api/sections/bulk/', {'create': creates}, format='json')
+
+
+@benchmark('section-detail:get')
+def section_detail(context):
+    return lambda: context.client.get(f'/api/sections/{context.section.pk}/')
+
+
+@benchmark('section-detail:put')
+def section_update(context):
+    # Repeated, so any version is accepted (still written with the conditional UPDATE)
+    return lambda: context.client.put(f'/api/sections/{context.section.pk}/', {'title': context.section.title}, HTTP_IF_MATCH='*')
+
+
+@benchmark('section-detail:delete', setup=_new_section)
+def section_delete(context, section):
+    return lambda: context.client.delete(f'/api/sections/{section.pk}/')
+
+
+@benchmark('section-move')
+def section_move(context):
+    return lambda: context.client.post(f'/api/sections/{context.section.pk}/move/', {}, format='json')
+
+
+@benchmark('subsection-list-create')
+def subsection_create(context):
+    return lambda: context.client.post('/api/subsections/', {'section': context.section.pk, 'title': 'Benchmark subsection'})
+
+
+@benchmark('subsection-bulk')
+def subsection_bulk(context):
+    creates = [{'section': context.section.pk, 'title': 'Bulk root'}]
+    creates += [{'section': context.section.pk, 'title': f'Bulk child {i}', 'parent_ref': 0} for i in range(49)]
+    return lambda: context.client.post('/api/subsections/bulk/', {'create': creates}, format='json')
+
+
+@benchmark('subsection-detail:get')
+def subsection_detail(context):
+    return lambda: context.client.get(f'/api/subsections/{context.subsection.pk}/')
+
+
+@benchmark('subsection-detail:put')
+def subsection_update(context):
+    return lambda: context.client.put(f'/api/subsections/{context.subsection.pk}/', {'title': context.subsection.title}, HTTP_IF_MATCH='*')
+
+
+@benchmark('subsection-detail:delete', setup=_new_subsection)
+def subsection_delete(context, subsection):
+    return lambda: context.client.delete(f'/api/subsections/{subsection.pk}/')
+
+
+@benchmark('subsection-move', setup=_new_subsection)
+def subsection_move(context, subsection):
+    first = Subsection.objects.filter(section=context.section, parent_subsection=None).order_by('position').first()
+    return lambda: context.client.post(f'/api/subsections/{subsection.pk}/move/', {'before': first.pk}, format='json')
+
+
+@benchmark('book-collaborators:get')
+def book_collaborators(context):
+    return lambda: context.client.get(f'/api/books/{context.book.pk}/collaborators/')
+
+
+@benchmark('book-collaborators:post', setup=_new_collaborator)
+def book_collaborators_update(context):
+    data = {'add': [context.outsider.username], 'remove': [context.book.author_id]}
+    return lambda: context.client.post(f'/api/books/{context.book.pk}/collaborators/', data, format='json')
+
+
+@benchmark('add-collaborator', setup=_new_collaborator)
+def add_collaborator(context):
+    return lambda: context.client.post(f'/api/books/{context.book.pk}/add-collaborator/{context.outsider.pk}/')
+
+
+@benchmark('remove-collaborator', setup=_existing_collaborator)
+def remove_collaborator(context):
+    return lambda: context.client.post(f'/api/books/{context.book.pk}/remove-collaborator/{context.outsider.pk}/')
+
+
+@benchmark('search')
+def search(context):
+    return lambda: context.client.get('/api/search/', {'q': 'subsection'})
+
+
+@benchmark('job-list-create:get')
+def job_list(context):
+    return lambda: context.client.get('/api/jobs/')
+
+
+@benchmark('job-list-create:post')
+def job_create(context):
+    return lambda: context.client.post('/api/jobs/', {'kind': 'warm_cache'}, format='json')
+
+
+@benchmark('job-detail', setup=_new_job)
+def job_detail(context, job):
+    return lambda: context.client.get(f'/api/jobs/{job.pk}/')
+
+
+@benchmark('async-book-list')
+def async_book_list(context):
+    return lambda: context.client.get('/api/async/books/')
+
+
+@benchmark('async-book-detail')
+def async_book_detail(context):
+    return lambda: context.client.get(f'/api/async/books/{context.book.pk}/')
+
+
+@benchmark('async-book-tree')
+def async_book_tree(context):
+    return lambda: context.client.get(f'/api/async/books/{context.book.pk}/tree/')
+
+
+@benchmark('async-section-detail')
+def async_section_detail(context):
+    return lambda: context.client.get(f'/api/async/sections/{context.section.pk}/')
+
+
+@benchmark('async-subsection-detail')
+def async_subsection_detail(context):
+    return lambda: context.client.get(f'/api/async/subsections/{context.subsection.pk}/')
+
+
+@benchmark('user-registration', setup=_new_user)
+def user_registration(context, username):
+    data = {'username': username, 'email': f'{username}@example.com', 'password': BENCHMARK_PASSWORD}
+    return lambda: context.anonymous_client.post('/api/auth/register/', data, format='json')
+
+
+@benchmark('user-login', setup=_reset_throttles)
+def user_login(context):
+    data = {'username': context.author.username, 'password': BENCHMARK_PASSWORD}
+    return lambda: context.anonymous_client.post('/api/auth/login/', data, format='json')
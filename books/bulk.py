@@ -0,0 +1,404 @@
+"""
+Batch create/update/delete of sections and subsections.
+
+A batch looks like::
+
+    {"create": [{...}, ...], "update": [{"id": 1, "title": "...", "version": 4}, ...], "delete": [2, 3]}
+
+Every item is validated up front with a fixed number of queries for the whole
+batch (one of them resolving the user's role on every book involved). If any item
+fails nothing is written, otherwise all writes happen in a single transaction
+using bulk_create/bulk_update. Each operation returns one result per item.
+An update that names a version is only written while the row still has it.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import status
+from .cache import bump_generation
+from .deletion import delete_sections, delete_subsections
+from .models import BookChange, Section, Subsection, VersionConflict
+from .ordering import append_positions, max_positions
+from .paths import make_path, path_depth
+from .permissions import AUTHOR, resolve_book_roles
+from .search import index_objects
+from .serializers import SectionSerializer, SubsectionSerializer
+
+OPERATIONS = ('create', 'update', 'delete')
+
+
+class BatchError(Exception):
+    pass
+
+
+def parse_batch(data):
+    if not isinstance(data, dict):
+        raise BatchError('Expected an object with "create", "update" and/or "delete" lists.')
+
+    batch = {}
+    for operation in OPERATIONS:
+        items = data.get(operation, [])
+        if not isinstance(items, list):
+            raise BatchError(f'"{operation}" must be a list.')
+        batch[operation] = items
+
+    if sum(len(items) for items in batch.values()) > settings.BOOKS_BULK_MAX_ITEMS:
+        raise BatchError(f'A batch can contain at most {settings.BOOKS_BULK_MAX_ITEMS} items.')
+    return batch
+
+
+def _error(code, errors):
+    return {'status': code, 'errors': errors}
+
+
+def _conflict(version):
+    # Carries the current version, for the client to reapply its change on
+    return {**_error(status.HTTP_409_CONFLICT, 'Changed since this version.'), 'version': version}
+
+
+def _item_id(item):
+    value = item.get('id') if isinstance(item, dict) else item
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def _id_error(item, field):
+    # A reference that was sent but is not an id, e.g. "abc", 1.5 or [1]
+    if item.get(field) is not None and _to_int(item[field]) is None:
+        return _error(status.HTTP_400_BAD_REQUEST, {field: ['A valid integer is required.']})
+    return None
+
+
+def _validate_title(serializer_class, item, instance=None):
+    if not isinstance(item, dict):
+        return None, _error(status.HTTP_400_BAD_REQUEST, {'non_field_errors': ['Expected an object.']})
+    serializer = serializer_class(instance, data=item, fields=['title'])
+    if not serializer.is_valid():
+        return None, _error(status.HTTP_400_BAD_REQUEST, serializer.errors)
+    return serializer.validated_data['title'], None
+
+
+def _validate_updates_and_deletes(model, serializer_class, batch, book_of, roles):
+    targets = model.objects.in_bulk([_item_id(item) for item in batch['update'] + batch['delete'] if _item_id(item)])
+
+    updates = []
+    update_results = []
+    for item in batch['update']:
+        obj = targets.get(_item_id(item))
+        if obj is None:
+            update_results.append(_error(status.HTTP_404_NOT_FOUND, 'Not found.'))
+            continue
+        if roles.get(book_of(obj)) is None:
+            update_results.append(_error(status.HTTP_403_FORBIDDEN, 'Only the author and collaborators can edit this item.'))
+            continue
+        title, error = _validate_title(serializer_class, item, obj)
+        if error:
+            update_results.append(error)
+            continue
+        version = item.get('version')
+        # JSON true and false would pass for 1 and 0
+        if version is not None and (isinstance(version, bool) or not isinstance(version, int)):
+            update_results.append(_error(status.HTTP_400_BAD_REQUEST, {'version': ['A valid integer is required.']}))
+            continue
+        if version is not None and version != obj.version:
+            update_results.append(_conflict(obj.version))
+            continue
+        obj.title = title
+        obj._expected_version = version
+        updates.append(obj)
+        update_results.append(None)
+
+    deletes = []
+    delete_results = []
+    for item in batch['delete']:
+        obj = targets.get(_item_id(item))
+        if obj is None:
+            delete_results.append(_error(status.HTTP_404_NOT_FOUND, 'Not found.'))
+        elif roles.get(book_of(obj)) != AUTHOR:
+            delete_results.append(_error(status.HTTP_403_FORBIDDEN, 'Only the author can delete this item.'))
+        else:
+            deletes.append(obj)
+            delete_results.append(None)
+
+    return updates, update_results, deletes, delete_results
+
+
+def _touch(objects):
+    # bulk_update() does not fill auto_now fields nor increment versions
+    now = timezone.now()
+    for obj in objects:
+        obj.updated_at = now
+        obj.version = F('version') + 1
+
+
+def _read_versions(model, objects):
+    # The results report the versions the rows were incremented to
+    if objects:
+        versions = dict(model.objects.filter(pk__in=[obj.pk for obj in objects]).values_list('pk', 'version'))
+        for obj in objects:
+            obj.version = versions[obj.pk]
+
+
+def _update_titles(model, updates):
+    # One conditional bulk_update per expected version. A row that changed since it
+    # was validated is not matched, and the whole batch is rolled back.
+    groups = {}
+    for obj in updates:
+        groups.setdefault(obj._expected_version, []).append(obj)
+    _touch(updates)
+    for version, objects in groups.items():
+        rows = model.objects.all() if version is None else model.objects.filter(version=version)
+        if rows.bulk_update(objects, ['title', 'updated_at', 'version']) < len(objects):
+            raise VersionConflict()
+    _read_versions(model, updates)
+
+
+def _conflicts(model, updates, update_results):
+    # The items whose rows were changed or deleted while the batch was written
+    versions = dict(model.objects.filter(pk__in=[obj.pk for obj in updates]).values_list('pk', 'version'))
+    updated = iter(updates)
+    results = []
+    for result in update_results:
+        if result is None:
+            obj = next(updated)
+            if obj.pk not in versions:
+                result = _error(status.HTTP_404_NOT_FOUND, 'Not found.')
+            elif obj._expected_version not in (None, versions[obj.pk]):
+                result = _conflict(versions[obj.pk])
+        results.append(result)
+    return results
+
+
+def _has_errors(*results):
+    return any(result is not None for items in results for result in items)
+
+
+def _rejected(*results):
+    # The batch is all or nothing: valid items are reported as not applied
+    not_applied = _error(status.HTTP_424_FAILED_DEPENDENCY, 'Not applied because other items in the batch failed.')
+    return {
+        operation: [result or not_applied for result in items]
+        for operation, items in zip(OPERATIONS, results)
+    }
+
+
+def _finish(serializer_class, creates, create_results, updates, update_results, deletes, delete_results):
+    created = iter(creates)
+    updated = iter(updates)
+    deleted = iter(deletes)
+    return {
+        'create': [
+            result or {'status': status.HTTP_201_CREATED, **serializer_class(next(created)).data}
+            for result in create_results
+        ],
+        'update': [
+            result or {'status': status.HTTP_200_OK, **serializer_class(next(updated)).data}
+            for result in update_results
+        ],
+        'delete': [
+            result or {'status': status.HTTP_204_NO_CONTENT, 'id': next(deleted).pk}
+            for result in delete_results
+        ],
+    }
+
+
+def bulk_sections(request, batch):
+    creates_book_ids = [_to_int(item.get('book')) if isinstance(item, dict) else None for item in batch['create']]
+    existing_book_ids = dict(
+        Section.objects.filter(pk__in=[_item_id(item) for item in batch['update'] + batch['delete'] if _item_id(item)])
+        .values_list('pk', 'book_id')
+    )
+    roles = resolve_book_roles(request, {book_id for book_id in creates_book_ids + list(existing_book_ids.values()) if book_id is not None})
+
+    creates = []
+    create_results = []
+    for item, book_id in zip(batch['create'], creates_book_ids):
+        title, error = _validate_title(SectionSerializer, item)
+        error = error or _id_error(item, 'book')
+        if error:
+            create_results.append(error)
+        elif book_id is None or roles.get(book_id) != AUTHOR:
+            create_results.append(_error(status.HTTP_403_FORBIDDEN, 'Only the author can create sections for this book.'))
+        else:
+            creates.append(Section(book_id=book_id, title=title))
+            create_results.append(None)
+
+    updates, update_results, deletes, delete_results = _validate_updates_and_deletes(
+        Section, SectionSerializer, batch, lambda section: section.book_id, roles,
+    )
+
+    results = (create_results, update_results, delete_results)
+    if _has_errors(*results):
+        return status.HTTP_400_BAD_REQUEST, _rejected(*results)
+
+    try:
+        with transaction.atomic():
+            append_sections(creates)
+            Section.objects.bulk_create(creates)
+            _update_titles(Section, updates)
+            BookChange.objects.log(
+                (section.book_id, BookChange.SECTION, section.pk, BookChange.UPSERT) for section in creates + updates
+            )
+            index_objects(creates + updates)
+            if deletes:
+                delete_sections([section.pk for section in deletes])
+    except VersionConflict:
+        return status.HTTP_400_BAD_REQUEST, _rejected(create_results, _conflicts(Section, updates, update_results), delete_results)
+    bump_generation()
+
+    return status.HTTP_200_OK, _finish(SectionSerializer, creates, create_results, updates, update_results, deletes, delete_results)
+
+
+def bulk_subsections(request, batch):
+    """
+    Subsections to create name their parent with either `parent_subsection` (an
+    existing subsection) or `parent_ref` (the index of an earlier item of the same
+    "create" list), so whole outlines can be created in one batch.
+    """
+    create_items = [item if isinstance(item, dict) else {} for item in batch['create']]
+    section_ids = {_to_int(item.get('section')) for item in create_items} - {None}
+    parent_ids = {_to_int(item.get('parent_subsection')) for item in create_items} - {None}
+
+    parents = Subsection.objects.in_bulk(parent_ids)
+    existing = dict(
+        Subsection.objects.filter(pk__in=[_item_id(item) for item in batch['update'] + batch['delete'] if _item_id(item)])
+        .values_list('pk', 'section__book_id')
+    )
+    section_books = dict(Section.objects.filter(pk__in=section_ids).values_list('pk', 'book_id'))
+    roles = resolve_book_roles(request, set(section_books.values()) | set(existing.values()))
+
+    creates = []
+    create_results = []
+    create_depths = []
+    for index, (raw_item, item) in enumerate(zip(batch['create'], create_items)):
+        title, error = _validate_title(SubsectionSerializer, raw_item)
+        error = error or _id_error(item, 'section') or _id_error(item, 'parent_subsection')
+        if error:
+            create_results.append(error)
+            create_depths.append(None)
+            continue
+
+        book_id = section_books.get(_to_int(item.get('section')))
+        if book_id is None or roles.get(book_id) != AUTHOR:
+            create_results.append(_error(status.HTTP_403_FORBIDDEN, 'Only the author can create subsections for this book.'))
+            create_depths.append(None)
+            continue
+
+        subsection = Subsection(section_id=_to_int(item['section']), title=title)
+        depth = 0
+        parent_ref = item.get('parent_ref')
+        if parent_ref is not None:
+            if not isinstance(parent_ref, int) or isinstance(parent_ref, bool) or not 0 <= parent_ref < index or create_depths[parent_ref] is None:
+                create_results.append(_error(status.HTTP_400_BAD_REQUEST, {'parent_ref': ['Must be the index of an earlier valid item.']}))
+                create_depths.append(None)
+                continue
+            parent = creates[create_depths[parent_ref][1]]
+            # Children share their parent's section, like SubsectionMoveSerializer requires
+            if parent.section_id != subsection.section_id:
+                create_results.append(_error(status.HTTP_400_BAD_REQUEST, {'parent_ref': ['Must be a subsection of the same section.']}))
+                create_depths.append(None)
+                continue
+            subsection._parent_ref = parent
+            depth = create_depths[parent_ref][0] + 1
+        elif item.get('parent_subsection') is not None:
+            parent = parents.get(_to_int(item['parent_subsection']))
+            if parent is None or parent.section_id != subsection.section_id:
+                create_results.append(_error(status.HTTP_400_BAD_REQUEST, {'parent_subsection': ['Must be a subsection of the same section.']}))
+                create_depths.append(None)
+                continue
+            subsection.parent_subsection = parent
+
+        create_depths.append((depth, len(creates)))
+        subsection._batch_depth = depth
+        creates.append(subsection)
+        create_results.append(None)
+
+    updates, update_results, deletes, delete_results = _validate_updates_and_deletes(
+        Subsection, SubsectionSerializer, batch, lambda subsection: existing.get(subsection.pk), roles,
+    )
+
+    results = (create_results, update_results, delete_results)
+    if _has_errors(*results):
+        return status.HTTP_400_BAD_REQUEST, _rejected(*results)
+
+    try:
+        with transaction.atomic():
+            create_subsections(creates)
+            _update_titles(Subsection, updates)
+            BookChange.objects.log(
+                [(section_books[subsection.section_id], BookChange.SUBSECTION, subsection.pk, BookChange.UPSERT) for subsection in creates]
+                + [(existing[subsection.pk], BookChange.SUBSECTION, subsection.pk, BookChange.UPSERT) for subsection in updates]
+            )
+            index_objects(creates + updates)
+            if deletes:
+                delete_subsections([subsection.pk for subsection in deletes])
+    except VersionConflict:
+        return status.HTTP_400_BAD_REQUEST, _rejected(create_results, _conflicts(Subsection, updates, update_results), delete_results)
+    bump_generation()
+
+    return status.HTTP_200_OK, _finish(SubsectionSerializer, creates, create_results, updates, update_results, deletes, delete_results)
+
+
+def append_sections(sections):
+    book_ids = {section.book_id for section in sections if not section.position}
+    last = max_positions(Section.objects.filter(book_id__in=book_ids), 'book_id') if book_ids else {}
+    append_positions(sections, lambda section: section.book_id, last)
+
+
+def _sibling_group(subsection):
+    parent = getattr(subsection, '_parent_ref', None)
+    if parent is not None:
+        return ('new', id(parent))
+    if subsection.parent_subsection_id:
+        return ('parent', subsection.parent_subsection_id)
+    return ('section', subsection.section_id)
+
+
+def append_subsections(subsections):
+    # Siblings that already exist are looked up with at most two queries
+    groups = {_sibling_group(subsection) for subsection in subsections if not subsection.position}
+    section_ids = [value for kind, value in groups if kind == 'section']
+    parent_ids = [value for kind, value in groups if kind == 'parent']
+
+    last = {}
+    if section_ids:
+        roots = Subsection.objects.filter(section_id__in=section_ids, parent_subsection__isnull=True)
+        last.update({('section', pk): position for pk, position in max_positions(roots, 'section_id').items()})
+    if parent_ids:
+        children = Subsection.objects.filter(parent_subsection_id__in=parent_ids)
+        last.update({('parent', pk): position for pk, position in max_positions(children, 'parent_subsection_id').items()})
+    append_positions(subsections, _sibling_group, last)
+
+
+def create_subsections(subsections):
+    # Insert level by level so every parent has a primary key before its children,
+    # then fill in the materialized paths with one bulk_update.
+    append_subsections(subsections)
+    levels = {}
+    for subsection in subsections:
+        levels.setdefault(getattr(subsection, '_batch_depth', 0), []).append(subsection)
+
+    for depth in sorted(levels):
+        level = levels[depth]
+        for subsection in level:
+            parent = getattr(subsection, '_parent_ref', None)
+            if parent is not None:
+                subsection.parent_subsection = parent
+        Subsection.objects.bulk_create(level)
+        for subsection in level:
+            parent = subsection.parent_subsection if subsection.parent_subsection_id else None
+            subsection.path = make_path(parent.path if parent else '', subsection.pk)
+            subsection.depth = path_depth(subsection.path)
+
+    Subsection.objects.bulk_update(subsections, ['path', 'depth'], batch_size=1000)
+
+
+def _to_int(value):
+    # Ids are JSON integers or strings of digits, floats and booleans are not ids
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    return None
@@ -0,0 +1,82 @@
+"""
+Versioned caching for the books API.
+
+Cached entries embed a global generation number in their key. Any write to a
+book, section, subsection or the collaborators of a book bumps the generation
+when its transaction commits (see books/signals.py), which orphans every
+previously cached entry at once, so entries can live for a long time without
+ever being served stale.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from backend.metrics import record_cache_access
+
+GENERATION_KEY = 'books:generation'
+
+
+def get_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Seed from the clock so a lost counter never reuses an older generation
+        cache.add(GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def _increment_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        get_generation()
+
+
+def bump_generation():
+    # Only once the write is committed (immediately outside a transaction): bumped
+    # earlier, a concurrent reader could cache the old data under the new generation
+    transaction.on_commit(_increment_generation)
+
+
+async def aget_generation():
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        await cache.aadd(GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = await cache.aget(GENERATION_KEY)
+    return generation
+
+
+def _cache_key(prefix, user, url, generation):
+    query = hashlib.md5(url.encode()).hexdigest()
+    return f'books:{prefix}:{generation}:{user.pk}:{query}'
+
+
+def make_cache_key(prefix, user, url):
+    # Per user and per absolute URL, query string included
+    return _cache_key(prefix, user, url, get_generation())
+
+
+async def amake_cache_key(prefix, user, url):
+    return _cache_key(prefix, user, url, await aget_generation())
+
+
+def get_cached(key):
+    value = cache.get(key)
+    record_cache_access(hits=value is not None, misses=value is None)
+    return value
+
+
+async def aget_cached(key):
+    value = await cache.aget(key)
+    record_cache_access(hits=value is not None, misses=value is None)
+    return value
+
+
+def set_cached(key, value):
+    cache.set(key, value, timeout=settings.BOOKS_CACHE_TIMEOUT)
+
+
+async def aset_cached(key, value):
+    await cache.aset(key, value, timeout=settings.BOOKS_CACHE_TIMEOUT)
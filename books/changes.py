@@ -0,0 +1,61 @@
+"""
+Incremental sync of a book's sections and subsections from the change log.
+
+A client keeps the cursor returned with every page and asks for the changes
+after it. Several changes to the same row are folded into one entry: the current
+state of the row, or a tombstone if it was deleted or left the book since. The
+work therefore depends on the number of changes, not on the size of the book.
+"""
+from django.db.models import F, Max
+from .models import BookChange, Section, Subsection
+from .serializers import SectionSerializer, SubsectionSerializer
+
+CHANGES_PAGE_SIZE = 500
+
+
+def current_cursor(book_id):
+    return BookChange.objects.filter(book_id=book_id).aggregate(last=Max('id'))['last'] or 0
+
+
+def _current_rows(book_id, kind, ids):
+    if not ids:
+        return {}
+    if kind == BookChange.SECTION:
+        return {section.pk: section for section in Section.objects.filter(pk__in=ids, book_id=book_id)}
+    subsections = Subsection.objects.annotate(book_id=F('section__book_id')).filter(pk__in=ids, book_id=book_id)
+    return {subsection.pk: subsection for subsection in subsections}
+
+
+def changes_since(book_id, since, limit=CHANGES_PAGE_SIZE):
+    rows = list(
+        BookChange.objects.filter(book_id=book_id, id__gt=since).order_by('id')
+        .values_list('id', 'kind', 'object_id', 'action')[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Last change of every row, in the order of those last changes
+    latest = {}
+    for change_id, kind, object_id, action in rows:
+        latest.pop((kind, object_id), None)
+        latest[(kind, object_id)] = action
+
+    current = {
+        kind: _current_rows(book_id, kind, [object_id for (row_kind, object_id), action in latest.items() if row_kind == kind and action == BookChange.UPSERT])
+        for kind in (BookChange.SECTION, BookChange.SUBSECTION)
+    }
+    serializers = {BookChange.SECTION: SectionSerializer, BookChange.SUBSECTION: SubsectionSerializer}
+
+    changes = []
+    for (kind, object_id), action in latest.items():
+        obj = current[kind].get(object_id)
+        if obj is None:
+            changes.append({'type': kind, 'action': BookChange.DELETE, 'id': object_id})
+        else:
+            changes.append({'type': kind, 'action': BookChange.UPSERT, **serializers[kind](obj).data})
+
+    return {
+        'cursor': rows[-1][0] if rows else since,
+        'has_more': has_more,
+        'changes': changes,
+    }
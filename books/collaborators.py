@@ -0,0 +1,110 @@
+"""
+Adding and removing many collaborators of a book at once.
+
+Users are given as ids or usernames and resolved with a single query, then the
+collaborators through table is changed with one bulk insert or one delete.
+Since this bypasses the m2m_changed signal, the cache generation and the cached
+roles of the affected users are invalidated here.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from rest_framework import status
+from .cache import bump_generation
+from .models import Book
+from .permissions import invalidate_book_roles
+
+User = get_user_model()
+
+Through = Book.collaborators.through
+
+
+def _result(identifier, user_id, code, detail=None):
+    result = {'user': identifier, 'id': user_id, 'status': code}
+    if detail:
+        result['detail'] = detail
+    return result
+
+
+def resolve_users(identifiers):
+    """
+    Maps every identifier (an id, or a username when it is not an integer) to
+    the id of the matching user, or None.
+    """
+    ids = {identifier for identifier in identifiers if isinstance(identifier, int)}
+    usernames = {identifier for identifier in identifiers if isinstance(identifier, str)}
+    if not ids and not usernames:
+        return dict.fromkeys(identifiers)
+
+    users = User.objects.filter(Q(pk__in=ids) | Q(username__in=usernames)).values_list('pk', 'username')
+    by_id = {}
+    by_username = {}
+    for pk, username in users:
+        by_id[pk] = pk
+        by_username[username] = pk
+    return {
+        identifier: by_id.get(identifier) if isinstance(identifier, int) else by_username.get(identifier)
+        for identifier in identifiers
+    }
+
+
+def _is_identifier(value):
+    return isinstance(value, (int, str)) and not isinstance(value, bool)
+
+
+def _validate(book, identifiers):
+    user_ids = resolve_users([identifier for identifier in identifiers if _is_identifier(identifier)])
+    current = set(Through.objects.filter(book_id=book.pk, user_id__in=[pk for pk in user_ids.values() if pk]).values_list('user_id', flat=True))
+
+    checked = []
+    for identifier in identifiers:
+        if not _is_identifier(identifier):
+            checked.append((identifier, None, _result(identifier, None, status.HTTP_400_BAD_REQUEST, 'Expected a user id or username.')))
+        elif user_ids.get(identifier) is None:
+            checked.append((identifier, None, _result(identifier, None, status.HTTP_404_NOT_FOUND, 'User not found.')))
+        else:
+            checked.append((identifier, user_ids[identifier], None))
+    return checked, current
+
+
+def add_collaborators(book, identifiers):
+    checked, current = _validate(book, identifiers)
+    results = []
+    added = set()
+    for identifier, user_id, error in checked:
+        if error:
+            results.append(error)
+        elif user_id == book.author_id:
+            results.append(_result(identifier, user_id, status.HTTP_400_BAD_REQUEST, 'The author cannot be a collaborator.'))
+        elif user_id in current or user_id in added:
+            results.append(_result(identifier, user_id, status.HTTP_200_OK, 'Already a collaborator.'))
+        else:
+            added.add(user_id)
+            results.append(_result(identifier, user_id, status.HTTP_201_CREATED))
+
+    if added:
+        Through.objects.bulk_create([Through(book_id=book.pk, user_id=user_id) for user_id in added], ignore_conflicts=True)
+        Book.objects.filter(pk=book.pk).touch()
+        bump_generation()
+        invalidate_book_roles([book.pk], added)
+    return results
+
+
+def remove_collaborators(book, identifiers):
+    checked, current = _validate(book, identifiers)
+    results = []
+    removed = set()
+    for identifier, user_id, error in checked:
+        if error:
+            results.append(error)
+        elif user_id in current:
+            removed.add(user_id)
+            results.append(_result(identifier, user_id, status.HTTP_204_NO_CONTENT))
+        else:
+            results.append(_result(identifier, user_id, status.HTTP_200_OK, 'Not a collaborator.'))
+
+    if removed:
+        Through.objects.filter(book_id=book.pk, user_id__in=removed).delete()
+        Book.objects.filter(pk=book.pk).touch()
+        bump_generation()
+        invalidate_book_roles([book.pk], removed)
+    return results
@@ -0,0 +1,72 @@
+"""
+Conditional requests for books and their contents.
+
+GET responses carry the book's id and version as a weak ETag and its updated_at
+as Last-Modified. Sections and subsections use the validators of their book, whose
+version is bumped whenever anything in it changes, so a 304 is never stale.
+Last-Modified only has a resolution of one second, so it is left out (and
+If-Modified-Since is not answered) until the second of updated_at is over: a
+later write within that second would otherwise share the same date.
+
+Updates of a section or subsection must say which version of the row they are
+based on, as If-Match: "<version>" or a `version` field, and are refused with 409
+when the row has changed since (see VersionedModel in books/models.py).
+"""
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from django.utils.http import http_date, parse_etags
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+
+class PreconditionRequired(APIException):
+    status_code = status.HTTP_428_PRECONDITION_REQUIRED
+    default_detail = 'Send the version this update is based on, as If-Match: "<version>" or a `version` field.'
+    default_code = 'precondition_required'
+
+
+def book_validators(book):
+    last_modified = int(book.updated_at.timestamp())
+    if last_modified >= int(timezone.now().timestamp()):
+        last_modified = None
+    return f'W/"{book.pk}-{book.version}"', last_modified
+
+
+def not_modified(request, validators):
+    # 304 when If-None-Match / If-Modified-Since still match, otherwise None
+    etag, last_modified = validators
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validators(response, validators):
+    etag, last_modified = validators
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def expected_version(request):
+    """
+    The row version an update is based on. None for If-Match: *, which accepts
+    any version.
+    """
+    if 'If-Match' in request.headers:
+        etags = parse_etags(request.headers['If-Match'])
+        if etags == ['*']:
+            return None
+        # A strong ETag holding the version, e.g. "3"
+        if len(etags) == 1 and etags[0].startswith('"') and etags[0][1:-1].isdigit():
+            return int(etags[0][1:-1])
+        raise ValidationError({'If-Match': 'Expected a quoted version number, e.g. "3".'})
+
+    version = request.data.get('version')
+    if version is None:
+        raise PreconditionRequired()
+    # int() would take true as 1 and 1.5 as 1, form data sends strings
+    if isinstance(version, bool) or not isinstance(version, (int, str)):
+        raise ValidationError({'version': 'A valid integer is required.'})
+    try:
+        return int(version)
+    except ValueError:
+        raise ValidationError({'version': 'A valid integer is required.'})
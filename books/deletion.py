@@ -0,0 +1,111 @@
+"""
+Set based deletion of books, sections and subtrees of subsections.
+
+QuerySet.delete() has Django's Collector load every related row into memory to
+cascade and send signals, walking parent_subsection one level at a time. Here
+each table is cleared with a single DELETE per statement instead (subtrees are
+found through their materialized path), so the number of queries does not
+depend on the size of what is deleted. Because no delete signals are sent, the
+search documents, cached roles, cache generation and change log are handled
+explicitly.
+"""
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Q
+from .cache import bump_generation
+from .models import Book, BookChange, SearchDocument, Section, Subsection
+from .permissions import invalidate_book_roles
+
+# Subtrees matched by a single statement, keeps the OR of LIKEs within SQLite's expression depth limit
+PATH_CHUNK_SIZE = 500
+
+
+def _raw_delete(queryset):
+    # A plain DELETE ... WHERE, without collecting related objects or sending signals
+    return queryset._raw_delete(queryset.db)
+
+
+def _delete_subsections(subsections):
+    _raw_delete(SearchDocument.objects.filter(kind=SearchDocument.SUBSECTION, object_id__in=subsections.values('pk')))
+    return _raw_delete(subsections)
+
+
+def outermost_paths(paths):
+    # Drops the paths that lie inside another one, their subtree is already covered
+    kept = []
+    for path in sorted(paths):
+        if not kept or not path.startswith(kept[-1]):
+            kept.append(path)
+    return kept
+
+
+def _subtrees(paths):
+    # One filter per chunk of outermost paths, each matching those subtrees
+    for start in range(0, len(paths), PATH_CHUNK_SIZE):
+        yield reduce(or_, (Q(path__startswith=path) for path in paths[start:start + PATH_CHUNK_SIZE]))
+
+
+def delete_subsections(subsection_ids):
+    """
+    Deletes the given subsections together with all of their descendants.
+    """
+    rows = list(Subsection.objects.filter(pk__in=subsection_ids).values_list('pk', 'path', 'section__book_id'))
+    paths = outermost_paths(path for _, path, _ in rows)
+    deleted = 0
+    with transaction.atomic():
+        # Descendants go with their ancestor, only the given subsections are logged
+        BookChange.objects.log((book_id, BookChange.SUBSECTION, pk, BookChange.DELETE) for pk, _, book_id in rows)
+        for subtrees in _subtrees(paths):
+            deleted += _delete_subsections(Subsection.objects.filter(subtrees))
+    bump_generation()
+    return deleted
+
+
+def delete_sections(section_ids):
+    """
+    Deletes the given sections with their subsections and every descendant of
+    those, even one that was filed under another section.
+    """
+    paths = outermost_paths(Subsection.objects.filter(section_id__in=section_ids).values_list('path', flat=True))
+    with transaction.atomic():
+        changes = [
+            (book_id, BookChange.SECTION, pk, BookChange.DELETE)
+            for pk, book_id in Section.objects.filter(pk__in=section_ids).values_list('pk', 'book_id')
+        ]
+        for subtrees in _subtrees(paths):
+            # Descendants in the remaining sections would not be dropped with the section by clients
+            elsewhere = Subsection.objects.filter(subtrees).exclude(section_id__in=section_ids)
+            changes += [
+                (book_id, BookChange.SUBSECTION, pk, BookChange.DELETE)
+                for pk, book_id in elsewhere.values_list('pk', 'section__book_id')
+            ]
+            _delete_subsections(Subsection.objects.filter(subtrees))
+        BookChange.objects.log(changes)
+        _raw_delete(SearchDocument.objects.filter(kind=SearchDocument.SECTION, object_id__in=section_ids))
+        deleted = _raw_delete(Section.objects.filter(pk__in=section_ids))
+    bump_generation()
+    return deleted
+
+
+def delete_books(book_ids):
+    members = {}
+    for book_id, author_id in Book.objects.filter(pk__in=book_ids).values_list('pk', 'author_id'):
+        members[book_id] = [author_id]
+    Through = Book.collaborators.through
+    for book_id, user_id in Through.objects.filter(book_id__in=book_ids).values_list('book_id', 'user_id'):
+        members[book_id].append(user_id)
+
+    with transaction.atomic():
+        _raw_delete(SearchDocument.objects.filter(book_id__in=book_ids))
+        _raw_delete(BookChange.objects.filter(book_id__in=book_ids))
+        _raw_delete(Subsection.objects.filter(section__book_id__in=book_ids))
+        _raw_delete(Section.objects.filter(book_id__in=book_ids))
+        _raw_delete(Through.objects.filter(book_id__in=book_ids))
+        deleted = _raw_delete(Book.objects.filter(pk__in=book_ids))
+
+    bump_generation()
+    for book_id, user_ids in members.items():
+        invalidate_book_roles([book_id], user_ids)
+    return deleted
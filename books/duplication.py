@@ -0,0 +1,48 @@
+"""
+Deep copy of a book with its sections and subsection tree.
+
+Sections are copied with one bulk_create and subsections with one bulk_create per
+tree level (see create_subsections), remapping section and parent_subsection to
+the new rows, so the number of queries depends on the depth of the tree rather
+than on the number of nodes.
+"""
+from django.db import transaction
+from .bulk import create_subsections
+from .cache import bump_generation
+from .models import Book, Section, Subsection
+from .search import index_objects
+
+DUPLICATE_CHUNK_SIZE = 2000
+
+
+def duplicate_book(book, author, title=None, copy_collaborators=False):
+    with transaction.atomic():
+        copy = Book.objects.create(title=title or f'Copy of {book.title}'[:255], author_id=author.pk)
+
+        if copy_collaborators:
+            Through = Book.collaborators.through
+            collaborator_ids = Through.objects.filter(book_id=book.pk).exclude(user_id=author.pk).values_list('user_id', flat=True)
+            Through.objects.bulk_create([Through(book_id=copy.pk, user_id=user_id) for user_id in collaborator_ids])
+
+        sections = list(Section.objects.filter(book=book).order_by('position', 'id').only('id', 'title', 'position'))
+        new_sections = [Section(title=section.title, book=copy, position=section.position) for section in sections]
+        Section.objects.bulk_create(new_sections)
+        section_ids = {section.pk: new.pk for section, new in zip(sections, new_sections)}
+
+        # Parents always come before their children when ordered by depth
+        new_subsections = {}
+        rows = (
+            Subsection.objects.filter(section__book=book).order_by('depth', 'id')
+            .values_list('id', 'title', 'section_id', 'parent_subsection_id', 'position', 'depth')
+        )
+        for pk, subsection_title, section_id, parent_id, position, depth in rows.iterator(chunk_size=DUPLICATE_CHUNK_SIZE):
+            subsection = Subsection(title=subsection_title, section_id=section_ids[section_id], position=position)
+            subsection._batch_depth = depth
+            subsection._parent_ref = new_subsections[parent_id] if parent_id else None
+            new_subsections[pk] = subsection
+        create_subsections(list(new_subsections.values()))
+
+        index_objects(new_sections)
+        index_objects(list(new_subsections.values()))
+    bump_generation()
+    return copy
@@ -0,0 +1,67 @@
+"""
+Streaming export of books, sections and subsections.
+
+Records are produced one at a time from server side iterators, so memory stays
+flat regardless of how much is exported. Each record is the regular serializer
+output of the object plus a "type" key ("book", "section" or "subsection"),
+without the change tracking fields that only make sense in this database.
+Books come first, then sections, then subsections ordered by their materialized
+path so a parent always precedes its children.
+"""
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from .models import Section, Subsection
+from .serializers import BookSerializer, SectionSerializer, SubsectionSerializer
+
+User = get_user_model()
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = ('ndjson', 'json')
+LOCAL_FIELDS = {'version', 'updated_at'}
+
+
+def export_fields(serializer_class):
+    return [name for name in serializer_class().fields if name not in LOCAL_FIELDS]
+
+
+def iter_export_records(books, chunk_size=EXPORT_CHUNK_SIZE):
+    book_ids = books.values('pk')
+    book_fields, section_fields, subsection_fields = map(export_fields, (BookSerializer, SectionSerializer, SubsectionSerializer))
+
+    books = books.order_by('id').prefetch_related(Prefetch('collaborators', queryset=User.objects.only('id')))
+    for book in books.iterator(chunk_size=chunk_size):
+        yield {'type': 'book', **BookSerializer(book, fields=book_fields).data}
+
+    sections = Section.objects.filter(book__in=book_ids).order_by('book_id', 'position', 'id')
+    for section in sections.iterator(chunk_size=chunk_size):
+        yield {'type': 'section', **SectionSerializer(section, fields=section_fields).data}
+
+    subsections = Subsection.objects.filter(section__book__in=book_ids).order_by('path')
+    for subsection in subsections.iterator(chunk_size=chunk_size):
+        yield {'type': 'subsection', **SubsectionSerializer(subsection, fields=subsection_fields).data}
+
+
+def iter_ndjson(records):
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+def iter_json(records):
+    # A JSON array written incrementally, one record per line
+    separator = '[\n'
+    for record in records:
+        yield separator + json.dumps(record, cls=DjangoJSONEncoder)
+        separator = ',\n'
+    yield '[]\n' if separator == '[\n' else '\n]\n'
+
+
+def iter_export(books, export_format='ndjson', chunk_size=EXPORT_CHUNK_SIZE):
+    records = iter_export_records(books, chunk_size=chunk_size)
+    return iter_json(records) if export_format == 'json' else iter_ndjson(records)
+
+
+def export_content_type(export_format):
+    return 'application/json' if export_format == 'json' else 'application/x-ndjson'
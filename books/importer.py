@@ -0,0 +1,241 @@
+"""
+Batched import of books, sections, subsections and collaborators.
+
+Input records use the export format (see books/export.py): a "type" key plus the
+serializer fields, where ids and references are the ids of the *source* system.
+Records are read as a stream and written in batches with bulk_create, each batch
+in its own transaction. Source ids are mapped to the new primary keys in memory,
+so a parent must appear before its children (which the export guarantees).
+
+With a checkpoint name, every batch also stores its new id mappings as an
+ImportCheckpoint row in the same transaction, so a batch and its checkpoint are
+committed together. Running again with the same name skips the records that
+were already committed and carries on from the next batch.
+"""
+import csv
+import json
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from .bulk import append_sections, create_subsections
+from .cache import bump_generation
+from .models import Book, ImportCheckpoint, Section, Subsection
+from .search import index_objects
+
+User = get_user_model()
+
+IMPORT_BATCH_SIZE = 1000
+IMPORT_FORMATS = ('ndjson', 'csv')
+RECORD_TYPES = ('book', 'collaborator', 'section', 'subsection')
+
+# Columns understood in CSV input. "collaborators" holds space separated user ids.
+CSV_COLUMNS = ('type', 'id', 'title', 'author', 'collaborators', 'book', 'user', 'section', 'parent_subsection')
+
+
+class ImportDataError(Exception):
+    pass
+
+
+def read_ndjson(lines):
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            raise ImportDataError(f'Line {number}: invalid JSON ({e}).')
+
+
+def read_csv(lines):
+    for number, row in enumerate(csv.DictReader(lines), start=1):
+        record = {key: value for key, value in row.items() if key in CSV_COLUMNS and value not in ('', None)}
+        if 'collaborators' in record:
+            record['collaborators'] = record['collaborators'].split()
+        yield number, record
+
+
+def _key(value):
+    return None if value is None else str(value)
+
+
+class BookImporter:
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE, default_author=None, checkpoint=None):
+        self.batch_size = batch_size
+        self.default_author = default_author
+        self.checkpoint = checkpoint
+        self.resume_after = 0
+        self.ids = {'book': {}, 'section': {}, 'subsection': {}}
+        self.new_ids = {'book': {}, 'section': {}, 'subsection': {}}
+        self.counts = dict.fromkeys(RECORD_TYPES, 0)
+
+        if checkpoint:
+            self._load_checkpoint()
+
+    def _load_checkpoint(self):
+        for line, ids in ImportCheckpoint.objects.filter(name=self.checkpoint).order_by('line').values_list('line', 'ids'):
+            self.resume_after = line
+            for record_type, mapping in ids.items():
+                self.ids[record_type].update(mapping)
+
+    def _write_checkpoint(self, line, ids):
+        if self.checkpoint:
+            ImportCheckpoint.objects.create(name=self.checkpoint, line=line, ids=ids)
+
+    def run(self, records):
+        batch = []
+        for number, record in records:
+            if number <= self.resume_after:
+                continue
+            batch.append((number, record))
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+        return self.counts
+
+    def _flush(self, batch):
+        by_type = {record_type: [] for record_type in RECORD_TYPES}
+        for number, record in batch:
+            record_type = record.get('type')
+            if record_type not in by_type:
+                raise ImportDataError(f"Line {number}: unknown record type '{record_type}'.")
+            by_type[record_type].append((number, record))
+
+        # Ids created by this batch only become permanent once it is committed
+        self.new_ids = {'book': {}, 'section': {}, 'subsection': {}}
+        self.changed = {'book': set(), 'section': set()}
+        with transaction.atomic():
+            self._import_books(by_type['book'])
+            self._import_collaborators(by_type['book'], by_type['collaborator'])
+            self._import_sections(by_type['section'])
+            self._import_subsections(by_type['subsection'])
+            # Books of earlier batches may have gained collaborators, sections or subsections
+            if self.changed['book'] or self.changed['section']:
+                Book.objects.filter(Q(pk__in=self.changed['book']) | Q(sections__in=self.changed['section'])).touch()
+            self._write_checkpoint(batch[-1][0], self.new_ids)
+
+        for record_type, mapping in self.new_ids.items():
+            self.ids[record_type].update(mapping)
+        bump_generation()
+
+    def _resolve(self, record_type, source_id, number):
+        key = _key(source_id)
+        pk = self.new_ids[record_type].get(key) or self.ids[record_type].get(key)
+        if pk is None:
+            raise ImportDataError(f"Line {number}: unknown {record_type} '{source_id}'.")
+        return pk
+
+    def _known_users(self, user_ids):
+        user_ids = {_to_int(user_id) for user_id in user_ids} - {None}
+        return set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+
+    def _import_books(self, records):
+        if self.default_author is None:
+            known_users = self._known_users(record.get('author') for _, record in records)
+
+        books = []
+        for number, record in records:
+            if self.default_author is not None:
+                author_id = self.default_author.pk
+            else:
+                author_id = _to_int(record.get('author'))
+                if author_id not in known_users:
+                    raise ImportDataError(f"Line {number}: unknown author '{record.get('author')}'.")
+            books.append(Book(title=record.get('title', ''), author_id=author_id))
+
+        Book.objects.bulk_create(books, batch_size=self.batch_size)
+        index_objects(books)
+        for (number, record), book in zip(records, books):
+            self.new_ids['book'][_key(record.get('id'))] = book.pk
+        self.counts['book'] += len(books)
+
+    def _import_collaborators(self, book_records, collaborator_records):
+        pairs = []
+        for number, record in book_records:
+            pairs.extend((number, record.get('id'), user_id) for user_id in record.get('collaborators') or [])
+        pairs.extend((number, record.get('book'), record.get('user')) for number, record in collaborator_records)
+        if not pairs:
+            return
+
+        known_users = self._known_users(user_id for _, _, user_id in pairs)
+        Through = Book.collaborators.through
+        links = []
+        for number, source_book, user_id in pairs:
+            if _to_int(user_id) not in known_users:
+                raise ImportDataError(f"Line {number}: unknown collaborator '{user_id}'.")
+            links.append(Through(book_id=self._resolve('book', source_book, number), user_id=_to_int(user_id)))
+
+        Through.objects.bulk_create(links, batch_size=self.batch_size, ignore_conflicts=True)
+        self.changed['book'].update(link.book_id for link in links)
+        self.counts['collaborator'] += len(links)
+
+    def _import_sections(self, records):
+        sections = [
+            Section(
+                title=record.get('title', ''),
+                book_id=self._resolve('book', record.get('book'), number),
+                position=_to_int(record.get('position')) or 0,
+            )
+            for number, record in records
+        ]
+        append_sections(sections)
+        Section.objects.bulk_create(sections, batch_size=self.batch_size)
+        index_objects(sections)
+        self.changed['book'].update(section.book_id for section in sections)
+        for (number, record), section in zip(records, sections):
+            self.new_ids['section'][_key(record.get('id'))] = section.pk
+        self.counts['section'] += len(sections)
+
+    def _import_subsections(self, records):
+        # Parents from earlier batches are only needed for their section and materialized path
+        earlier_parents = {
+            self.ids['subsection'][_key(record['parent_subsection'])]
+            for _, record in records
+            if record.get('parent_subsection') is not None and _key(record['parent_subsection']) in self.ids['subsection']
+        }
+        earlier_parents = Subsection.objects.only('section_id', 'path').in_bulk(earlier_parents)
+
+        subsections = []
+        in_batch = {}
+        for number, record in records:
+            subsection = Subsection(
+                title=record.get('title', ''),
+                section_id=self._resolve('section', record.get('section'), number),
+                position=_to_int(record.get('position')) or 0,
+            )
+            subsection._batch_depth = 0
+            parent_key = _key(record.get('parent_subsection'))
+            if parent_key in in_batch:
+                parent = in_batch[parent_key]
+            elif parent_key is not None:
+                parent = earlier_parents.get(self._resolve('subsection', parent_key, number))
+                if parent is None:
+                    raise ImportDataError(f"Line {number}: unknown subsection '{record.get('parent_subsection')}'.")
+            else:
+                parent = None
+            # The materialized path of a subtree only covers its own section
+            if parent is not None and parent.section_id != subsection.section_id:
+                raise ImportDataError(f"Line {number}: parent subsection '{record.get('parent_subsection')}' is in another section.")
+            if parent_key in in_batch:
+                subsection._parent_ref = parent
+                subsection._batch_depth = parent._batch_depth + 1
+            elif parent is not None:
+                subsection.parent_subsection = parent
+            in_batch[_key(record.get('id'))] = subsection
+            subsections.append(subsection)
+
+        create_subsections(subsections)
+        index_objects(subsections)
+        self.changed['section'].update(subsection.section_id for subsection in subsections)
+        for (number, record), subsection in zip(records, subsections):
+            self.new_ids['subsection'][_key(record.get('id'))] = subsection.pk
+        self.counts['subsection'] += len(subsections)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
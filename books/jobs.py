@@ -0,0 +1,286 @@
+"""
+A small database backed job queue for work that should not run inside a request.
+
+Views enqueue a Job and answer 202 with its id; the `run_jobs` management command
+claims queued jobs one at a time and runs the handler registered for their kind.
+Claiming is a conditional UPDATE of the job's status, so several workers can
+share the queue (on PostgreSQL candidates are also picked with SKIP LOCKED).
+A job that raises is retried with an exponential backoff until it has been tried
+max_attempts times. While a handler runs, a thread of its worker refreshes the
+job's heartbeat_at every BOOKS_JOB_HEARTBEAT_INTERVAL seconds. Jobs whose worker
+died stop beating and are put back in the queue after BOOKS_JOB_TIMEOUT seconds,
+or failed if that was their last attempt.
+"""
+import logging
+import os
+import threading
+import traceback
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connections, transaction
+from django.db.models import F, Q
+from django.http import QueryDict
+from django.utils import timezone
+from .cache import make_cache_key, set_cached
+from .deletion import delete_books
+from .duplication import duplicate_book
+from .export import iter_export
+from .importer import BookImporter, ImportDataError, read_csv, read_ndjson
+from .listing import book_list_page
+from .models import Book, ImportCheckpoint, Job
+from .permissions import resolve_user_book_roles
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+JOB_HANDLERS = {}
+
+
+class JobFailed(Exception):
+    """
+    Raised by a handler for errors that retrying cannot fix, e.g. invalid input.
+    """
+
+
+def job_handler(kind):
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, user, payload=None, max_attempts=None):
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}'.")
+    return Job.objects.create(
+        kind=kind,
+        user_id=user.pk,
+        payload=payload or {},
+        max_attempts=max_attempts or settings.BOOKS_JOB_MAX_ATTEMPTS,
+    )
+
+
+def job_output_path(job, suffix):
+    os.makedirs(settings.BOOKS_JOB_OUTPUT_DIR, exist_ok=True)
+    return os.path.join(settings.BOOKS_JOB_OUTPUT_DIR, f'job-{job.pk}{suffix}')
+
+
+def remove_expired_results():
+    """
+    Deletes the result files of jobs that finished more than BOOKS_JOB_RESULT_TTL
+    seconds ago. The jobs keep their result, marked as expired.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.BOOKS_JOB_RESULT_TTL)
+    expired = list(Job.objects.filter(status=Job.SUCCEEDED, finished_at__lt=cutoff, result__has_key='file'))
+    for job in expired:
+        try:
+            os.remove(os.path.join(settings.BOOKS_JOB_OUTPUT_DIR, job.result.pop('file')))
+        except FileNotFoundError:
+            pass
+        job.result['expired'] = True
+        job.save(update_fields=['result'])
+    return len(expired)
+
+
+def requeue_stale_jobs():
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.BOOKS_JOB_TIMEOUT)
+    # Jobs claimed before heartbeats existed only have started_at
+    stale = Job.objects.filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff), status=Job.RUNNING,
+    )
+    # A job that keeps killing its worker (e.g. running out of memory) fails once out of attempts
+    abandoned = list(stale.filter(attempts__gte=F('max_attempts')))
+    Job.objects.filter(pk__in=[job.pk for job in abandoned], status=Job.RUNNING).update(
+        status=Job.FAILED, error='The worker running the job stopped responding.', finished_at=now,
+    )
+    for job in abandoned:
+        if job.kind == 'import':
+            clean_up_import(job)
+    return stale.update(status=Job.QUEUED, run_at=now)
+
+
+def claim_job():
+    now = timezone.now()
+    while True:
+        with transaction.atomic():
+            candidates = Job.objects.select_for_update(skip_locked=True).filter(status=Job.QUEUED, run_at__lte=now)
+            job = candidates.order_by('run_at', 'id').first()
+            if job is None:
+                return None
+            # Another worker may have claimed it since it was read (SQLite has no row locks)
+            claimed = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+                status=Job.RUNNING, started_at=now, heartbeat_at=now, attempts=job.attempts + 1,
+            )
+        if claimed:
+            job.status = Job.RUNNING
+            job.started_at = job.heartbeat_at = now
+            job.attempts += 1
+            return job
+
+
+class Heartbeat(threading.Thread):
+    """
+    Refreshes the job's heartbeat_at while its handler runs, however long a
+    single step of the handler (e.g. one transaction) takes.
+    """
+    def __init__(self, job):
+        super().__init__(name=f'job-{job.pk}-heartbeat', daemon=True)
+        self.job = job
+        self.stopped = threading.Event()
+
+    def beat(self):
+        Job.objects.filter(pk=self.job.pk, status=Job.RUNNING).update(heartbeat_at=timezone.now())
+
+    def run(self):
+        try:
+            while not self.stopped.wait(settings.BOOKS_JOB_HEARTBEAT_INTERVAL):
+                try:
+                    self.beat()
+                except DatabaseError:
+                    # e.g. SQLite locked by the handler's own transaction, tried again at the next beat
+                    logger.warning('Heartbeat of job %s failed', self.job.pk, exc_info=True)
+        finally:
+            # The connections opened by this thread
+            connections.close_all()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def _run_handler(job):
+    heartbeat = Heartbeat(job)
+    heartbeat.start()
+    try:
+        return JOB_HANDLERS[job.kind](job)
+    finally:
+        heartbeat.stop()
+
+
+def run_job(job):
+    try:
+        result = _run_handler(job)
+    except JobFailed as e:
+        job.error = str(e)
+        job.status = Job.FAILED
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        return job
+    except Exception:
+        logger.exception('Job %s (%s) failed on attempt %d', job.pk, job.kind, job.attempts)
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + timedelta(seconds=settings.BOOKS_JOB_RETRY_DELAY * 2 ** (job.attempts - 1))
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'run_at', 'finished_at'])
+        return job
+
+    job.status = Job.SUCCEEDED
+    job.result = result
+    job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'finished_at'])
+    return job
+
+
+def run_pending_jobs(max_jobs=None):
+    count = 0
+    while max_jobs is None or count < max_jobs:
+        job = claim_job()
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
+
+
+@job_handler('export')
+def export_job(job):
+    books = Book.objects.accessible_to(job.user)
+    if job.payload.get('books'):
+        books = books.filter(pk__in=job.payload['books'])
+    export_format = job.payload.get('format', 'ndjson')
+
+    path = job_output_path(job, f'.{export_format}')
+    with open(path, 'w') as output:
+        output.writelines(iter_export(books, export_format))
+    return {'file': os.path.basename(path), 'format': export_format, 'size': os.path.getsize(path)}
+
+
+@job_handler('duplicate_book')
+def duplicate_book_job(job):
+    try:
+        book = Book.objects.get(pk=job.payload['book'])
+    except Book.DoesNotExist:
+        raise JobFailed(f"Book {job.payload['book']} does not exist.")
+    copy = duplicate_book(book, job.user, title=job.payload.get('title'), copy_collaborators=job.payload.get('collaborators', False))
+    return {'book': copy.pk}
+
+
+def _import_checkpoint(job):
+    return f'job-{job.pk}'
+
+
+def _upload_path(job):
+    return os.path.join(settings.BOOKS_JOB_OUTPUT_DIR, job.payload['file'])
+
+
+def clean_up_import(job):
+    try:
+        os.remove(_upload_path(job))
+    except FileNotFoundError:
+        pass
+    ImportCheckpoint.objects.filter(name=_import_checkpoint(job)).delete()
+
+
+@job_handler('import')
+def import_job(job):
+    # The checkpoint lets a retried job carry on after the last committed batch
+    importer = BookImporter(default_author=job.user, checkpoint=_import_checkpoint(job))
+    reader = read_csv if job.payload.get('format') == 'csv' else read_ndjson
+    try:
+        with open(_upload_path(job), newline='') as records:
+            importer.run(reader(records))
+    except ImportDataError as e:
+        clean_up_import(job)
+        raise JobFailed(str(e))
+    except Exception:
+        # The upload is kept for the remaining attempts
+        if job.attempts >= job.max_attempts:
+            clean_up_import(job)
+        raise
+    clean_up_import(job)
+    return importer.counts
+
+
+@job_handler('delete_book')
+def delete_book_job(job):
+    return {'deleted': delete_books([job.payload['book']])}
+
+
+@job_handler('warm_cache')
+def warm_cache_job(job):
+    """
+    Fills the cache with the user's first book list pages, for the URL they were
+    requested from, and with their role on every book they can access.
+    """
+    url = job.payload['url']
+    pages = 0
+    while url and pages < job.payload.get('pages', 1):
+        # The absolute URL is what the view's cache key and next links are made of
+        data = book_list_page(job.user, QueryDict(urlsplit(url).query), url)
+        set_cached(make_cache_key('book_list', job.user, url), data)
+        pages += 1
+        url = data['next']
+
+    book_ids = list(Book.objects.accessible_to(job.user).values_list('pk', flat=True)[:settings.BOOKS_BULK_MAX_ITEMS])
+    resolve_user_book_roles(job.user, book_ids)
+    return {'pages': pages, 'roles': len(book_ids)}
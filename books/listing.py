@@ -0,0 +1,72 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
+from rest_framework.exceptions import ValidationError
+from .models import Book
+from .pagination import BookCursorPagination
+from .serializers import BookSerializer
+
+User = get_user_model()
+
+
+def get_requested_fields(query_params):
+    available_fields = list(BookSerializer().fields)
+    if not query_params.get('fields'):
+        return available_fields
+
+    fields = [name.strip() for name in query_params['fields'].split(',') if name.strip()]
+    unknown_fields = set(fields) - set(available_fields)
+    if unknown_fields:
+        raise ValidationError({'fields': [f"Unknown field '{name}'." for name in sorted(unknown_fields)]})
+    return fields
+
+
+# ?role= value -> BookQuerySet method selecting the user's books
+ROLE_FILTERS = {
+    'author': 'authored_by',
+    'collaborator': 'collaborated_on_by',
+    'any': 'accessible_to',
+}
+
+
+def get_role_filter(query_params):
+    role = query_params.get('role')
+    if role is not None and role not in ROLE_FILTERS:
+        raise ValidationError({'role': [f"Must be one of: {', '.join(ROLE_FILTERS)}."]})
+    return role
+
+
+class _PageQuery:
+    # What the paginator reads from a request: the query and the URL its links are built on
+    def __init__(self, query_params, url):
+        self.query_params = query_params
+        self.url = url
+
+    def build_absolute_uri(self):
+        return self.url
+
+
+def book_list_page(user, query_params, url):
+    """
+    The page of the book list selected by `query_params` (a QueryDict), for `user`.
+    `url` is the absolute URL of the page, used for the next/previous links.
+    """
+    fields = get_requested_fields(query_params)
+    role = get_role_filter(query_params)
+
+    books = Book.objects.all()
+    if role:
+        books = getattr(books, ROLE_FILTERS[role])(user)
+
+    # Only load the requested columns, and fetch collaborator ids in one query when they are asked for
+    books = books.only('id', *[name for name in fields if name != 'collaborators'])
+    if 'collaborators' in fields:
+        books = books.prefetch_related(Prefetch('collaborators', queryset=User.objects.only('id')))
+
+    paginator = BookCursorPagination()
+    page = paginator.paginate_queryset(books, _PageQuery(query_params, url))
+    serializer = BookSerializer(page, many=True, fields=fields)
+    data = paginator.get_paginated_response(serializer.data).data
+    if role:
+        # Only filtered lists are counted, counting the whole catalog would cost a full scan
+        data['count'] = books.count()
+    return data
@@ -0,0 +1,79 @@
+import json
+import platform
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from books.benchmark import BENCHMARKS, run_benchmarks, seed_benchmark_data
+
+BENCHMARK_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'books-benchmark'},
+}
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway test database with synthetic data and benchmark every API endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--books', type=int, default=20)
+        parser.add_argument('--collaborators', type=int, default=3, help='Collaborators per book.')
+        parser.add_argument('--sections', type=int, default=5, help='Sections per book.')
+        parser.add_argument('--depth', type=int, default=3, help='Levels of subsections in every section.')
+        parser.add_argument('--width', type=int, default=2, help='Children of every subsection node.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=20, help='Requests per endpoint.')
+        parser.add_argument('--benchmark', action='append', dest='benchmarks', help='Run only this benchmark (can be repeated).')
+        parser.add_argument('--output', help='File to write the JSON results to, defaults to stdout.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['books'] < 1:
+            raise CommandError('At least 2 users and 1 book are needed.')
+        unknown = set(options['benchmarks'] or []) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}. Choose from: {', '.join(BENCHMARKS)}.")
+
+        scale = {name: options[name] for name in ('users', 'books', 'collaborators', 'sections', 'depth', 'width', 'seed')}
+
+        # Never touch the real database: run against a fresh test database. Its ids start
+        # again from 1, so it gets a cache of its own too, or its role, generation and
+        # throttle entries would be read by the real site.
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES=BENCHMARK_CACHES):
+                try:
+                    seeded = seed_benchmark_data(**scale)
+                    results = run_benchmarks(options['iterations'], options['benchmarks'])
+                finally:
+                    cache.clear()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'scale': scale,
+            'seeded': seeded,
+            'iterations': options['iterations'],
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            for result in results:
+                latency = result['latency_ms']
+                self.stdout.write(
+                    f"{result['name']:<28} p50 {latency['p50']:8.2f} ms  p99 {latency['p99']:8.2f} ms  "
+                    f"{result['throughput_rps']:8.1f} req/s  {result['queries']['max']:4d} queries"
+                )
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from books.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, iter_export
+from books.models import Book
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Stream books with their sections and subsections as NDJSON or JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--book', type=int, action='append', dest='books', help='Export only this book (can be repeated).')
+        parser.add_argument('--user', help='Export every book this username can access.')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson', dest='export_format')
+        parser.add_argument('--output', help='File to write to, defaults to stdout.')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        books = Book.objects.all()
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist.")
+            books = Book.objects.accessible_to(user)
+        if options['books']:
+            books = books.filter(pk__in=options['books'])
+
+        chunks = iter_export(books, options['export_format'], chunk_size=options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,46 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from books.importer import IMPORT_BATCH_SIZE, IMPORT_FORMATS, BookImporter, ImportDataError, read_csv, read_ndjson
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Import books, sections, subsections and collaborators from NDJSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="File to import, or '-' for stdin.")
+        parser.add_argument('--format', choices=IMPORT_FORMATS, dest='import_format',
+                            help='Input format, guessed from the file extension by default.')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--author', help='Username to use as the author of every imported book.')
+        parser.add_argument('--checkpoint', help='Name under which committed batches are recorded, used to resume an interrupted import.')
+
+    def handle(self, *args, **options):
+        import_format = options['import_format'] or ('csv' if options['input'].endswith('.csv') else 'ndjson')
+
+        default_author = None
+        if options['author']:
+            try:
+                default_author = User.objects.get(username=options['author'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['author']}' does not exist.")
+
+        importer = BookImporter(batch_size=options['batch_size'], default_author=default_author, checkpoint=options['checkpoint'])
+        if importer.resume_after:
+            self.stdout.write(f'Resuming after line {importer.resume_after}.')
+
+        source = sys.stdin if options['input'] == '-' else open(options['input'], newline='')
+        try:
+            records = read_csv(source) if import_format == 'csv' else read_ndjson(source)
+            counts = importer.run(records)
+        except ImportDataError as e:
+            raise CommandError(str(e))
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        summary = ', '.join(f'{count} {record_type}s' for record_type, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Imported {summary}.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from books.models import Subsection
+from books.paths import rebuild_paths
+
+
+class Command(BaseCommand):
+    help = 'Recompute the materialized path and depth of every subsection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = rebuild_paths(Subsection, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt paths for {updated} subsections.'))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from books.jobs import claim_job, remove_expired_results, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (exports, imports, deletes, duplication, cache warming).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty instead of waiting for new jobs.')
+        parser.add_argument('--max-jobs', type=int, help='Exit after running this many jobs.')
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds to wait when the queue is empty.')
+
+    def handle(self, *args, **options):
+        count = 0
+        while options['max_jobs'] is None or count < options['max_jobs']:
+            requeue_stale_jobs()
+            remove_expired_results()
+            job = claim_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            job = run_job(job)
+            count += 1
+            self.stdout.write(f'Job {job.pk} ({job.kind}): {job.status}')
+        self.stdout.write(self.style.SUCCESS(f'Ran {count} jobs.'))
@@ -0,0 +1,30 @@
+# Generated by Django 4.1.5 on 2026-10-18 08:19
+
+from django.db import migrations, models
+
+from books.paths import rebuild_paths
+
+
+def backfill_paths(apps, schema_editor):
+    rebuild_paths(apps.get_model('books', 'Subsection'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_remove_section_parent_section_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subsection',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subsection',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=1024),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.1.5 on 2026-10-18 08:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from books.search import create_search_schema, drop_search_schema, rebuild_search_index
+
+
+def create_index(apps, schema_editor):
+    create_search_schema(schema_editor)
+    rebuild_search_index(apps)
+
+
+def drop_index(apps, schema_editor):
+    drop_search_schema(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_subsection_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('book', 'Book'), ('section', 'Section'), ('subsection', 'Subsection')], max_length=16)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('title', models.CharField(max_length=255)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='books.book')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='searchdocument',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_search_document'),
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.1.5 on 2026-10-18 08:36
+
+from django.db import migrations, models
+
+from books.ordering import rebuild_positions
+
+
+def backfill_positions(apps, schema_editor):
+    # Existing rows keep their current (id) order
+    rebuild_positions(apps.get_model('books', 'Section'), ['book_id'])
+    rebuild_positions(apps.get_model('books', 'Subsection'), ['section_id', 'parent_subsection_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_searchdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='position',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='subsection',
+            name='position',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='section',
+            index=models.Index(fields=['book', 'position'], name='books_section_book_position'),
+        ),
+        migrations.AddIndex(
+            model_name='subsection',
+            index=models.Index(fields=['parent_subsection', 'position'], name='books_subsection_parent_pos'),
+        ),
+        migrations.AddIndex(
+            model_name='subsection',
+            index=models.Index(fields=['section', 'position'], name='books_subsection_section_pos'),
+        ),
+        migrations.RunPython(backfill_positions, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,310 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef, Q, Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth.models import User
+from django.utils import timezone
+from .ordering import next_position, place
+from .paths import make_path, path_depth, path_ids
 
 # Create your models here.
 
+class BookQuerySet(models.QuerySet):
+    def accessible_to(self, user):
+        # EXISTS on the collaborators table instead of a join, so no DISTINCT is needed
+        is_collaborator = self.model.collaborators.through.objects.filter(book_id=OuterRef('pk'), user_id=user.pk)
+        return self.filter(Q(author_id=user.pk) | Exists(is_collaborator))
+
+    def authored_by(self, user):
+        return self.filter(author_id=user.pk)
+
+    def collaborated_on_by(self, user):
+        # Driven by the user_id index of the collaborators table
+        return self.filter(pk__in=self.model.collaborators.through.objects.filter(user_id=user.pk).values('book_id'))
+
+    def touch(self):
+        # Marks the books as changed, which invalidates the ETags of the book and everything in it
+        return self.update(version=F('version') + 1, updated_at=timezone.now())
+
 class Book(models.Model):
     title = models.CharField(max_length=255)
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='books')
     collaborators = models.ManyToManyField(User, related_name='collaborating_books', blank=True)
+    # Bumped on any change to the book, its collaborators, sections or subsections (see books/signals.py)
+    version = models.PositiveBigIntegerField(default=1, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BookQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        book = super().from_db(db, field_names, values)
+        # Whose cached role to drop when the author changes (see books/signals.py)
+        book._loaded_author_id = book.__dict__.get('author_id')
+        return book
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Writing back the loaded version could undo a concurrent touch()
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields if not field.primary_key and field.name != 'version']
+        super().save(*args, **kwargs)
+
+class VersionConflict(Exception):
+    """
+    Raised when saving a section or subsection that was changed by someone else
+    since the version it was read at.
+    """
+
+class VersionedModel(models.Model):
+    """
+    Optimistic concurrency control. Saving an existing row is a single
+    UPDATE ... WHERE version = <the instance's version> that also increments it,
+    so an edit based on an outdated read changes nothing and raises
+    VersionConflict, without holding a lock between the read and the write.
+    """
+    # Incremented by every write to the row
+    version = models.PositiveBigIntegerField(default=1, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is not None and not self._state.adding:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
 
-class Section(models.Model):
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        if self._state.adding:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        expected = self.version
+        values = [(field, model, expected + 1 if field.name == 'version' else value) for field, model, value in values]
+        # Nothing updated means a newer version (or a deletion), never an insert
+        if not super()._do_update(base_qs.filter(version=expected), using, pk_val, values, update_fields, True):
+            raise VersionConflict
+        self.version = expected + 1
+        return True
+
+class Section(VersionedModel):
     title = models.CharField(max_length=255)
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='sections')
+    # Order among the sections of the book, see books/ordering.py. 0 until assigned on save.
+    position = models.PositiveBigIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['book', 'position'], name='books_section_book_position'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.position:
+            self.position = next_position(self.get_siblings())
+        super().save(*args, **kwargs)
+
+    def get_siblings(self):
+        return Section.objects.filter(book_id=self.book_id).exclude(pk=self.pk)
+
+    @transaction.atomic
+    def move(self, before=None, after=None):
+        respaced = place(self, self.get_siblings(), before=before, after=after)
+        self.save(update_fields=['position', 'updated_at'])
+        BookChange.objects.log((self.book_id, BookChange.SECTION, section.pk, BookChange.UPSERT) for section in respaced)
     
-class Subsection(models.Model):
+class Subsection(VersionedModel):
     title = models.CharField(max_length=255)
     section = models.ForeignKey(Section, on_delete=models.CASCADE, related_name='subsections')
     parent_subsection = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='child_sections')
+    # Materialized path of the node, see books/paths.py
+    path = models.CharField(max_length=1024, db_index=True, blank=True, default='', editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    # Order among the children of the same parent (or the top level subsections of the section)
+    position = models.PositiveBigIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['parent_subsection', 'position'], name='books_subsection_parent_pos'),
+            models.Index(fields=['section', 'position'], name='books_subsection_section_pos'),
+        ]
+
+    def save(self, *args, **kwargs):
+        parent_path = self.parent_subsection.path if self.parent_subsection_id else ''
+        if not self.position:
+            self.position = next_position(self.get_siblings())
+
+        if self.pk is None:
+            super().save(*args, **kwargs)
+            self.path = make_path(parent_path, self.pk)
+            self.depth = path_depth(self.path)
+            Subsection.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+            return
+
+        old_path = self.path
+        new_path = make_path(parent_path, self.pk)
+        self.path = new_path
+        self.depth = path_depth(new_path)
+        super().save(*args, **kwargs)
+
+        if old_path and old_path != new_path:
+            # The node moved: rewrite the prefix of every descendant in one UPDATE
+            descendants = self.get_descendants(old_path)
+            self._log_upserts(descendants.values_list('pk', flat=True))
+            descendants.update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (path_depth(new_path) - path_depth(old_path)),
+                updated_at=self.updated_at,
+                version=F('version') + 1,
+            )
+
+    def get_siblings(self):
+        if self.parent_subsection_id:
+            siblings = Subsection.objects.filter(parent_subsection_id=self.parent_subsection_id)
+        else:
+            siblings = Subsection.objects.filter(section_id=self.section_id, parent_subsection__isnull=True)
+        return siblings.exclude(pk=self.pk)
+
+    @transaction.atomic
+    def move(self, section, parent=None, before=None, after=None):
+        """
+        Moves the subsection (with its subtree) under `parent`, or to the top level
+        of `section`, next to `before`/`after` or after its new siblings.
+        """
+        previous_section_id = self.section_id
+        previous_path = self.path
+        self.section = section
+        self.parent_subsection = parent
+        respaced = place(self, self.get_siblings(), before=before, after=after)
+        self._log_upserts(subsection.pk for subsection in respaced)
+        self.save(update_fields=['section', 'parent_subsection', 'position', 'path', 'depth', 'updated_at'])
+        if section.pk != previous_section_id:
+            descendants = self.get_descendants()
+            if self.path == previous_path:
+                # Otherwise already logged by save()
+                self._log_upserts(descendants.values_list('pk', flat=True))
+            descendants.update(section=section, updated_at=self.updated_at, version=F('version') + 1)
+            # Replicas of the book it came from drop it with its subtree
+            previous_book_id = Section.objects.filter(pk=previous_section_id).values_list('book_id', flat=True).get()
+            if previous_book_id != section.book_id:
+                BookChange.objects.log([(previous_book_id, BookChange.SUBSECTION, self.pk, BookChange.DELETE)])
+
+    def _log_upserts(self, subsection_ids):
+        BookChange.objects.log((self.section.book_id, BookChange.SUBSECTION, pk, BookChange.UPSERT) for pk in subsection_ids)
+
+    def get_descendants(self, path=None):
+        return Subsection.objects.filter(path__startswith=path or self.path).exclude(pk=self.pk)
+
+    def get_ancestors(self):
+        return Subsection.objects.filter(pk__in=path_ids(self.path)[:-1]).order_by('depth')
+
+    def is_descendant_of(self, other):
+        return self.pk != other.pk and self.path.startswith(other.path)
+
+class BookChangeQuerySet(models.QuerySet):
+    def log(self, changes):
+        """
+        Appends (book_id, kind, object_id, action) changes, after touching their
+        books. On PostgreSQL the touch locks the book rows until the transaction
+        commits, so the changes of a book are committed in id order and a client
+        never skips one by using the last id it has seen as its cursor.
+        """
+        changes = list(changes)
+        if not changes:
+            return []
+        Book.objects.filter(pk__in={book_id for book_id, *_ in changes}).touch()
+        return self.bulk_create([
+            BookChange(book_id=book_id, kind=kind, object_id=object_id, action=action)
+            for book_id, kind, object_id, action in changes
+        ], batch_size=1000)
+
+class BookChange(models.Model):
+    """
+    Append-only log of section and subsection changes, served by the changes
+    endpoint (see books/changes.py). The id is the clients' sync cursor. A deleted
+    section or subsection takes its subsections with it, they get no entry.
+    """
+    SECTION = 'section'
+    SUBSECTION = 'subsection'
+    KIND_CHOICES = [(SECTION, 'Section'), (SUBSECTION, 'Subsection')]
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    ACTION_CHOICES = [(UPSERT, 'Upsert'), (DELETE, 'Delete')]
+
+    id = models.BigAutoField(primary_key=True)
+    # No constraint: entries are written while a book is being deleted, and removed with it by delete_books()
+    book = models.ForeignKey(Book, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    action = models.CharField(max_length=8, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = BookChangeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['book', 'id'], name='books_bookchange_book_id'),
+        ]
+
+class SearchDocument(models.Model):
+    """
+    One row per searchable title. A full-text index is built on top of this table
+    by the database backend (see books/search.py and the 0005 migration).
+    """
+    BOOK = 'book'
+    SECTION = 'section'
+    SUBSECTION = 'subsection'
+    KIND_CHOICES = [(BOOK, 'Book'), (SECTION, 'Section'), (SUBSECTION, 'Subsection')]
+
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    title = models.CharField(max_length=255)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='unique_search_document'),
+        ]
+
+class Job(models.Model):
+    """
+    A unit of background work run by the `run_jobs` worker, see books/jobs.py.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=64)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='book_jobs')
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the worker while the job runs
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='books_job_status_run_at'),
+        ]
+
+class ImportCheckpoint(models.Model):
+    """
+    One committed import batch: the last input line it covered and the ids it
+    created, keyed by the source ids. Written in the batch's own transaction, so
+    a resumed import never inserts a committed batch again (see books/importer.py).
+    """
+    name = models.CharField(max_length=255)
+    line = models.PositiveIntegerField()
+    ids = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'line'], name='books_importcheckpoint_name'),
+        ]
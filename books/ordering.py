@@ -0,0 +1,103 @@
+"""
+Gap based ordering of sections and subsections among their siblings.
+
+Positions are spaced POSITION_GAP apart. Moving a node gives it a position
+halfway between its new neighbours, so only the moved row is written. Only when
+two neighbours are adjacent integers are the siblings re-spaced, which is rare.
+
+Like books/paths.py this module only works with the querysets and model classes
+it is given, so it can be used from migrations as well.
+"""
+from django.db.models import F, Max
+
+POSITION_GAP = 1 << 16
+
+
+def max_positions(queryset, field):
+    # Maps each value of `field` to the highest position in that group, in one query
+    return dict(queryset.values(field).annotate(last=Max('position')).order_by().values_list(field, 'last'))
+
+
+def next_position(siblings):
+    return (siblings.aggregate(last=Max('position'))['last'] or 0) + POSITION_GAP
+
+
+def append_positions(objects, key, last=None):
+    """
+    Gives every object without a position one after the last of its siblings, in
+    list order. `key` maps an object to its sibling group and `last` holds the
+    highest existing position of each group (see max_positions).
+    """
+    last = dict(last or {})
+    for obj in objects:
+        group = key(obj)
+        if not obj.position:
+            obj.position = (last.get(group) or 0) + POSITION_GAP
+        last[group] = max(last.get(group) or 0, obj.position)
+
+
+def position_between(lower, upper):
+    # None when there is no free integer left between the two neighbours
+    lower = lower or 0
+    if upper is None:
+        return lower + POSITION_GAP
+    if upper - lower > 1:
+        return (lower + upper) // 2
+    return None
+
+
+def respace(siblings):
+    objects = list(siblings.order_by('position', 'id').only('id', 'position'))
+    for index, obj in enumerate(objects, start=1):
+        obj.position = index * POSITION_GAP
+        obj.version = F('version') + 1
+    siblings.model.objects.bulk_update(objects, ['position', 'version'], batch_size=1000)
+    return objects
+
+
+def place(obj, siblings, before=None, after=None):
+    """
+    Sets obj.position so that it sorts right after `after`, right before `before`,
+    or after every sibling when neither is given. Does not save obj, returns the
+    siblings whose position had to be rewritten.
+    """
+    siblings = siblings.exclude(pk=obj.pk)
+    respaced = []
+    for _ in range(2):
+        if after is not None:
+            lower = after.position
+            upper = siblings.filter(position__gt=lower).order_by('position').values_list('position', flat=True).first()
+        elif before is not None:
+            upper = before.position
+            lower = siblings.filter(position__lt=upper).order_by('-position').values_list('position', flat=True).first()
+        else:
+            lower, upper = siblings.aggregate(last=Max('position'))['last'], None
+
+        position = position_between(lower, upper)
+        if position is not None:
+            obj.position = position
+            return respaced
+        respaced = respace(siblings)
+        for anchor in (before, after):
+            if anchor is not None:
+                anchor.refresh_from_db(fields=['position'])
+    raise RuntimeError('Could not find a free position after re-spacing the siblings.')
+
+
+def rebuild_positions(model, group_fields, batch_size=1000):
+    # Numbers the rows of every sibling group in id order, e.g. to backfill a migration
+    rows = model.objects.order_by(*group_fields, 'id').values_list('id', *group_fields)
+    group = None
+    position = 0
+    batch = []
+    for pk, *values in rows.iterator(chunk_size=batch_size):
+        if values != group:
+            group = values
+            position = 0
+        position += POSITION_GAP
+        batch.append(model(pk=pk, position=position))
+        if len(batch) >= batch_size:
+            model.objects.bulk_update(batch, ['position'])
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, ['position'])
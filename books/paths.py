@@ -0,0 +1,62 @@
+"""
+Materialized path helpers for the Subsection tree.
+
+Every subsection stores the zero padded ids of its ancestors and itself,
+e.g. ``0000000001/0000000007/``. Subtrees are then a single ``LIKE 'prefix%'``
+range scan on an indexed column and ancestors can be read straight off the path.
+
+This module only depends on the model class it is given so it can be used from
+migrations as well as from the application code.
+"""
+
+PATH_SEGMENT_WIDTH = 10
+PATH_SEPARATOR = '/'
+
+
+def make_path(parent_path, pk):
+    return f'{parent_path or ""}{pk:0{PATH_SEGMENT_WIDTH}d}{PATH_SEPARATOR}'
+
+
+def path_depth(path):
+    return path.count(PATH_SEPARATOR) - 1
+
+
+def path_ids(path):
+    return [int(segment) for segment in path.split(PATH_SEPARATOR) if segment]
+
+
+def compute_paths(parents):
+    # parents maps subsection id -> parent id (or None). Resolves every path in
+    # O(n) by walking each chain once and memoizing the result.
+    paths = {}
+    for pk in parents:
+        chain = []
+        current = pk
+        while current is not None and current not in paths:
+            if current in chain:
+                raise ValueError(f'Subsection {current} is part of a parent cycle.')
+            chain.append(current)
+            current = parents.get(current)
+        prefix = paths.get(current, '')
+        for node in reversed(chain):
+            prefix = make_path(prefix, node)
+            paths[node] = prefix
+    return paths
+
+
+def rebuild_paths(model, batch_size=1000):
+    parents = dict(model.objects.values_list('id', 'parent_subsection_id').iterator(chunk_size=batch_size))
+    paths = compute_paths(parents)
+
+    updated = 0
+    batch = []
+    for pk, path in paths.items():
+        batch.append(model(pk=pk, path=path, depth=path_depth(path)))
+        if len(batch) >= batch_size:
+            model.objects.bulk_update(batch, ['path', 'depth'])
+            updated += len(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, ['path', 'depth'])
+        updated += len(batch)
+    return updated
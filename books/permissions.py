@@ -1,7 +1,135 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from rest_framework import permissions
+from backend.metrics import record_cache_access
+from .models import Book, Section, Subsection
+
+AUTHOR = 'author'
+COLLABORATOR = 'collaborator'
+
+# Roles are cached briefly in Redis; collaborator changes invalidate them (see books/signals.py)
+ROLE_CACHE_TIMEOUT = 60
+NO_ROLE = ''
+
+
+def role_cache_key(book_id, user_id):
+    return f'books:role:{book_id}:{user_id}'
+
+
+def get_book_id(obj):
+    if isinstance(obj, Book):
+        return obj.pk
+    if isinstance(obj, Section):
+        return obj.book_id
+    if isinstance(obj, Subsection):
+        return obj.section.book_id
+    raise TypeError(f'Cannot resolve the book of {obj!r}.')
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _request_memo(request):
+    memo = getattr(request, '_book_roles', None)
+    if memo is None:
+        memo = request._book_roles = {}
+    return memo
+
+
+def _prepare(user, memo, book_ids):
+    # Ids may come straight from request data, e.g. '12'
+    normalized = {book_id: _to_int(book_id) for book_id in book_ids}
+    missing = {book_id for book_id in normalized.values() if book_id is not None and book_id not in memo}
+    if user.pk is None:
+        missing = set()
+    return normalized, missing
+
+
+def _apply_cached(memo, missing, keys, cached):
+    record_cache_access(hits=len(cached), misses=len(keys) - len(cached))
+    for key, role in cached.items():
+        memo[keys[key]] = role or None
+        missing.discard(keys[key])
+
+
+def _roles_query(book_ids, user_id):
+    is_collaborator = Book.collaborators.through.objects.filter(book_id=OuterRef('pk'), user_id=user_id)
+    books = Book.objects.filter(pk__in=book_ids).annotate(is_collaborator=Exists(is_collaborator))
+    return books.values_list('pk', 'author_id', 'is_collaborator')
+
+
+def _apply_resolved(memo, rows, user_id):
+    resolved = {}
+    for book_id, author_id, collaborator in rows:
+        role = AUTHOR if author_id == user_id else COLLABORATOR if collaborator else None
+        memo[book_id] = role
+        resolved[role_cache_key(book_id, user_id)] = role or NO_ROLE
+    return resolved
+
+
+def resolve_user_book_roles(user, book_ids, memo=None):
+    """
+    Returns a dict mapping each book id to the role of `user` on it (AUTHOR,
+    COLLABORATOR or None). Roles already in `memo` are reused, then read from the
+    cache, and only the remaining books are resolved with one query.
+    """
+    memo = {} if memo is None else memo
+    normalized, missing = _prepare(user, memo, book_ids)
+
+    if missing:
+        keys = {role_cache_key(book_id, user.pk): book_id for book_id in missing}
+        _apply_cached(memo, missing, keys, cache.get_many(keys))
+
+    if missing:
+        resolved = _apply_resolved(memo, _roles_query(missing, user.pk), user.pk)
+        cache.set_many(resolved, timeout=ROLE_CACHE_TIMEOUT)
+
+    return {book_id: memo.get(normalized[book_id]) for book_id in book_ids}
+
+
+def resolve_book_roles(request, book_ids):
+    # The requesting user's roles, memoized on the request
+    return resolve_user_book_roles(request.user, book_ids, _request_memo(request))
+
+
+async def aresolve_book_roles(request, book_ids):
+    # Same as resolve_book_roles, for async views
+    user_id = request.user.pk
+    memo = _request_memo(request)
+    normalized, missing = _prepare(request.user, memo, book_ids)
+
+    if missing:
+        keys = {role_cache_key(book_id, user_id): book_id for book_id in missing}
+        _apply_cached(memo, missing, keys, await cache.aget_many(keys))
+
+    if missing:
+        rows = [row async for row in _roles_query(missing, user_id)]
+        await cache.aset_many(_apply_resolved(memo, rows, user_id), timeout=ROLE_CACHE_TIMEOUT)
+
+    return {book_id: memo.get(normalized[book_id]) for book_id in book_ids}
+
+
+def resolve_book_role(request, book_id):
+    return resolve_book_roles(request, [book_id])[book_id]
+
+
+async def aresolve_book_role(request, book_id):
+    return (await aresolve_book_roles(request, [book_id]))[book_id]
+
+
+def invalidate_book_roles(book_ids, user_ids):
+    # After commit, like bump_generation(), so the old role cannot be cached again meanwhile
+    keys = [role_cache_key(book_id, user_id) for book_id in book_ids for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
 
 class IsAuthorOrCollaborator(permissions.BasePermission):
     
     def has_object_permission(self, request, view, obj):
         # Check if the user is the author or a collaborator of the book
-        return request.user == obj.book.author or request.user in obj.book.collaborators.all()
\ No newline at end of file
+        return resolve_book_role(request, get_book_id(obj)) is not None
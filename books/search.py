@@ -0,0 +1,153 @@
+"""
+Full-text search over book, section and subsection titles.
+
+Titles are copied into SearchDocument, which is kept up to date incrementally
+(books/signals.py for single saves and deletes, explicit index_objects() calls for
+bulk writes). The full-text index itself depends on the database:
+
+* SQLite: an FTS5 external content table kept in sync by triggers, ranked with bm25.
+* PostgreSQL: a GIN index on to_tsvector('simple', title), ranked with ts_rank.
+* Anything else falls back to a case insensitive substring match.
+"""
+import re
+
+from django.apps import apps as django_apps
+from django.db import connection
+
+FTS_TABLE = 'books_searchdocument_fts'
+TSVECTOR_INDEX = 'books_searchdocument_title_tsv'
+
+SQLITE_SCHEMA = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(title, content='books_searchdocument', content_rowid='id')",
+    f"""CREATE TRIGGER books_searchdocument_ai AFTER INSERT ON books_searchdocument BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title) VALUES (new.id, new.title);
+    END""",
+    f"""CREATE TRIGGER books_searchdocument_ad AFTER DELETE ON books_searchdocument BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title) VALUES ('delete', old.id, old.title);
+    END""",
+    f"""CREATE TRIGGER books_searchdocument_au AFTER UPDATE ON books_searchdocument BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title) VALUES ('delete', old.id, old.title);
+        INSERT INTO {FTS_TABLE}(rowid, title) VALUES (new.id, new.title);
+    END""",
+]
+SQLITE_DROP_SCHEMA = [
+    'DROP TRIGGER IF EXISTS books_searchdocument_ai',
+    'DROP TRIGGER IF EXISTS books_searchdocument_ad',
+    'DROP TRIGGER IF EXISTS books_searchdocument_au',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+POSTGRESQL_SCHEMA = [
+    f"CREATE INDEX {TSVECTOR_INDEX} ON books_searchdocument USING GIN (to_tsvector('simple', title))",
+]
+POSTGRESQL_DROP_SCHEMA = [
+    f'DROP INDEX IF EXISTS {TSVECTOR_INDEX}',
+]
+
+
+def create_search_schema(schema_editor):
+    statements = {'sqlite': SQLITE_SCHEMA, 'postgresql': POSTGRESQL_SCHEMA}
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_search_schema(schema_editor):
+    statements = {'sqlite': SQLITE_DROP_SCHEMA, 'postgresql': POSTGRESQL_DROP_SCHEMA}
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def _documents(objects, apps):
+    SearchDocument = apps.get_model('books', 'SearchDocument')
+    Section = apps.get_model('books', 'Section')
+
+    section_ids = {obj.section_id for obj in objects if obj._meta.model_name == 'subsection'}
+    section_books = dict(Section.objects.filter(pk__in=section_ids).values_list('pk', 'book_id')) if section_ids else {}
+
+    for obj in objects:
+        kind = obj._meta.model_name
+        if kind == 'book':
+            book_id = obj.pk
+        elif kind == 'section':
+            book_id = obj.book_id
+        else:
+            book_id = section_books[obj.section_id]
+        yield SearchDocument(kind=kind, object_id=obj.pk, book_id=book_id, title=obj.title)
+
+
+def index_objects(objects, apps=django_apps):
+    """
+    Adds or refreshes the search documents of the given books, sections and subsections.
+    """
+    SearchDocument = apps.get_model('books', 'SearchDocument')
+    documents = list(_documents(objects, apps))
+    if not documents:
+        return
+
+    for kind in {document.kind for document in documents}:
+        SearchDocument.objects.filter(kind=kind, object_id__in=[d.object_id for d in documents if d.kind == kind]).delete()
+    SearchDocument.objects.bulk_create(documents, batch_size=1000)
+
+
+def unindex_objects(kind, object_ids, apps=django_apps):
+    apps.get_model('books', 'SearchDocument').objects.filter(kind=kind, object_id__in=object_ids).delete()
+
+
+def rebuild_search_index(apps=django_apps, batch_size=1000):
+    SearchDocument = apps.get_model('books', 'SearchDocument')
+    SearchDocument.objects.all().delete()
+
+    count = 0
+    for model_name in ('Book', 'Section', 'Subsection'):
+        batch = []
+        for obj in apps.get_model('books', model_name).objects.order_by('pk').iterator(chunk_size=batch_size):
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                index_objects(batch, apps)
+                count += len(batch)
+                batch = []
+        index_objects(batch, apps)
+        count += len(batch)
+    return count
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def search_documents(user, query, limit, offset=0):
+    """
+    Returns up to `limit` SearchDocuments matching every word of `query` (as a
+    prefix), best matches first, restricted to the books `user` can access.
+    """
+    from .models import Book, SearchDocument
+
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    accessible_sql, accessible_params = Book.objects.accessible_to(user).values('pk').query.sql_with_params()
+    table = SearchDocument._meta.db_table
+
+    if connection.vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        sql = f"""
+            SELECT d.id, d.kind, d.object_id, d.book_id, d.title FROM {FTS_TABLE}
+            JOIN {table} d ON d.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s AND d.book_id IN ({accessible_sql})
+            ORDER BY bm25({FTS_TABLE}), d.id LIMIT %s OFFSET %s
+        """
+        return list(SearchDocument.objects.raw(sql, [match, *accessible_params, limit, offset]))
+
+    if connection.vendor == 'postgresql':
+        match = ' & '.join(f'{term}:*' for term in terms)
+        sql = f"""
+            SELECT d.id, d.kind, d.object_id, d.book_id, d.title FROM {table} d
+            WHERE to_tsvector('simple', d.title) @@ to_tsquery('simple', %s) AND d.book_id IN ({accessible_sql})
+            ORDER BY ts_rank(to_tsvector('simple', d.title), to_tsquery('simple', %s)) DESC, d.id LIMIT %s OFFSET %s
+        """
+        return list(SearchDocument.objects.raw(sql, [match, *accessible_params, match, limit, offset]))
+
+    documents = SearchDocument.objects.filter(book__in=Book.objects.accessible_to(user).values('pk'))
+    for term in terms:
+        documents = documents.filter(title__icontains=term)
+    return list(documents.order_by('title', 'id')[offset:offset + limit])
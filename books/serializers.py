@@ -1,12 +1,30 @@
+from django.contrib.auth import get_user_model
 from rest_framework import serializers
-from .models import Book, Section, Subsection
+from rest_framework.exceptions import PermissionDenied
+from .models import Book, BookChange, Job, Section, Subsection
+from .permissions import AUTHOR, resolve_book_roles
 
-class BookSerializer(serializers.ModelSerializer):
+User = get_user_model()
+
+class DynamicFieldsMixin:
+    """
+    Takes an optional `fields` argument listing the only fields to serialize.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+class BookSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Book
         fields = '__all__'
 
-class SectionSerializer(serializers.ModelSerializer):
+class SectionSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Section
         fields = '__all__'
@@ -14,10 +32,137 @@ class SectionSerializer(serializers.ModelSerializer):
             'book': {'required': False}  # Make the book field optional for updates
         }
 
-class SubsectionSerializer(serializers.ModelSerializer):
+    def validate_book(self, value):
+        # Moving a section to another book takes it out of one and adds it to the other: author only, on both
+        if self.instance is not None and value.pk != self.instance.book_id:
+            roles = resolve_book_roles(self.context['request'], [self.instance.book_id, value.pk])
+            if any(role != AUTHOR for role in roles.values()):
+                raise PermissionDenied("Only the author of both books can move a section between them.")
+        return value
+
+    def update(self, instance, validated_data):
+        # Moved to another book: append it after the sections already there
+        previous_book_id = instance.book_id
+        if 'book' in validated_data and validated_data['book'].pk != instance.book_id:
+            instance.position = 0
+        instance = super().update(instance, validated_data)
+        if instance.book_id != previous_book_id:
+            # The section is logged in its new book on save, its subsections moved with it
+            subsection_ids = instance.subsections.values_list('pk', flat=True)
+            BookChange.objects.log([
+                (previous_book_id, BookChange.SECTION, instance.pk, BookChange.DELETE),
+                *((instance.book_id, BookChange.SUBSECTION, pk, BookChange.UPSERT) for pk in subsection_ids),
+            ])
+        return instance
+
+class SubsectionSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Subsection
         fields = '__all__'
         extra_kwargs = {
             'section': {'required': False}  # Make the section field optional for updates
-        }
\ No newline at end of file
+        }
+
+    def validate(self, data):
+        if self.instance is None:
+            parent = data.get('parent_subsection')
+            if parent is not None and parent.section_id != getattr(data.get('section'), 'pk', None):
+                raise serializers.ValidationError({'parent_subsection': ["Must be a subsection of the same section."]})
+            return data
+
+        # Changing the section or parent is a move, with the checks of the move endpoint
+        destination = {}
+        if 'section' in data and data['section'].pk != self.instance.section_id:
+            destination['section'] = data['section'].pk
+        parent = data.get('parent_subsection', self.instance.parent_subsection_id)
+        if getattr(parent, 'pk', parent) != self.instance.parent_subsection_id:
+            destination['parent_subsection'] = getattr(parent, 'pk', None)
+        data.pop('section', None)
+        data.pop('parent_subsection', None)
+        if destination:
+            move = SubsectionMoveSerializer(data=destination, context={'subsection': self.instance})
+            move.is_valid(raise_exception=True)
+            data['move'] = move.validated_data
+        return data
+
+    def update(self, instance, validated_data):
+        move = validated_data.pop('move', None)
+        instance = super().update(instance, validated_data)
+        if move is not None:
+            # Appended after its new siblings, together with its subtree
+            instance.move(**move)
+        return instance
+
+class SectionMoveSerializer(serializers.Serializer):
+    """
+    Where to move a section within its book: right before or after a sibling, or
+    last when neither is given.
+    """
+    before = serializers.PrimaryKeyRelatedField(queryset=Section.objects.all(), required=False)
+    after = serializers.PrimaryKeyRelatedField(queryset=Section.objects.all(), required=False)
+
+    def validate(self, data):
+        section = self.context['section']
+        if 'before' in data and 'after' in data:
+            raise serializers.ValidationError("Give either before or after, not both.")
+        anchor = data.get('before') or data.get('after')
+        if anchor is not None and (anchor.book_id != section.book_id or anchor.pk == section.pk):
+            raise serializers.ValidationError("before and after must be another section of the same book.")
+        return data
+
+class SubsectionMoveSerializer(serializers.Serializer):
+    """
+    Where to move a subsection: under `parent_subsection` (null for the top level
+    of `section`), right before or after a sibling, or last when neither is given.
+    Anything left out keeps its current value, or is taken from the sibling.
+    """
+    section = serializers.PrimaryKeyRelatedField(queryset=Section.objects.all(), required=False)
+    parent_subsection = serializers.PrimaryKeyRelatedField(queryset=Subsection.objects.select_related('section'), required=False, allow_null=True)
+    before = serializers.PrimaryKeyRelatedField(queryset=Subsection.objects.select_related('section'), required=False)
+    after = serializers.PrimaryKeyRelatedField(queryset=Subsection.objects.select_related('section'), required=False)
+
+    def validate(self, data):
+        subsection = self.context['subsection']
+        if 'before' in data and 'after' in data:
+            raise serializers.ValidationError("Give either before or after, not both.")
+        anchor = data.get('before') or data.get('after')
+
+        if 'parent_subsection' in data:
+            parent = data['parent_subsection']
+        elif anchor is not None:
+            parent = anchor.parent_subsection
+        elif 'section' in data:
+            parent = None
+        else:
+            parent = subsection.parent_subsection
+
+        if parent is not None:
+            section = parent.section
+            if data.get('section', section) != section:
+                raise serializers.ValidationError({'section': ["Must be the section of the parent subsection."]})
+            if parent.pk == subsection.pk or parent.is_descendant_of(subsection):
+                raise serializers.ValidationError({'parent_subsection': ["A subsection cannot be nested under itself or its descendants."]})
+        else:
+            section = data.get('section') or (anchor.section if anchor is not None else subsection.section)
+
+        if section.book_id != subsection.section.book_id:
+            raise serializers.ValidationError({'section': ["Subsections can only be moved within their book."]})
+        if anchor is not None and (
+            anchor.pk == subsection.pk
+            or anchor.parent_subsection_id != (parent.pk if parent else None)
+            or anchor.section_id != section.pk
+        ):
+            raise serializers.ValidationError("before and after must be a sibling at the destination.")
+
+        return {'section': section, 'parent': parent, 'before': data.get('before'), 'after': data.get('after')}
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'payload', 'result', 'error', 'attempts', 'max_attempts', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+class CollaboratorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username']
@@ -0,0 +1,95 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .cache import bump_generation
+from .models import Book, BookChange, SearchDocument, Section, Subsection
+from .permissions import invalidate_book_roles
+from .search import index_objects, unindex_objects
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Section)
+@receiver(post_save, sender=Subsection)
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Section)
+@receiver(post_delete, sender=Subsection)
+def invalidate_book_cache(sender, **kwargs):
+    bump_generation()
+
+
+@receiver(post_save, sender=Book)
+def touch_book(sender, instance, created, **kwargs):
+    if not created:
+        Book.objects.filter(pk=instance.pk).touch()
+
+
+@receiver(post_save, sender=Section)
+@receiver(post_delete, sender=Section)
+def log_section_change(sender, instance, signal, **kwargs):
+    action = BookChange.DELETE if signal is post_delete else BookChange.UPSERT
+    BookChange.objects.log([(instance.book_id, BookChange.SECTION, instance.pk, action)])
+
+
+@receiver(post_save, sender=Subsection)
+@receiver(post_delete, sender=Subsection)
+def log_subsection_change(sender, instance, signal, **kwargs):
+    action = BookChange.DELETE if signal is post_delete else BookChange.UPSERT
+    BookChange.objects.log([(instance.section.book_id, BookChange.SUBSECTION, instance.pk, action)])
+
+
+@receiver(pre_save, sender=Book)
+def remember_previous_author(sender, instance, **kwargs):
+    # Books not read from the database (e.g. built with a pk) look their author up
+    if instance.pk is not None and getattr(instance, '_loaded_author_id', None) is None:
+        instance._loaded_author_id = Book.objects.filter(pk=instance.pk).values_list('author_id', flat=True).first()
+
+
+@receiver(post_save, sender=Book)
+def invalidate_author_role(sender, instance, created, **kwargs):
+    # The author may have changed, the previous one must not keep a cached AUTHOR role
+    if not created:
+        invalidate_book_roles([instance.pk], {instance.author_id, getattr(instance, '_loaded_author_id', None)} - {None})
+    instance._loaded_author_id = instance.author_id
+
+
+@receiver(m2m_changed, sender=Book.collaborators.through)
+def invalidate_book_cache_on_collaborators_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # The cleared ids are only known before the rows are gone
+        if reverse:
+            instance._cleared_pks = list(instance.collaborating_books.values_list('pk', flat=True))
+        else:
+            instance._cleared_pks = list(instance.collaborators.values_list('pk', flat=True))
+        return
+
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    bump_generation()
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_pks', [])
+    if reverse:
+        Book.objects.filter(pk__in=pk_set or []).touch()
+        invalidate_book_roles(pk_set or [], [instance.pk])
+    else:
+        Book.objects.filter(pk=instance.pk).touch()
+        invalidate_book_roles([instance.pk], pk_set or [])
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Section)
+@receiver(post_save, sender=Subsection)
+def update_search_index(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is None or 'title' in update_fields:
+        index_objects([instance])
+    if sender is Section and not created and (update_fields is None or 'book' in update_fields):
+        # The section may have moved to another book, its subsections' documents follow it
+        SearchDocument.objects.filter(
+            kind=SearchDocument.SUBSECTION, object_id__in=instance.subsections.values('pk'),
+        ).exclude(book_id=instance.book_id).update(book_id=instance.book_id)
+
+
+@receiver(post_delete, sender=Section)
+@receiver(post_delete, sender=Subsection)
+def remove_from_search_index(sender, instance, **kwargs):
+    # Documents of a deleted book go away with it through their foreign key
+    unindex_objects(sender._meta.model_name, [instance.pk])
@@ -1,11 +1,35 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework import status
-from .models import Book, Section, Subsection
+from backend.testing import QueryBudgetTestCase
+from .benchmark import BENCHMARKS, run_benchmarks, seed_benchmark_data
+from .bulk import _update_titles
+from .cache import get_generation
+from .deletion import delete_books, delete_sections, delete_subsections
+from .duplication import duplicate_book
+from .jobs import JOB_HANDLERS, claim_job, enqueue, remove_expired_results, requeue_stale_jobs, run_job
+from .models import Book, BookChange, ImportCheckpoint, Job, SearchDocument, Section, Subsection, VersionConflict
+from .ordering import POSITION_GAP
+from .paths import make_path
 
 class BookAPITestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.user_author = User.objects.create_user(username='author', password='password123')
         self.user_collaborator = User.objects.create_user(username='collaborator', password='password123')
@@ -52,7 +76,7 @@ class BookAPITestCase(TestCase):
 
     def test_edit_section_as_author(self):
         self.client.force_authenticate(user=self.user_author)
-        response = self.client.put(f'/api/sections/{self.section.id}/', {'title': 'Updated Section'})
+        response = self.client.put(f'/api/sections/{self.section.id}/', {'version': self.section.version, 'title': 'Updated Section'})
         if response.status_code != status.HTTP_200_OK:
             print(f"Response Content: {response.content}")
 
@@ -60,27 +84,27 @@ class BookAPITestCase(TestCase):
 
     def test_edit_section_as_collaborator(self):
         self.client.force_authenticate(user=self.user_collaborator)
-        response = self.client.put(f'/api/sections/{self.section.id}/', {'title': 'Updated Section'})
+        response = self.client.put(f'/api/sections/{self.section.id}/', {'version': self.section.version, 'title': 'Updated Section'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
     def test_edit_section_as_regular_user(self):
         self.client.force_authenticate(user=self.user_regular)
-        response = self.client.put(f'/api/sections/{self.section.id}/', {'title': 'Updated Section'})
+        response = self.client.put(f'/api/sections/{self.section.id}/', {'version': self.section.version, 'title': 'Updated Section'})
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
     def test_edit_subsection_as_author(self):
         self.client.force_authenticate(user=self.user_author)
-        response = self.client.put(f'/api/subsections/{self.subsection.id}/', {'title': 'Updated Subsection'})
+        response = self.client.put(f'/api/subsections/{self.subsection.id}/', {'version': self.subsection.version, 'title': 'Updated Subsection'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
     def test_edit_subsection_as_collaborator(self):
         self.client.force_authenticate(user=self.user_collaborator)
-        response = self.client.put(f'/api/subsections/{self.subsection.id}/', {'title': 'Updated Subsection'})
+        response = self.client.put(f'/api/subsections/{self.subsection.id}/', {'version': self.subsection.version, 'title': 'Updated Subsection'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
     def test_edit_subsection_as_regular_user(self):
         self.client.force_authenticate(user=self.user_regular)
-        response = self.client.put(f'/api/subsections/{self.subsection.id}/', {'title': 'Updated Subsection'})
+        response = self.client.put(f'/api/subsections/{self.subsection.id}/', {'version': self.subsection.version, 'title': 'Updated Subsection'})
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
     def test_delete_section_as_author(self):
@@ -159,4 +183,1571 @@ class BookAPITestCase(TestCase):
         response = self.client.post(f'/api/books/{self.book.id}/remove-collaborator/{self.user_author.id}/')
 
         # Check for a permission denied response
-        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+class BookTreeAPITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user_author = User.objects.create_user(username='author', password='password123')
+        self.user_collaborator = User.objects.create_user(username='collaborator', password='password123')
+        self.user_regular = User.objects.create_user(username='regular', password='password123')
+        self.book = Book.objects.create(title='Test Book', author=self.user_author)
+        self.book.collaborators.add(self.user_collaborator)
+        self.section = Section.objects.create(title='Test Section', book=self.book)
+        self.subsection = Subsection.objects.create(title='Test Subsection', section=self.section)
+        self.child = Subsection.objects.create(title='Child', section=self.section, parent_subsection=self.subsection)
+        self.grandchild = Subsection.objects.create(title='Grandchild', section=self.section, parent_subsection=self.child)
+
+    def test_get_tree_as_collaborator(self):
+        self.client.force_authenticate(user=self.user_collaborator)
+        response = self.client.get(f'/api/books/{self.book.id}/tree/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        section = response.data['sections'][0]
+        self.assertEqual(section['id'], self.section.id)
+        subsection = section['subsections'][0]
+        self.assertEqual(subsection['id'], self.subsection.id)
+        self.assertEqual(subsection['subsections'][0]['id'], self.child.id)
+        self.assertEqual(subsection['subsections'][0]['subsections'][0]['id'], self.grandchild.id)
+
+    def test_get_tree_query_count_is_bounded(self):
+        for i in range(10):
+            Subsection.objects.create(title=f'Extra {i}', section=self.section, parent_subsection=self.grandchild)
+
+        self.client.force_authenticate(user=self.user_author)
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/api/books/{self.book.id}/tree/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_get_tree_as_regular_user(self):
+        self.client.force_authenticate(user=self.user_regular)
+        response = self.client.get(f'/api/books/{self.book.id}/tree/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_get_tree_missing_book(self):
+        self.client.force_authenticate(user=self.user_author)
+        response = self.client.get('/api/books/0/tree/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SubsectionPathTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user_author = User.objects.create_user(username='author', password='password123')
+        self.book = Book.objects.create(title='Test Book', author=self.user_author)
+        self.section = Section.objects.create(title='Test Section', book=self.book)
+        self.root = Subsection.objects.create(title='Root', section=self.section)
+        self.child = Subsection.objects.create(title='Child', section=self.section, parent_subsection=self.root)
+        self.grandchild = Subsection.objects.create(title='Grandchild', section=self.section, parent_subsection=self.child)
+        self.other_root = Subsection.objects.create(title='Other Root', section=self.section)
+
+    def test_paths_are_set_on_create(self):
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.depth, 2)
+        self.assertTrue(self.grandchild.path.startswith(self.child.path))
+        self.assertEqual(list(self.grandchild.get_ancestors()), [self.root, self.child])
+        self.assertEqual(set(self.root.get_descendants()), {self.child, self.grandchild})
+
+    def test_move_rewrites_descendant_paths(self):
+        self.child.parent_subsection = self.other_root
+        self.child.save()
+
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.depth, 2)
+        self.assertTrue(self.grandchild.path.startswith(self.other_root.path))
+        self.assertEqual(list(self.root.get_descendants()), [])
+        self.assertEqual(set(self.other_root.get_descendants()), {self.child, self.grandchild})
+
+    def test_move_under_own_descendant_is_rejected(self):
+        self.client.force_authenticate(user=self.user_author)
+        response = self.client.put(f'/api/subsections/{self.root.id}/', {'version': self.root.version, 'title': 'Root', 'parent_subsection': self.grandchild.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rebuild_subsection_paths_command(self):
+        Subsection.objects.update(path='', depth=0)
+        call_command('rebuild_subsection_paths', stdout=StringIO())
+
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.depth, 2)
+        self.assertEqual(set(self.root.get_descendants()), {self.child, self.grandchild})
+
+
+class BookListAPITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user_author = User.objects.create_user(username='author', password='password123')
+        self.user_collaborator = User.objects.create_user(username='collaborator', password='password123')
+        for i in range(5):
+            book = Book.objects.create(title=f'Book {i}', author=self.user_author)
+            book.collaborators.add(self.user_collaborator)
+        self.client.force_authenticate(user=self.user_author)
+
+    def test_list_books_is_cursor_paginated(self):
+        response = self.client.get('/api/books/', {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([book['title'] for book in response.data['results']], ['Book 0', 'Book 1'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([book['title'] for book in response.data['results']], ['Book 2', 'Book 3'])
+
+    def test_list_books_with_field_projection(self):
+        response = self.client.get('/api/books/', {'fields': 'id,title'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title'})
+
+    def test_list_books_prefetches_collaborators(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/books/', {'fields': 'id,collaborators'})
+        self.assertEqual(response.data['results'][0]['collaborators'], [self.user_collaborator.id])
+
+    def test_list_books_with_unknown_field(self):
+        response = self.client.get('/api/books/', {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_books_cache_is_invalidated_on_write(self):
+        response = self.client.get('/api/books/', {'fields': 'id,title'})
+        self.assertEqual(len(response.data['results']), 5)
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/books/', {'fields': 'id,title'})
+
+        # The generation is bumped once the write commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/books/', {'title': 'New Book'})
+        response = self.client.get('/api/books/', {'fields': 'id,title'})
+        self.assertEqual(len(response.data['results']), 6)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.filter(title='New Book').first().collaborators.add(self.user_collaborator)
+        with self.assertNumQueries(1):
+            self.client.get('/api/books/', {'fields': 'id,title'})
+
+    def test_generation_is_bumped_when_the_write_commits(self):
+        generation = get_generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.create(title='Uncommitted', author=self.user_author)
+            # A reader caching now would still see the previous data
+            self.assertEqual(get_generation(), generation)
+        self.assertGreater(get_generation(), generation)
+
+    def test_list_books_cache_is_per_user(self):
+        self.client.get('/api/books/', {'fields': 'id,title'})
+
+        self.client.force_authenticate(user=self.user_collaborator)
+        with self.assertNumQueries(1):
+            self.client.get('/api/books/', {'fields': 'id,title'})
+
+
+class BookRoleTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user_author = User.objects.create_user(username='author', password='password123')
+        self.user_collaborator = User.objects.create_user(username='collaborator', password='password123')
+        self.user_regular = User.objects.create_user(username='regular', password='password123')
+        self.book = Book.objects.create(title='Test Book', author=self.user_author)
+        self.book.collaborators.add(self.user_collaborator)
+        self.section = Section.objects.create(title='Test Section', book=self.book)
+        self.subsection = Subsection.objects.create(title='Test Subsection', section=self.section)
+
+    def test_get_as_regular_user_is_forbidden(self):
+        self.client.force_authenticate(user=self.user_regular)
+        for url in (f'/api/books/{self.book.id}/', f'/api/sections/{self.section.id}/', f'/api/subsections/{self.subsection.id}/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_role_is_cached_between_requests(self):
+        self.client.force_authenticate(user=self.user_collaborator)
+        self.client.get(f'/api/sections/{self.section.id}/')
+
+        # Only the section itself is loaded, the role comes from the cache
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/sections/{self.section.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_removing_collaborator_invalidates_role(self):
+        self.client.force_authenticate(user=self.user_collaborator)
+        response = self.client.get(f'/api/sections/{self.section.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(user=self.user_author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/books/{self.book.id}/remove-collaborator/{self.user_collaborator.id}/')
+
+        self.client.force_authenticate(user=self.user_collaborator)
+        response = self.client.get(f'/api/sections/{self.section.id}/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+    def test_changing_the_author_invalidates_the_previous_authors_role(self):
+        for make_book in (
+            lambda: Book.objects.get(pk=self.book.pk),
+            lambda: Book(pk=self.book.pk, title='Test Book', author_id=self.user_regular.pk),
+        ):
+            Book.objects.filter(pk=self.book.pk).update(author=self.user_author)
+            cache.clear()
+            self.client.force_authenticate(user=self.user_author)
+            self.assertEqual(self.client.get(f'/api/books/{self.book.id}/').status_code, status.HTTP_200_OK)
+
+            book = make_book()
+            book.author = self.user_regular
+            with self.captureOnCommitCallbacks(execute=True):
+                book.save()
+
+            response = self.client.delete(f'/api/books/{self.book.id}/')
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+class BulkAPITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user_author = User.objects.create_user(username='author', password='password123')
+        self.user_collaborator = User.objects.create_user(username='collaborator', password='password123')
+        self.book = Book.objects.create(title='Test Book', author=self.user_author)
+        self.book.collaborators.add(self.user_collaborator)
+        self.section = Section.objects.create(title='Test Section', book=self.book)
+        self.subsection = Subsection.objects.create(title='Test Subsection', section=self.section)
+
+    def test_bulk_sections(self):
+        self.client.force_authenticate(user=self.user_author)
+        other = Section.objects.create(title='Other Section', book=self.book)
+        response = self.client.post('/api/sections/bulk/', {
+            'create': [{'book': self.book.id, 'title': 'A'}, {'book': self.book.id, 'title': 'B'}],
+            'update': [{'id': self.section.id, 'title': 'Renamed'}],
+            'delete': [other.id],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['status'] for item in response.data['create']], [201, 201])
+        self.assertEqual(response.data['update'][0]['title'], 'Renamed')
+        self.assertEqual(response.data['delete'][0], {'status': 204, 'id': other.id})
+        self.assertEqual(set(self.book.sections.values_list('title', flat=True)), {'Renamed', 'A', 'B'})
+
+    def test_bulk_sections_is_all_or_nothing(self):
+        self.client.force_authenticate(user=self.user_collaborator)
+        response = self.client.post('/api/sections/bulk/', {
+            'create': [{'book': self.book.id, 'title': 'A'}],
+            'update': [{'id': self.section.id, 'title': 'Renamed'}],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['create'][0]['status'], 403)
+        self.assertEqual(response.data['update'][0]['status'], 424)
+        self.assertFalse(Section.objects.filter(title__in=['A', 'Renamed']).exists())
+
+    def test_bulk_subsections_with_nested_creates(self):
+        self.client.force_authenticate(user=self.user_author)
+        creates = [{'section': self.section.id, 'title': 'Root', 'parent_subsection': self.subsection.id}]
+        for depth in range(1, 20):
+            creates.append({'section': self.section.id, 'title': f'Level {depth}', 'parent_ref': depth - 1})
+
+        # A fixed number of lookups plus one INSERT per nesting level
+        with self.assertNumQueries(32):
+            response = self.client.post('/api/subsections/bulk/', {'create': creates}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        deepest = Subsection.objects.get(pk=response.data['create'][-1]['id'])
+        self.assertEqual(deepest.depth, 20)
+        self.assertEqual(len(deepest.get_ancestors()), 20)
+
+    def test_bulk_subsections_parent_must_be_in_the_same_section(self):
+        self.client.force_authenticate(user=self.user_author)
+        other = Section.objects.create(title='Other', book=self.book)
+        parent = Subsection.objects.create(title='Parent', section=self.section)
+        response = self.client.post('/api/subsections/bulk/', {'create': [
+            {'section': other.id, 'title': 'Stray', 'parent_subsection': parent.id},
+            {'section': self.section.id, 'title': 'Root'},
+            {'section': other.id, 'title': 'Stray child', 'parent_ref': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([item['status'] for item in response.data['create']], [400, 424, 400])
+        self.assertFalse(Subsection.objects.filter(section=other).exists())
+
+    def test_bulk_references_must_be_ids(self):
+        self.client.force_authenticate(user=self.user_author)
+        response = self.client.post('/api/sections/bulk/', {'create': [
+            {'book': 'abc', 'title': 'A'}, {'book': [self.book.id], 'title': 'B'}, {'book': 1.5, 'title': 'C'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([item['errors'] for item in response.data['create']], [{'book': ['A valid integer is required.']}] * 3)
+
+        response = self.client.post('/api/subsections/bulk/', {'create': [
+            {'section': 'abc', 'title': 'A'},
+            {'section': [self.section.id], 'title': 'B'},
+            {'section': self.section.id, 'title': 'C', 'parent_subsection': [self.subsection.id]},
+            {'section': str(self.section.id), 'title': 'D'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([item['status'] for item in response.data['create']], [400, 400, 400, 424])
+        self.assertEqual(response.data['create'][2]['errors'], {'parent_subsection': ['A valid integer is required.']})
+
+    def test_bulk_subsections_validates_ownership(self):
+        self.client.force_authenticate(user=self.user_collaborator)
+        response = self.client.post('/api/subsections/bulk/', {
+            'update': [{'id': self.subsection.id, 'title': 'Renamed'}],
+            'delete': [self.subsection.id],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['delete'][0]['status'], 403)
+        self.subsection.refresh_from_db()
+        self.assertEqual(self.subsection.title, 'Test Subsection')
+
+
+class ExportAPITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user_author = User.objects.create_user(username='author', password='password123')
+        self.user_collaborator = User.objects.create_user(username='collaborator', password='password123')
+        self.user_regular = User.objects.create_user(username='regular', password='password123')
+        self.book = Book.objects.create(title='Test Book', author=self.user_author)
+        self.book.collaborators.add(self.user_collaborator)
+        self.other_book = Book.objects.create(title='Other Book', author=self.user_regular)
+        self.section = Section.objects.create(title='Test Section', book=self.book)
+        self.subsection = Subsection.objects.create(title='Test Subsection', section=self.section)
+        self.child = Subsection.objects.create(title='Child', section=self.section, parent_subsection=self.subsection)
+
+    def read_ndjson(self, response):
+        content = b''.join(response.streaming_content).decode()
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_export_book_as_ndjson(self):
+        self.client.force_authenticate(user=self.user_collaborator)
+        response = self.client.get(f'/api/books/{self.book.id}/export/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+        records = self.read_ndjson(response)
+        self.assertEqual([record['type'] for record in records], ['book', 'section', 'subsection', 'subsection'])
+        self.assertEqual(records[0]['collaborators'], [self.user_collaborator.id])
+        self.assertEqual(records[3]['parent_subsection'], self.subsection.id)
+
+    def test_export_book_as_json(self):
+        self.client.force_authenticate(user=self.user_author)
+        response = self.client.get(f'/api/books/{self.book.id}/export/', {'as': 'json'})
+        records = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(records), 4)
+
+    def test_export_book_as_regular_user(self):
+        self.client.force_authenticate(user=self.user_regular)
+        response = self.client.get(f'/api/books/{self.book.id}/export/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_library_only_contains_accessible_books(self):
+        self.client.force_authenticate(user=self.user_collaborator)
+        records = self.read_ndjson(self.client.get('/api/books/export/'))
+        self.assertEqual([record['id'] for record in records if record['type'] == 'book'], [self.book.id])
+
+    def test_export_books_command(self):
+        out = StringIO()
+        call_command('export_books', '--user', 'regular', stdout=out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(records, [{'type': 'book', 'id': self.other_book.id, 'title': 'Other Book', 'author': self.user_regular.id, 'collaborators': []}])
+
+
+class ImportBooksCommandTestCase(TestCase):
+    def setUp(self):
+        self.user_author = User.objects.create_user(username='author', password='password123')
+        self.user_collaborator = User.objects.create_user(username='collaborator', password='password123')
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def ndjson(self, records):
+        return ''.join(json.dumps(record) + '\n' for record in records)
+
+    def outline(self):
+        records = [
+            {'type': 'book', 'id': 10, 'title': 'Imported', 'author': self.user_author.id, 'collaborators': [self.user_collaborator.id]},
+            {'type': 'section', 'id': 20, 'book': 10, 'title': 'Section'},
+            {'type': 'subsection', 'id': 30, 'section': 20, 'parent_subsection': None, 'title': 'Level 0'},
+        ]
+        for depth in range(1, 6):
+            records.append({'type': 'subsection', 'id': 30 + depth, 'section': 20, 'parent_subsection': 29 + depth, 'title': f'Level {depth}'})
+        return records
+
+    def test_import_refuses_parents_in_another_section(self):
+        other = {'type': 'section', 'id': 21, 'book': 10, 'title': 'Other'}
+        for batch_size in ('1', '100'):
+            records = self.outline()[:3] + [other, {'type': 'subsection', 'id': 40, 'section': 21, 'parent_subsection': 30, 'title': 'Stray'}]
+            with self.assertRaisesMessage(CommandError, "Line 5: parent subsection '30' is in another section."):
+                call_command('import_books', self.write('stray.ndjson', self.ndjson(records)), '--batch-size', batch_size, stdout=StringIO())
+        self.assertFalse(Subsection.objects.filter(title='Stray').exists())
+
+    def test_import_ndjson_across_batches(self):
+        path = self.write('books.ndjson', self.ndjson(self.outline()))
+        call_command('import_books', path, '--batch-size', '3', stdout=StringIO())
+
+        book = Book.objects.get(title='Imported')
+        self.assertEqual(list(book.collaborators.all()), [self.user_collaborator])
+        deepest = Subsection.objects.get(title='Level 5')
+        self.assertEqual(deepest.depth, 5)
+        self.assertEqual([s.title for s in deepest.get_ancestors()], [f'Level {depth}' for depth in range(5)])
+
+    def test_import_csv(self):
+        path = self.write('books.csv', '\n'.join([
+            'type,id,title,author,collaborators,book,section,parent_subsection',
+            f'book,1,From CSV,{self.user_author.id},{self.user_collaborator.id},,,',
+            'section,2,Section,,,1,,',
+            'subsection,3,Root,,,,2,',
+            'subsection,4,Child,,,,2,3',
+        ]))
+        call_command('import_books', path, stdout=StringIO())
+
+        child = Subsection.objects.get(title='Child')
+        self.assertEqual(child.parent_subsection.title, 'Root')
+        self.assertEqual(child.section.book.title, 'From CSV')
+
+    def test_import_resumes_from_checkpoint(self):
+        checkpoint = 'outline'
+        records = self.outline()
+        broken = records[:6] + [{'type': 'subsection', 'id': 99, 'section': 404, 'title': 'Broken'}]
+        with self.assertRaises(CommandError):
+            call_command('import_books', self.write('broken.ndjson', self.ndjson(broken)), '--batch-size', '3', '--checkpoint', checkpoint, stdout=StringIO())
+        self.assertEqual(Subsection.objects.count(), 4)
+        self.assertEqual(list(ImportCheckpoint.objects.filter(name=checkpoint).values_list('line', flat=True)), [3, 6])
+
+        call_command('import_books', self.write('fixed.ndjson', self.ndjson(records)), '--batch-size', '3', '--checkpoint', checkpoint, stdout=StringIO())
+        self.assertEqual(Book.objects.count(), 1)
+        self.assertEqual(Subsection.objects.count(), 6)
+        self.assertEqual(Subsection.objects.get(title='Level 5').depth, 5)
+
+
+class AsyncViewsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user_author = User.objects.create_user(username='author', password='password123')
+        self.user_regular = User.objects.create_user(username='regular', password='password123')
+        self.book = Book.objects.create(title='Test Book', author=self.user_author)
+        self.section = Section.objects.create(title='Test Section', book=self.book)
+        self.subsection = Subsection.objects.create(title='Test Subsection', section=self.section)
+
+    def auth(self, user):
+        # AsyncClient takes raw header names
+        return {'AUTHORIZATION': f'Bearer {RefreshToken.for_user(user).access_token}'}
+
+    async def test_async_detail_views(self):
+        headers = self.auth(self.user_author)
+        for url, title in (
+            (f'/api/async/books/{self.book.id}/', 'Test Book'),
+            (f'/api/async/sections/{self.section.id}/', 'Test Section'),
+            (f'/api/async/subsections/{self.subsection.id}/', 'Test Subsection'),
+        ):
+            response = await self.async_client.get(url, **headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()['title'], title)
+
+    async def test_async_tree(self):
+        response = await self.async_client.get(f'/api/async/books/{self.book.id}/tree/', **self.auth(self.user_author))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['sections'][0]['subsections'][0]['id'], self.subsection.id)
+
+    async def test_async_list(self):
+        response = await self.async_client.get('/api/async/books/', {'fields': 'id,title'}, **self.auth(self.user_author))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'], [{'id': self.book.id, 'title': 'Test Book'}])
+
+    async def test_async_list_filters_by_the_authenticated_user(self):
+        for user, count in ((self.user_author, 1), (self.user_regular, 0)):
+            response = await self.async_client.get('/api/async/books/', {'role': 'author'}, **self.auth(user))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()['count'], count)
+
+    async def test_async_views_check_permissions(self):
+        response = await self.async_client.get(f'/api/async/sections/{self.section.id}/', **self.auth(self.user_regular))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = await self.async_client.get(f'/api/async/sections/{self.section.id}/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = await self.async_client.get('/api/async/sections/0/', **self.auth(self.user_author))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SearchAPITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user_author = User.objects.create_user(username='author', password='password123')
+        self.user_regular = User.objects.create_user(username='regular', password='password123')
+        self.book = Book.objects.create(title='Gardening Basics', author=self.user_author)
+        self.section = Section.objects.create(title='Growing Tomatoes', book=self.book)
+        self.subsection = Subsection.objects.create(title='Tomato varieties', section=self.section)
+        self.other_book = Book.objects.create(title='Tomato Sauces', author=self.user_regular)
+        self.client.force_authenticate(user=self.user_author)
+
+    def search(self, query, **params):
+        response = self.client.get('/api/search/', {'q': query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_search_matches_titles_of_accessible_books(self):
+        results = self.search('tomat')['results']
+        self.assertEqual(
+            {(result['type'], result['id']) for result in results},
+            {('section', self.section.id), ('subsection', self.subsection.id)},
+        )
+
+    def test_search_index_follows_updates_and_deletes(self):
+        self.client.put(f'/api/subsections/{self.subsection.id}/', {'version': self.subsection.version, 'title': 'Pepper varieties'})
+        self.assertEqual([result['id'] for result in self.search('pepper')['results']], [self.subsection.id])
+        self.assertEqual(len(self.search('tomato')['results']), 1)
+
+        self.client.delete(f'/api/sections/{self.section.id}/')
+        self.assertEqual(self.search('pepper')['results'], [])
+
+    def test_search_indexes_bulk_creates(self):
+        self.client.post('/api/sections/bulk/', {'create': [{'book': self.book.id, 'title': 'Composting'}]}, format='json')
+        self.assertEqual(len(self.search('compost')['results']), 1)
+
+    def test_search_is_paginated(self):
+        for i in range(3):
+            Section.objects.create(title=f'Soil {i}', book=self.book)
+        data = self.search('soil', page_size=2)
+        self.assertEqual(len(data['results']), 2)
+        self.assertIsNotNone(data['next'])
+
+        data = self.client.get(data['next']).data
+        self.assertEqual(len(data['results']), 1)
+        self.assertIsNone(data['next'])
+
+    def test_search_with_empty_query(self):
+        self.assertEqual(self.search('')['results'], [])
+
+
+class OrderingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.collaborator = User.objects.create_user(username='collaborator', password='password123')
+        self.regular = User.objects.create_user(username='regular', password='password123')
+        self.book = Book.objects.create(title='Outline', author=self.author)
+        self.book.collaborators.add(self.collaborator)
+        self.section = Section.objects.create(title='Section 1', book=self.book)
+        self.other_section = Section.objects.create(title='Section 2', book=self.book)
+        self.first = Subsection.objects.create(title='First', section=self.section)
+        self.second = Subsection.objects.create(title='Second', section=self.section)
+        self.third = Subsection.objects.create(title='Third', section=self.section)
+        self.child = Subsection.objects.create(title='Child', section=self.section, parent_subsection=self.third)
+        self.client.force_authenticate(user=self.author)
+
+    def move(self, subsection, **data):
+        return self.client.post(f'/api/subsections/{subsection.id}/move/', data, format='json')
+
+    def tree_titles(self, section_index=0):
+        sections = self.client.get(f'/api/books/{self.book.id}/tree/').data['sections']
+        return [subsection['title'] for subsection in sections[section_index]['subsections']]
+
+    def test_new_nodes_are_appended(self):
+        self.assertLess(self.section.position, self.other_section.position)
+        self.assertLess(self.first.position, self.second.position)
+        self.assertLess(self.second.position, self.third.position)
+        self.assertEqual(self.child.position, POSITION_GAP)
+
+    def test_move_before_sibling_only_writes_the_moved_node(self):
+        positions = {subsection.id: subsection.position for subsection in (self.first, self.second)}
+        response = self.move(self.third, before=self.first.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.tree_titles(), ['Third', 'First', 'Second'])
+        self.assertEqual(dict(Subsection.objects.filter(pk__in=positions).values_list('pk', 'position')), positions)
+
+    def test_move_after_sibling(self):
+        self.move(self.first, after=self.second.id)
+        self.assertEqual(self.tree_titles(), ['Second', 'First', 'Third'])
+
+    def test_move_to_another_section_moves_the_subtree(self):
+        response = self.move(self.third, section=self.other_section.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.child.refresh_from_db()
+        self.assertEqual(self.child.section_id, self.other_section.id)
+        self.assertEqual(self.tree_titles(1), ['Third'])
+        self.assertEqual(self.tree_titles(0), ['First', 'Second'])
+
+    def test_reparent(self):
+        response = self.move(self.first, parent_subsection=self.child.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.depth, 2)
+        self.assertTrue(self.first.is_descendant_of(self.third))
+
+        response = self.move(self.first, parent_subsection=None, before=self.second.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.tree_titles(), ['First', 'Second', 'Third'])
+
+    def test_invalid_moves(self):
+        other_book = Book.objects.create(title='Other', author=self.author)
+        other_book_section = Section.objects.create(title='Elsewhere', book=other_book)
+        for data in (
+            {'parent_subsection': self.child.id},
+            {'section': other_book_section.id},
+            {'before': self.child.id},
+            {'before': self.first.id, 'after': self.second.id},
+        ):
+            with self.subTest(data):
+                self.assertEqual(self.move(self.third, **data).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_move_permissions(self):
+        self.client.force_authenticate(user=self.collaborator)
+        self.assertEqual(self.move(self.first, after=self.second.id).status_code, status.HTTP_200_OK)
+        self.client.force_authenticate(user=self.regular)
+        self.assertEqual(self.move(self.first, after=self.third.id).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_siblings_are_respaced_when_no_gap_is_left(self):
+        Subsection.objects.filter(pk=self.first.pk).update(position=1)
+        Subsection.objects.filter(pk=self.second.pk).update(position=2)
+        self.move(self.third, after=self.first.id)
+        self.assertEqual(self.tree_titles(), ['First', 'Third', 'Second'])
+
+    def test_reparent_through_update_appends(self):
+        self.client.put(f'/api/subsections/{self.first.id}/', {'version': self.first.version, 'title': 'First', 'parent_subsection': self.third.id})
+        self.first.refresh_from_db()
+        self.assertGreater(self.first.position, self.child.position)
+
+    def test_section_change_through_update_moves_the_subtree(self):
+        response = self.client.put(f'/api/subsections/{self.third.id}/', {'version': self.third.version, 'title': 'Third', 'section': self.other_section.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Subsection.objects.get(pk=self.child.pk).section_id, self.other_section.id)
+
+        other_book = Book.objects.create(title='Other', author=self.author)
+        elsewhere = Section.objects.create(title='Elsewhere', book=other_book)
+        response = self.client.put(f'/api/subsections/{self.first.id}/', {'version': self.first.version, 'title': 'First', 'section': elsewhere.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/subsections/', {'title': 'Stray', 'section': self.other_section.id, 'parent_subsection': self.first.id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_moving_a_section_to_another_book_moves_its_search_documents(self):
+        other_book = Book.objects.create(title='Other', author=self.author)
+        response = self.client.put(f'/api/sections/{self.section.id}/', {'version': self.section.version, 'title': 'Section 1', 'book': other_book.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        documents = SearchDocument.objects.filter(kind__in=['section', 'subsection'], object_id__in=[self.section.id, self.first.id, self.child.id])
+        self.assertEqual(set(documents.values_list('book_id', flat=True)), {other_book.id})
+
+    def test_moving_a_section_to_another_book_takes_the_author_of_both(self):
+        foreign = Book.objects.create(title='Not mine', author=self.regular)
+        response = self.client.put(f'/api/sections/{self.section.id}/', {'version': self.section.version, 'title': 'Section 1', 'book': foreign.id})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Section.objects.get(pk=self.section.pk).book_id, self.book.id)
+
+        # Collaborators cannot take a section out of the book either
+        mine = Book.objects.create(title='Mine', author=self.collaborator)
+        self.client.force_authenticate(user=self.collaborator)
+        response = self.client.put(f'/api/sections/{self.section.id}/', {'version': self.section.version, 'title': 'Section 1', 'book': mine.id})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_move_section(self):
+        response = self.client.post(f'/api/sections/{self.other_section.id}/move/', {'before': self.section.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        sections = self.client.get(f'/api/books/{self.book.id}/tree/').data['sections']
+        self.assertEqual([section['title'] for section in sections], ['Section 2', 'Section 1'])
+
+    def test_bulk_creates_are_appended(self):
+        self.client.post('/api/subsections/bulk/', {'create': [
+            {'section': self.section.id, 'title': 'Fourth'},
+            {'section': self.section.id, 'title': 'Grandchild', 'parent_ref': 0},
+            {'section': self.section.id, 'title': 'Second child', 'parent_subsection': self.third.id},
+        ]}, format='json')
+        self.assertEqual(self.tree_titles(), ['First', 'Second', 'Third', 'Fourth'])
+        third = Subsection.objects.get(title='Third')
+        self.assertEqual(list(third.child_sections.order_by('position').values_list('title', flat=True)), ['Child', 'Second child'])
+
+
+class DeletionTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.collaborator = User.objects.create_user(username='collaborator', password='password123')
+        self.client.force_authenticate(user=self.author)
+
+    def create_book(self, sections=2, depth=3):
+        book = Book.objects.create(title='Big book', author=self.author)
+        book.collaborators.add(self.collaborator)
+        for i in range(sections):
+            section = Section.objects.create(title=f'Section {i}', book=book)
+            parent = None
+            for level in range(depth):
+                parent = Subsection.objects.create(title=f'Level {level}', section=section, parent_subsection=parent)
+                Subsection.objects.create(title=f'Leaf {level}', section=section, parent_subsection=parent)
+        return book
+
+    def test_delete_book_removes_everything(self):
+        book = self.create_book()
+        kept = self.create_book(sections=1)
+        self.client.get(f'/api/books/{book.id}/')  # caches the author's role
+
+        response = self.client.delete(f'/api/books/{book.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Book.objects.filter(pk=book.pk).exists())
+        self.assertFalse(Section.objects.filter(book_id=book.pk).exists())
+        self.assertFalse(Subsection.objects.filter(section__book_id=book.pk).exists())
+        self.assertFalse(Book.collaborators.through.objects.filter(book_id=book.pk).exists())
+        self.assertFalse(SearchDocument.objects.filter(book_id=book.pk).exists())
+        self.assertEqual(Subsection.objects.filter(section__book=kept).count(), 6)
+        self.assertEqual(self.client.get(f'/api/books/{book.id}/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_queries_do_not_depend_on_size(self):
+        small = self.create_book(sections=1, depth=1)
+        large = self.create_book(sections=5, depth=8)
+        for book in (small, large):
+            section = book.sections.order_by('pk').last()
+            root = section.subsections.get(depth=0, title='Level 0')
+            with self.assertNumQueries(7):
+                delete_subsections([root.pk])
+            with self.assertNumQueries(8):
+                delete_sections([section.pk])
+            with self.assertNumQueries(10):
+                delete_books([book.pk])
+
+    def test_delete_subsection_removes_its_subtree_only(self):
+        book = self.create_book(sections=1)
+        level_1 = Subsection.objects.get(section__book=book, title='Level 1')
+        response = self.client.delete(f'/api/subsections/{level_1.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(
+            sorted(Subsection.objects.filter(section__book=book).values_list('title', flat=True)),
+            ['Leaf 0', 'Level 0'],
+        )
+        self.assertEqual(SearchDocument.objects.filter(kind='subsection', book=book).count(), 2)
+
+    def test_delete_section_removes_descendants_filed_under_another_section(self):
+        book = self.create_book(sections=1, depth=1)
+        section, other = book.sections.first(), Section.objects.create(title='Other', book=book)
+        root = section.subsections.get(title='Level 0')
+        # Rows like this could be created before bulk creates checked the parent's section
+        stray = Subsection.objects.create(title='Stray', section=other, parent_subsection=root)
+        kept = Subsection.objects.create(title='Kept', section=other)
+
+        response = self.client.delete(f'/api/sections/{section.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(Subsection.objects.filter(section__book=book).values_list('pk', flat=True)), [kept.pk])
+        self.assertFalse(SearchDocument.objects.filter(kind='subsection', object_id=stray.pk).exists())
+        self.assertTrue(BookChange.objects.filter(kind='subsection', object_id=stray.pk, action='delete').exists())
+
+    def test_delete_section(self):
+        book = self.create_book()
+        section = book.sections.order_by('pk').first()
+        response = self.client.delete(f'/api/sections/{section.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(Subsection.objects.filter(section__book=book).count(), 6)
+        self.assertFalse(SearchDocument.objects.filter(kind='section', object_id=section.pk).exists())
+        self.assertEqual(SearchDocument.objects.filter(kind='subsection', book=book).count(), 6)
+
+    def test_nested_subtrees_in_one_call(self):
+        book = self.create_book(sections=1)
+        ids = Subsection.objects.filter(section__book=book, title__in=['Level 0', 'Level 2']).values_list('pk', flat=True)
+        self.assertEqual(delete_subsections(list(ids)), 6)
+        self.assertFalse(Subsection.objects.filter(section__book=book).exists())
+
+
+class JobsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.output_dir.cleanup)
+        settings_override = self.settings(BOOKS_JOB_OUTPUT_DIR=self.output_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.other = User.objects.create_user(username='other', password='password123')
+        self.book = Book.objects.create(title='Queued', author=self.author)
+        self.section = Section.objects.create(title='Section', book=self.book)
+        Subsection.objects.create(title='Subsection', section=self.section)
+        self.client.force_authenticate(user=self.author)
+
+    def run_jobs(self):
+        call_command('run_jobs', once=True, stdout=StringIO())
+
+    def test_export_job(self):
+        response = self.client.post('/api/jobs/', {'kind': 'export', 'format': 'ndjson'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], Job.QUEUED)
+        self.assertEqual(response['Location'], f"/api/jobs/{response.data['id']}/")
+
+        self.run_jobs()
+        job = self.client.get(response['Location']).data
+        self.assertEqual(job['status'], Job.SUCCEEDED)
+
+        result = self.client.get(f"/api/jobs/{job['id']}/result/")
+        self.assertEqual(result.status_code, status.HTTP_200_OK)
+        records = [json.loads(line) for line in b''.join(result.streaming_content).decode().splitlines()]
+        self.assertEqual([record['type'] for record in records], ['book', 'section', 'subsection'])
+
+        os.remove(os.path.join(self.output_dir.name, job['result']['file']))
+        result = self.client.get(f"/api/jobs/{job['id']}/result/")
+        self.assertEqual(result.status_code, status.HTTP_410_GONE)
+
+    def test_expired_results_are_removed(self):
+        job = enqueue('export', self.author)
+        self.run_jobs()
+        job.refresh_from_db()
+        path = os.path.join(self.output_dir.name, job.result['file'])
+        self.assertEqual(remove_expired_results(), 0)
+
+        Job.objects.filter(pk=job.pk).update(finished_at=timezone.now() - timedelta(days=30))
+        self.assertEqual(remove_expired_results(), 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.client.get(f'/api/jobs/{job.pk}/result/').status_code, status.HTTP_410_GONE)
+        self.assertEqual(remove_expired_results(), 0)
+
+    def test_jobs_are_private(self):
+        job = enqueue('export', self.author)
+        self.client.force_authenticate(user=self.other)
+        self.assertEqual(self.client.get(f'/api/jobs/{job.pk}/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/jobs/').data, [])
+
+    def test_import_job(self):
+        upload = StringIO('{"type": "book", "id": 1, "title": "Imported"}\n{"type": "section", "id": 2, "book": 1, "title": "Part"}\n')
+        upload.name = 'books.ndjson'
+        response = self.client.post('/api/jobs/', {'kind': 'import', 'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        self.run_jobs()
+        job = Job.objects.get(pk=response.data['id'])
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result['book'], 1)
+        # Only the name of the upload is shown, not where it is stored
+        self.assertEqual(job.payload['file'], os.path.basename(job.payload['file']))
+        self.assertEqual(Book.objects.get(title='Imported').author, self.author)
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir.name, job.payload['file'])))
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_invalid_import_fails_without_retry(self):
+        upload = StringIO('not json\n')
+        upload.name = 'books.ndjson'
+        response = self.client.post('/api/jobs/', {'kind': 'import', 'file': upload}, format='multipart')
+        self.run_jobs()
+        job = Job.objects.get(pk=response.data['id'])
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 1))
+        self.assertIn('invalid JSON', job.error)
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir.name, job.payload['file'])))
+
+    def test_failing_job_is_retried_with_backoff(self):
+        calls = []
+
+        def flaky(job):
+            calls.append(job.attempts)
+            if job.attempts < 2:
+                raise RuntimeError('temporary failure')
+            return {'ok': True}
+
+        JOB_HANDLERS['flaky'] = flaky
+        self.addCleanup(JOB_HANDLERS.pop, 'flaky')
+        job = enqueue('flaky', self.author)
+
+        with self.assertLogs('books.jobs', 'ERROR'):
+            self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('temporary failure', job.error)
+        self.assertGreater(job.run_at, timezone.now())
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, calls), (Job.SUCCEEDED, {'ok': True}, [1, 2]))
+
+    def test_job_fails_after_max_attempts(self):
+        JOB_HANDLERS['broken'] = lambda job: 1 / 0
+        self.addCleanup(JOB_HANDLERS.pop, 'broken')
+        job = enqueue('broken', self.author, max_attempts=1)
+        with self.assertLogs('books.jobs', 'ERROR'):
+            self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = enqueue('export', self.author)
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, started_at=timezone.now() - timedelta(days=1))
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+
+    def test_running_jobs_with_a_recent_heartbeat_are_left_alone(self):
+        job = enqueue('export', self.author)
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.RUNNING, started_at=timezone.now() - timedelta(days=1), heartbeat_at=timezone.now(),
+        )
+        self.assertEqual(requeue_stale_jobs(), 0)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.RUNNING)
+
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(requeue_stale_jobs(), 1)
+
+    def test_stale_jobs_out_of_attempts_fail(self):
+        job = enqueue('export', self.author, max_attempts=2)
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, attempts=2, started_at=timezone.now() - timedelta(days=1))
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_stale_import_out_of_attempts_removes_its_upload(self):
+        upload = StringIO('{"type": "book", "id": 1, "title": "Imported"}\n')
+        upload.name = 'books.ndjson'
+        response = self.client.post('/api/jobs/', {'kind': 'import', 'file': upload}, format='multipart')
+        job = Job.objects.get(pk=response.data['id'])
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.RUNNING, attempts=job.max_attempts, started_at=timezone.now() - timedelta(days=1),
+        )
+        self.run_jobs()
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.FAILED)
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir.name, job.payload['file'])))
+
+    def test_large_book_is_deleted_in_the_background(self):
+        with self.settings(BOOKS_SYNC_DELETE_MAX_NODES=0):
+            response = self.client.delete(f'/api/books/{self.book.id}/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(Book.objects.filter(pk=self.book.pk).exists())
+
+        self.run_jobs()
+        self.assertFalse(Book.objects.filter(pk=self.book.pk).exists())
+        self.assertEqual(Job.objects.get(pk=response.data['id']).result, {'deleted': 1})
+
+    def test_collaborator_cannot_delete_a_book(self):
+        self.book.collaborators.add(self.other)
+        self.client.force_authenticate(user=self.other)
+        for max_nodes in (0, 100):
+            with self.settings(BOOKS_SYNC_DELETE_MAX_NODES=max_nodes):
+                response = self.client.delete(f'/api/books/{self.book.id}/')
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertTrue(Book.objects.filter(pk=self.book.pk).exists())
+        self.assertFalse(Job.objects.exists())
+
+    def test_job_body_must_be_an_object(self):
+        response = self.client.post('/api/jobs/', ['export'], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delete_job_requires_author(self):
+        self.client.force_authenticate(user=self.other)
+        response = self.client.post('/api/jobs/', {'kind': 'delete_book', 'book': self.book.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_warm_cache_job(self):
+        response = self.client.post('/api/jobs/', {'kind': 'warm_cache'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.run_jobs()
+        self.assertEqual(Job.objects.get(pk=response.data['id']).result, {'pages': 1, 'roles': 1})
+
+        # Served from the cache without touching the database
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/books/')
+        self.assertEqual(response.data['results'][0]['title'], 'Queued')
+
+    def test_unknown_kind(self):
+        response = self.client.post('/api/jobs/', {'kind': 'nope'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class JobHeartbeatTestCase(TransactionTestCase):
+    # The heartbeat thread writes through its own connection, which the transaction of a TestCase would lock out
+    def test_heartbeat_is_refreshed_while_the_handler_runs(self):
+        beats = []
+
+        def slow(job):
+            deadline = time.monotonic() + 5
+            while len(beats) < 2 and time.monotonic() < deadline:
+                beat = Job.objects.get(pk=job.pk).heartbeat_at
+                if not beats or beat != beats[-1]:
+                    beats.append(beat)
+                time.sleep(0.01)
+            return {}
+
+        JOB_HANDLERS['slow'] = slow
+        self.addCleanup(JOB_HANDLERS.pop, 'slow')
+        author = User.objects.create_user(username='author', password='password123')
+        enqueue('slow', author)
+        with self.settings(BOOKS_JOB_HEARTBEAT_INTERVAL=0.05):
+            run_job(claim_job())
+        self.assertEqual(len(beats), 2)
+        self.assertLess(beats[0], beats[1])
+
+
+class DuplicateBookTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.collaborator = User.objects.create_user(username='collaborator', password='password123')
+        self.regular = User.objects.create_user(username='regular', password='password123')
+        self.book = self.create_book(depth=3)
+        self.book.collaborators.add(self.collaborator)
+        self.client.force_authenticate(user=self.author)
+
+    def create_book(self, sections=2, depth=3):
+        book = Book.objects.create(title='Template', author=self.author)
+        for i in range(sections):
+            section = Section.objects.create(title=f'Section {i}', book=book)
+            parent = None
+            for level in range(depth):
+                parent = Subsection.objects.create(title=f'{i}.{level}', section=section, parent_subsection=parent)
+                Subsection.objects.create(title=f'{i}.{level} leaf', section=section, parent_subsection=parent)
+        return book
+
+    def outline(self, book_id):
+        def strip(nodes):
+            return [(node['title'], strip(node['subsections'])) for node in nodes]
+        return strip(self.client.get(f'/api/books/{book_id}/tree/').data['sections'])
+
+    def test_duplicate_copies_the_tree(self):
+        # Order comes from positions, not ids
+        first = Section.objects.get(book=self.book, title='Section 0')
+        second = Section.objects.get(book=self.book, title='Section 1')
+        second.move(before=first)
+
+        response = self.client.post(f'/api/books/{self.book.id}/duplicate/', {'title': 'Second edition'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        copy = Book.objects.get(pk=response.data['id'])
+        self.assertEqual((copy.title, copy.author), ('Second edition', self.author))
+        self.assertEqual(self.outline(copy.id), self.outline(self.book.id))
+        self.assertFalse(copy.collaborators.exists())
+
+        copied = Subsection.objects.filter(section__book=copy)
+        self.assertEqual(copied.count(), 12)
+        for subsection in copied.select_related('parent_subsection'):
+            parent = subsection.parent_subsection
+            self.assertEqual(subsection.path, make_path(parent.path if parent else '', subsection.pk))
+            self.assertTrue(parent is None or parent.section_id == subsection.section_id)
+        self.assertEqual(SearchDocument.objects.filter(book=copy).count(), 1 + 2 + 12)
+
+    def test_duplicate_with_collaborators(self):
+        response = self.client.post(f'/api/books/{self.book.id}/duplicate/', {'collaborators': True}, format='json')
+        copy = Book.objects.get(pk=response.data['id'])
+        self.assertEqual(copy.title, 'Copy of Template')
+        self.assertEqual(list(copy.collaborators.all()), [self.collaborator])
+
+    def test_collaborator_duplicates_as_author(self):
+        self.client.force_authenticate(user=self.collaborator)
+        response = self.client.post(f'/api/books/{self.book.id}/duplicate/', {'collaborators': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        copy = Book.objects.get(pk=response.data['id'])
+        self.assertEqual(copy.author, self.collaborator)
+        self.assertFalse(copy.collaborators.exists())
+
+    def test_regular_user_cannot_duplicate(self):
+        self.client.force_authenticate(user=self.regular)
+        response = self.client.post(f'/api/books/{self.book.id}/duplicate/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_queries_depend_on_depth_not_size(self):
+        small = self.create_book(sections=1, depth=4)
+        large = self.create_book(sections=10, depth=4)
+        with CaptureQueriesContext(connection) as small_queries:
+            duplicate_book(small, self.author)
+        with CaptureQueriesContext(connection) as large_queries:
+            duplicate_book(large, self.author)
+        self.assertEqual(len(small_queries), len(large_queries))
+
+    def test_large_book_is_duplicated_in_the_background(self):
+        with self.settings(BOOKS_SYNC_DUPLICATE_MAX_NODES=1):
+            response = self.client.post(f'/api/books/{self.book.id}/duplicate/', {'title': 'Later'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(Book.objects.filter(title='Later').exists())
+
+        call_command('run_jobs', once=True, stdout=StringIO())
+        copy = Book.objects.get(title='Later')
+        self.assertEqual(Job.objects.get(pk=response.data['id']).result, {'book': copy.pk})
+        self.assertEqual(self.outline(copy.id), self.outline(self.book.id))
+
+
+class CollaboratorsAPITestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.users = [User.objects.create_user(username=f'user{i}', password='password123') for i in range(5)]
+        self.book = Book.objects.create(title='Shared', author=self.author)
+        self.book.collaborators.add(self.users[0])
+        self.client.force_authenticate(user=self.author)
+        self.url = f'/api/books/{self.book.id}/collaborators/'
+
+    def test_bulk_add_and_remove(self):
+        data = {
+            'add': [self.users[1].id, 'user2', 'user0', 'missing', self.author.id, 99999, {'id': 1}],
+            'remove': ['user0', self.users[3].id],
+        }
+        with self.assertNumQueries(10):
+            response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.data['add']], [201, 201, 200, 404, 400, 404, 400])
+        self.assertEqual([result['status'] for result in response.data['remove']], [204, 200])
+        self.assertEqual(response.data['add'][1]['id'], self.users[2].id)
+        self.assertEqual(set(self.book.collaborators.all()), {self.users[1], self.users[2]})
+
+    def test_bulk_changes_update_access(self):
+        self.client.force_authenticate(user=self.users[1])
+        self.assertEqual(self.client.get(f'/api/books/{self.book.id}/').status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, {'add': ['user1']}, format='json')
+        self.client.force_authenticate(user=self.users[1])
+        self.assertEqual(self.client.get(f'/api/books/{self.book.id}/').status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(user=self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, {'remove': ['user1']}, format='json')
+        self.client.force_authenticate(user=self.users[1])
+        self.assertEqual(self.client.get(f'/api/books/{self.book.id}/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_only_the_author_can_change_collaborators(self):
+        self.client.force_authenticate(user=self.users[0])
+        response = self.client.post(self.url, {'add': ['user1']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_invalid_body(self):
+        response = self.client.post(self.url, {'add': 'user1'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, ['user1'], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_paged_listing(self):
+        self.book.collaborators.add(*self.users)
+        response = self.client.get(self.url, {'page_size': 3})
+        self.assertEqual([user['username'] for user in response.data['results']], ['user0', 'user1', 'user2'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([user['username'] for user in response.data['results']], ['user3', 'user4'])
+        self.assertIsNone(response.data['next'])
+
+        self.client.force_authenticate(user=self.users[0])
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+
+    def test_single_collaborator_views_return_404_for_missing_users(self):
+        response = self.client.post(f'/api/books/{self.book.id}/add-collaborator/99999/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(f'/api/books/{self.book.id}/remove-collaborator/99999/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BookRoleFilterTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='me', password='password123')
+        self.other = User.objects.create_user(username='other', password='password123')
+        self.mine = [Book.objects.create(title=f'Mine {i}', author=self.user) for i in range(3)]
+        self.shared = [Book.objects.create(title=f'Shared {i}', author=self.other) for i in range(2)]
+        for book in self.shared:
+            book.collaborators.add(self.user, self.other)
+        Book.objects.create(title='Not mine', author=self.other)
+        self.client.force_authenticate(user=self.user)
+
+    def titles(self, role, **params):
+        response = self.client.get('/api/books/', {'role': role, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [book['title'] for book in response.data['results']], response.data
+
+    def test_role_filters(self):
+        titles, data = self.titles('author')
+        self.assertEqual((titles, data['count']), (['Mine 0', 'Mine 1', 'Mine 2'], 3))
+        titles, data = self.titles('collaborator')
+        self.assertEqual((titles, data['count']), (['Shared 0', 'Shared 1'], 2))
+        titles, data = self.titles('any')
+        self.assertEqual(data['count'], 5)
+        self.assertNotIn('Not mine', titles)
+
+    def test_role_filter_is_paginated_and_counted(self):
+        titles, data = self.titles('any', page_size=2)
+        self.assertEqual((titles, data['count']), (['Mine 0', 'Mine 1'], 5))
+        response = self.client.get(data['next'])
+        self.assertEqual([book['title'] for book in response.data['results']], ['Mine 2', 'Shared 0'])
+
+    def test_role_filter_queries(self):
+        # Page, count and collaborator prefetch, without a join on the collaborators table
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/books/', {'role': 'any'})
+        self.assertEqual(len(queries), 3)
+        self.assertNotIn('DISTINCT', queries[0]['sql'])
+
+    def test_unfiltered_list_is_unchanged(self):
+        response = self.client.get('/api/books/')
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertNotIn('count', response.data)
+
+    def test_unknown_role(self):
+        response = self.client.get('/api/books/', {'role': 'owner'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.collaborator = User.objects.create_user(username='collaborator', password='password123')
+        self.book = Book.objects.create(title='Polled Book', author=self.author)
+        self.section = Section.objects.create(title='Section', book=self.book)
+        self.subsection = Subsection.objects.create(title='Subsection', section=self.section)
+        self.other_section = Section.objects.create(title='Other section', book=self.book)
+        self.client.force_authenticate(user=self.author)
+        self.urls = [
+            f'/api/books/{self.book.id}/',
+            f'/api/books/{self.book.id}/tree/',
+            f'/api/sections/{self.section.id}/',
+            f'/api/subsections/{self.subsection.id}/',
+        ]
+
+    def etags(self):
+        return [self.client.get(url)['ETag'] for url in self.urls]
+
+    def assertAllModified(self, etags):
+        for url, etag in zip(self.urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK, url)
+
+    def test_unchanged_resources_are_not_resent(self):
+        Book.objects.filter(pk=self.book.pk).update(updated_at=timezone.now() - timedelta(minutes=1))
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('Last-Modified', response)
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response.content, b'')
+            self.assertIn('ETag', response)
+
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_last_modified_waits_for_its_second_to_end(self):
+        # Written within the current second (pushed ahead so the test cannot cross into the next one),
+        # another write could still land within it
+        Book.objects.filter(pk=self.book.pk).update(updated_at=timezone.now() + timedelta(seconds=5))
+        response = self.client.get(self.urls[0])
+        self.assertNotIn('Last-Modified', response)
+        response = self.client.get(self.urls[0], HTTP_IF_MODIFIED_SINCE=http_date(timezone.now().timestamp()))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_not_modified_skips_serialization(self):
+        url = f'/api/books/{self.book.id}/tree/'
+        etag = self.client.get(url)['ETag']
+        # Only the book: the role is cached, collaborators, sections and subsections are not loaded
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_child_changes_bump_the_book_version(self):
+        changes = [
+            lambda: self.client.put(f'/api/subsections/{self.subsection.id}/', {'version': self.subsection.version, 'title': 'Renamed'}, format='json'),
+            lambda: Subsection.objects.create(title='New', section=self.other_section),
+            lambda: self.client.post(f'/api/sections/{self.other_section.id}/move/', {'before': self.section.id}, format='json'),
+            lambda: self.client.post('/api/subsections/bulk/', {'create': [{'section': self.section.id, 'title': 'Bulk'}]}, format='json'),
+            lambda: delete_sections([self.other_section.pk]),
+            lambda: self.book.collaborators.add(self.collaborator),
+            lambda: self.client.put(f'/api/books/{self.book.id}/', {'title': 'Renamed book', 'author': self.author.id}, format='json'),
+        ]
+        version = Book.objects.get(pk=self.book.pk).version
+        for index, change in enumerate(changes):
+            etags = self.etags()
+            change()
+            self.assertGreater(Book.objects.get(pk=self.book.pk).version, version, index)
+            version = Book.objects.get(pk=self.book.pk).version
+            self.assertAllModified(etags)
+
+    def test_moving_a_section_to_another_book_changes_both(self):
+        other_book = Book.objects.create(title='Other book', author=self.author)
+        versions = dict(Book.objects.values_list('pk', 'version'))
+        self.client.put(f'/api/sections/{self.other_section.id}/', {'version': self.other_section.version, 'title': 'Moved', 'book': other_book.id}, format='json')
+        for book in Book.objects.all():
+            self.assertGreater(book.version, versions[book.pk])
+
+    def test_export_leaves_out_change_tracking_fields(self):
+        response = self.client.get(f'/api/books/{self.book.id}/export/')
+        record = json.loads(b''.join(response.streaming_content).splitlines()[0])
+        self.assertNotIn('version', record)
+        self.assertNotIn('updated_at', record)
+
+    async def test_async_views(self):
+        headers = {'AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.author).access_token}'}
+        for url in (f'/api/async/books/{self.book.id}/', f'/api/async/books/{self.book.id}/tree/', f'/api/async/sections/{self.section.id}/'):
+            response = await self.async_client.get(url, **headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = await self.async_client.get(url, IF_NONE_MATCH=response['ETag'], **headers)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class BookChangesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.outsider = User.objects.create_user(username='outsider', password='password123')
+        self.book = Book.objects.create(title='Synced Book', author=self.author)
+        self.section = Section.objects.create(title='Section', book=self.book)
+        self.root = Subsection.objects.create(title='Root', section=self.section)
+        self.child = Subsection.objects.create(title='Child', section=self.section, parent_subsection=self.root)
+        self.other_book = Book.objects.create(title='Other Book', author=self.author)
+        self.other_section = Section.objects.create(title='Other section', book=self.other_book)
+        self.client.force_authenticate(user=self.author)
+        self.url = f'/api/books/{self.book.id}/changes/'
+
+    def changes(self, since, **params):
+        response = self.client.get(self.url, {'since': since, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def summary(self, data):
+        return {(change['type'], change['id'], change['action']) for change in data['changes']}
+
+    def test_without_cursor_returns_the_current_cursor(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.data, {'cursor': BookChange.objects.filter(book=self.book).latest('id').id, 'has_more': False, 'changes': []})
+        self.assertEqual(self.changes(response.data['cursor'])['changes'], [])
+
+    def test_changes_are_folded_per_object(self):
+        cursor = self.client.get(self.url).data['cursor']
+        self.client.put(f'/api/subsections/{self.root.id}/', {'version': self.root.version, 'title': 'Renamed'}, format='json')
+        self.client.put(f'/api/subsections/{self.root.id}/', {'title': 'Renamed again', 'version': self.root.version + 1}, format='json')
+        new = self.client.post('/api/sections/', {'book': self.book.id, 'title': 'New'}).data
+        self.client.delete(f'/api/subsections/{self.child.id}/')
+
+        data = self.changes(cursor)
+        self.assertEqual(self.summary(data), {
+            ('subsection', self.root.id, 'upsert'), ('section', new['id'], 'upsert'), ('subsection', self.child.id, 'delete'),
+        })
+        root = next(change for change in data['changes'] if change['id'] == self.root.id)
+        self.assertEqual(root['title'], 'Renamed again')
+        self.assertEqual(self.changes(data['cursor'])['changes'], [])
+
+    def test_deleted_objects_become_tombstones(self):
+        cursor = self.client.get(self.url).data['cursor']
+        self.client.put(f'/api/subsections/{self.child.id}/', {'version': self.child.version, 'title': 'Renamed'}, format='json')
+        delete_sections([self.section.pk])
+        # Subsections deleted with their section get no entry, the renamed one is missing so it is a tombstone too
+        self.assertEqual(self.summary(self.changes(cursor)), {('section', self.section.id, 'delete'), ('subsection', self.child.id, 'delete')})
+
+    def test_moves_between_books(self):
+        cursor = self.client.get(self.url).data['cursor']
+        other_cursor = self.client.get(f'/api/books/{self.other_book.id}/changes/').data['cursor']
+        self.root.move(self.other_section)
+
+        self.assertEqual(self.summary(self.changes(cursor)), {('subsection', self.root.id, 'delete')})
+        data = self.client.get(f'/api/books/{self.other_book.id}/changes/', {'since': other_cursor}).data
+        self.assertEqual(self.summary(data), {('subsection', self.root.id, 'upsert'), ('subsection', self.child.id, 'upsert')})
+
+    def test_bulk_changes_are_logged(self):
+        cursor = self.client.get(self.url).data['cursor']
+        response = self.client.post('/api/subsections/bulk/', {
+            'create': [{'section': self.section.id, 'title': 'Bulk'}],
+            'update': [{'id': self.root.id, 'title': 'Bulk renamed'}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        created = Subsection.objects.get(title='Bulk')
+        self.assertEqual(self.summary(self.changes(cursor)), {('subsection', created.id, 'upsert'), ('subsection', self.root.id, 'upsert')})
+
+    def test_pages_follow_the_cursor(self):
+        cursor = self.client.get(self.url).data['cursor']
+        sections = [Section.objects.create(title=f'Section {i}', book=self.book) for i in range(5)]
+        seen = []
+        data = {'cursor': cursor, 'has_more': True}
+        while data['has_more']:
+            data = self.changes(data['cursor'], limit=2)
+            seen += [change['id'] for change in data['changes']]
+        self.assertEqual(seen, [section.id for section in sections])
+
+    def test_queries_do_not_depend_on_the_number_of_changes(self):
+        cursor = self.client.get(self.url).data['cursor']
+        for i in range(20):
+            Section.objects.create(title=f'Section {i}', book=self.book)
+            Subsection.objects.create(title=f'Subsection {i}', section=self.section)
+        # Book, changes, sections and subsections (the role is cached)
+        with self.assertNumQueries(4):
+            self.changes(cursor)
+
+    def test_invalid_parameters(self):
+        for params in ({'since': 'abc'}, {'since': -1}, {'since': 0, 'limit': 0}, {'since': 0, 'limit': 'x'}):
+            self.assertEqual(self.client.get(self.url, params).status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_outsiders_cannot_read_changes(self):
+        self.client.force_authenticate(user=self.outsider)
+        self.assertEqual(self.client.get(self.url, {'since': 0}).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class OptimisticConcurrencyTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.author = User.objects.create_user(username='author', password='password123')
+        self.book = Book.objects.create(title='Shared Book', author=self.author)
+        self.section = Section.objects.create(title='Section', book=self.book)
+        self.root = Subsection.objects.create(title='Root', section=self.section)
+        self.child = Subsection.objects.create(title='Child', section=self.section, parent_subsection=self.root)
+        self.client.force_authenticate(user=self.author)
+
+    def test_updates_require_a_version(self):
+        for url in (f'/api/sections/{self.section.id}/', f'/api/subsections/{self.root.id}/'):
+            response = self.client.put(url, {'title': 'Blind edit'})
+            self.assertEqual(response.status_code, status.HTTP_428_PRECONDITION_REQUIRED)
+        self.assertEqual(Section.objects.get(pk=self.section.pk).title, 'Section')
+
+    def test_versions_must_be_integers(self):
+        for version in (True, 1.5, '1.5'):
+            response = self.client.put(f'/api/subsections/{self.root.id}/', {'title': 'Odd', 'version': version}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, version)
+
+        response = self.client.post('/api/subsections/bulk/', {'update': [{'id': self.root.id, 'title': 'Odd', 'version': True}]}, format='json')
+        self.assertEqual(response.data['update'][0]['errors'], {'version': ['A valid integer is required.']})
+        self.assertEqual(Subsection.objects.get(pk=self.root.pk).title, 'Root')
+
+    def test_concurrent_edits_conflict(self):
+        url = f'/api/subsections/{self.root.id}/'
+        version = self.client.get(url).data['version']
+
+        response = self.client.put(url, {'title': 'First', 'version': version})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], version + 1)
+
+        # The second editor read the same version: refused, with the current state to merge with
+        response = self.client.put(url, {'title': 'Second', 'version': version})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual((response.data['title'], response.data['version']), ('First', version + 1))
+        self.assertEqual(Subsection.objects.get(pk=self.root.pk).title, 'First')
+
+    def test_if_match(self):
+        url = f'/api/sections/{self.section.id}/'
+        self.assertEqual(self.client.put(url, {'title': 'A'}, HTTP_IF_MATCH='"1"').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.put(url, {'title': 'B'}, HTTP_IF_MATCH='"1"').status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.client.put(url, {'title': 'B'}, HTTP_IF_MATCH='W/"2"').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.put(url, {'title': 'B', 'version': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(url, {'title': 'C'}, HTTP_IF_MATCH='*')
+        self.assertEqual((response.status_code, response.data['version']), (status.HTTP_200_OK, 3))
+
+    def test_update_is_a_single_conditional_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(f'/api/sections/{self.section.id}/', {'title': 'Renamed', 'version': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "books_section"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"books_section"."version" = 1', updates[0])
+
+    def test_stale_instances_are_not_saved(self):
+        stale = Subsection.objects.get(pk=self.root.pk)
+        self.root.title = 'Saved'
+        self.root.save()
+        stale.title = 'Lost'
+        with self.assertRaises(VersionConflict), transaction.atomic():
+            stale.save()
+        self.assertEqual(Subsection.objects.get(pk=self.root.pk).title, 'Saved')
+
+    def test_indirect_changes_increment_versions(self):
+        other = Section.objects.create(title='Other', book=self.book)
+        self.root.move(other)
+        # The descendants changed section with the moved node
+        self.assertEqual(Subsection.objects.get(pk=self.child.pk).version, 2)
+
+        response = self.client.post('/api/subsections/bulk/', {'update': [{'id': self.child.id, 'title': 'Bulk'}]}, format='json')
+        self.assertEqual(response.data['update'][0]['version'], 3)
+        self.assertEqual(Subsection.objects.get(pk=self.child.pk).version, 3)
+
+    def test_bulk_update_checks_versions(self):
+        Subsection.objects.filter(pk=self.child.pk).update(version=2)
+        response = self.client.post('/api/subsections/bulk/', {'update': [
+            {'id': self.root.id, 'title': 'Root', 'version': 1},
+            {'id': self.child.id, 'title': 'Stale', 'version': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['update'][0]['status'], 424)
+        self.assertEqual((response.data['update'][1]['status'], response.data['update'][1]['version']), (409, 2))
+
+        response = self.client.post('/api/subsections/bulk/', {'update': [{'id': self.child.id, 'title': 'Fresh', 'version': 2}]}, format='json')
+        self.assertEqual((response.data['update'][0]['title'], response.data['update'][0]['version']), ('Fresh', 3))
+
+    def test_bulk_update_written_over_a_concurrent_change_is_rolled_back(self):
+        child = Subsection.objects.get(pk=self.child.pk)
+        child.title, child._expected_version = 'Stale', child.version
+        Subsection.objects.filter(pk=child.pk).update(version=F('version') + 1)
+        with self.assertRaises(VersionConflict), transaction.atomic():
+            _update_titles(Subsection, [child])
+        self.assertEqual(Subsection.objects.get(pk=child.pk).title, self.child.title)
+
+
+class BenchmarkTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_seed_benchmark_data(self):
+        seeded = seed_benchmark_data(users=3, books=2, collaborators=2, sections=2, depth=2, width=3)
+        self.assertEqual(seeded, {'users': 3, 'books': 2, 'sections': 4, 'subsections': 4 * (3 + 9)})
+        self.assertEqual(Book.collaborators.through.objects.count(), 4)
+        self.assertEqual(Subsection.objects.filter(depth=1, parent_subsection__isnull=False).count(), 4 * 9)
+
+    def test_every_benchmark_succeeds(self):
+        seed_benchmark_data(users=3, books=2, collaborators=1, sections=2, depth=2, width=2)
+        results = run_benchmarks(iterations=2)
+        self.assertEqual(len(results), len(BENCHMARKS))
+        for result in results:
+            self.assertTrue(all(code < 400 for code in result['status_codes']), result)
+            self.assertEqual(result['iterations'], 2)
+
+
+class QueryBudgetAPITestCase(QueryBudgetTestCase):
+    # Upper bounds measured against the seeded fixture; lower them when an endpoint gets cheaper
+    QUERY_BUDGETS = {
+        'book-list-create:get': 2,
+        'book-list-create:get-role': 3,
+        'book-list-create:post': 6,
+        'library-export': 4,
+        'book-detail:get': 3,
+        'book-detail:put': 11,
+        'book-detail:delete': 13,
+        'book-duplicate': 21,
+        'book-export': 6,
+        'book-tree': 5,
+        'book-changes': 5,
+        'section-list-create': 10,
+        'section-bulk': 9,
+        'section-detail:get': 2,
+        'section-detail:put': 10,
+        'section-detail:delete': 10,
+        'section-move': 8,
+        'subsection-list-create': 13,
+        'subsection-bulk': 13,
+        'subsection-detail:get': 2,
+        'subsection-detail:put': 11,
+        'subsection-detail:delete': 9,
+        'subsection-move': 9,
+        'add-collaborator': 6,
+        'remove-collaborator': 6,
+        'book-collaborators:get': 3,
+        'book-collaborators:post': 8,
+        'search': 1,
+        'job-list-create:get': 1,
+        'job-list-create:post': 1,
+        'job-detail': 1,
+        'async-book-list': 2,
+        'async-book-detail': 3,
+        'async-book-tree': 5,
+        'async-section-detail': 2,
+        'async-subsection-detail': 2,
+    }
+
+    def test_endpoints_stay_within_query_budget(self):
+        for name, limit in self.QUERY_BUDGETS.items():
+            with self.subTest(name):
+                cache.clear()
+                self.assertEndpointQueries(name, limit)
+
+    def test_every_books_benchmark_has_a_budget(self):
+        self.assertEqual(set(self.QUERY_BUDGETS), {name for name in BENCHMARKS if not name.startswith('user-')})
+
+    def test_budget_failure_reports_repeated_queries(self):
+        with self.assertRaises(AssertionError) as raised:
+            with self.assertMaxQueries(1):
+                for book in Book.objects.order_by('pk')[:3]:
+                    list(book.sections.all())
+        message = str(raised.exception)
+        self.assertIn('4 queries executed, at most 1 expected.', message)
+        self.assertIn('3 x SELECT', message)
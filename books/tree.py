@@ -0,0 +1,41 @@
+from .models import Section, Subsection
+from .serializers import BookSerializer
+
+SECTION_FIELDS = ('id', 'title', 'book', 'position', 'version')
+SUBSECTION_FIELDS = ('id', 'title', 'section', 'parent_subsection', 'position', 'version')
+
+
+def book_sections(book):
+    return Section.objects.filter(book=book).order_by('position', 'id').values(*SECTION_FIELDS)
+
+
+def book_subsections(book):
+    return Subsection.objects.filter(section__book=book).order_by('position', 'id').values(*SUBSECTION_FIELDS)
+
+
+def nest_book_tree(book_data, sections, subsections):
+    sections_by_id = {}
+    for section in sections:
+        section['subsections'] = []
+        sections_by_id[section['id']] = section
+
+    subsections_by_id = {}
+    for subsection in subsections:
+        subsection['subsections'] = []
+        subsections_by_id[subsection['id']] = subsection
+
+    for subsection in subsections:
+        parent = subsections_by_id.get(subsection['parent_subsection'])
+        if parent is None:
+            # Top level subsection (or one whose parent lives outside this book)
+            parent = sections_by_id[subsection['section']]
+        parent['subsections'].append(subsection)
+
+    book_data['sections'] = sections
+    return book_data
+
+
+def build_book_tree(book):
+    # Load every node of the book in two queries and nest them in memory,
+    # instead of walking sections and subsections one request at a time.
+    return nest_book_tree(BookSerializer(book).data, list(book_sections(book)), list(book_subsections(book)))
@@ -1,23 +1,49 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     # Book views
     path('books/', views.BookListCreateView.as_view(), name='book-list-create'),
+    path('books/export/', views.LibraryExportView.as_view(), name='library-export'),
     path('books/<int:pk>/', views.BookDetailView.as_view(), name='book-detail'),
+    path('books/<int:pk>/export/', views.BookExportView.as_view(), name='book-export'),
+    path('books/<int:pk>/tree/', views.BookTreeView.as_view(), name='book-tree'),
+    path('books/<int:pk>/changes/', views.BookChangesView.as_view(), name='book-changes'),
+    path('books/<int:pk>/duplicate/', views.BookDuplicateView.as_view(), name='book-duplicate'),
 
     # Section views
     path('sections/', views.SectionListCreateView.as_view(), name='section-list-create'),
+    path('sections/bulk/', views.SectionBulkView.as_view(), name='section-bulk'),
     path('sections/<int:pk>/', views.SectionDetailView.as_view(), name='section-detail'),
+    path('sections/<int:pk>/move/', views.SectionMoveView.as_view(), name='section-move'),
 
     # Subsection views
     path('subsections/', views.SubsectionListCreateView.as_view(), name='subsection-list-create'),
+    path('subsections/bulk/', views.SubsectionBulkView.as_view(), name='subsection-bulk'),
     path('subsections/<int:pk>/', views.SubsectionDetailView.as_view(), name='subsection-detail'),
+    path('subsections/<int:pk>/move/', views.SubsectionMoveView.as_view(), name='subsection-move'),
     
+    # Collaborators: paged listing and bulk add/remove
+    path('books/<int:pk>/collaborators/', views.BookCollaboratorsView.as_view(), name='book-collaborators'),
+
     # Add Collaborator
     path('books/<int:book_id>/add-collaborator/<int:user_id>/', views.AddCollaboratorView.as_view(), name='add-collaborator'),
 
     # Remove Collaborator
     path('books/<int:book_id>/remove-collaborator/<int:user_id>/', views.RemoveCollaboratorView.as_view(), name='remove-collaborator'),
 
-]
\ No newline at end of file
+    # Search
+    path('search/', views.SearchView.as_view(), name='search'),
+
+    # Background jobs
+    path('jobs/', views.JobListCreateView.as_view(), name='job-list-create'),
+    path('jobs/<int:pk>/', views.JobDetailView.as_view(), name='job-detail'),
+    path('jobs/<int:pk>/result/', views.JobResultView.as_view(), name='job-result'),
+
+    # Async (ASGI) read views
+    path('async/books/', async_views.AsyncBookListView.as_view(), name='async-book-list'),
+    path('async/books/<int:pk>/', async_views.AsyncBookDetailView.as_view(), name='async-book-detail'),
+    path('async/books/<int:pk>/tree/', async_views.AsyncBookTreeView.as_view(), name='async-book-tree'),
+    path('async/sections/<int:pk>/', async_views.AsyncSectionDetailView.as_view(), name='async-section-detail'),
+    path('async/subsections/<int:pk>/', async_views.AsyncSubsectionDetailView.as_view(), name='async-subsection-detail'),
+]
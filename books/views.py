@@ -1,24 +1,50 @@
+import os
+import uuid
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
-from django.http import Http404
-from .models import Book, Section, Subsection
-from .serializers import BookSerializer, SectionSerializer, SubsectionSerializer
-from .permissions import IsAuthorOrCollaborator
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.urls import reverse
+from .bulk import BatchError, bulk_sections, bulk_subsections, parse_batch
+from .cache import get_cached, make_cache_key, set_cached
+from .changes import CHANGES_PAGE_SIZE, changes_since, current_cursor
+from .collaborators import add_collaborators, remove_collaborators
+from .conditional import book_validators, expected_version, not_modified, set_validators
+from .deletion import delete_books, delete_sections, delete_subsections
+from .duplication import duplicate_book
+from .export import EXPORT_FORMATS, export_content_type, iter_export
+from .importer import IMPORT_FORMATS
+from .jobs import enqueue
+from .listing import book_list_page
+from .pagination import CollaboratorCursorPagination
+from .models import Book, Job, Section, Subsection, VersionConflict
+from .serializers import (
+    BookSerializer, CollaboratorSerializer, JobSerializer, SectionMoveSerializer, SectionSerializer, SubsectionMoveSerializer, SubsectionSerializer,
+)
+from .permissions import AUTHOR, IsAuthorOrCollaborator, resolve_book_role
+from .search import search_documents
+from .tree import build_book_tree
 from django.contrib.auth import get_user_model
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 
 User = get_user_model()
 
 class BookListCreateView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
-    @method_decorator(cache_page(60*60*2, key_prefix='book_list_view_cache_'))
     def get(self, request):
-        books = Book.objects.all()
-        serializer = BookSerializer(books, many=True)
-        return Response(serializer.data)
+        # Cached per user and per query; the key is invalidated by any write (see books/cache.py)
+        cache_key = make_cache_key('book_list', request.user, request.build_absolute_uri())
+        data = get_cached(cache_key)
+        if data is not None:
+            return Response(data)
+
+        data = book_list_page(request.user, request.query_params, request.build_absolute_uri())
+        set_cached(cache_key, data)
+        return Response(data)
 
     def post(self, request):
         data = request.data.copy()
@@ -26,7 +52,7 @@ class BookListCreateView(APIView):
         serializer = BookSerializer(data=data)
 
         if serializer.is_valid():
-            serializer.save(author=request.user)
+            serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -35,14 +61,16 @@ class BookDetailView(APIView):
 
     def get_object(self, pk):
         try:
-            return Book.objects.get(pk=pk)
+            book = Book.objects.get(pk=pk)
         except Book.DoesNotExist:
             raise Http404
+        self.check_object_permissions(self.request, book)
+        return book
 
     def get(self, request, pk):
         book = self.get_object(pk)
-        serializer = BookSerializer(book)
-        return Response(serializer.data)
+        validators = book_validators(book)
+        return set_validators(not_modified(request, validators) or Response(BookSerializer(book).data), validators)
 
     def put(self, request, pk):
         book = self.get_object(pk)
@@ -54,129 +82,376 @@ class BookDetailView(APIView):
 
     def delete(self, request, pk):
         book = self.get_object(pk)
-        book.delete()
+
+        if resolve_book_role(request, book.pk) != AUTHOR:
+            return Response("Only the author can delete this book.", status=status.HTTP_403_FORBIDDEN)
+
+        # Large books are deleted in the background, counting stops as soon as the limit is reached
+        limit = settings.BOOKS_SYNC_DELETE_MAX_NODES
+        if Subsection.objects.filter(section__book=book)[:limit + 1].count() > limit:
+            job = enqueue('delete_book', request.user, {'book': book.pk})
+            return job_accepted(job)
+
+        delete_books([book.pk])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+def job_accepted(job):
+    response = Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+    response['Location'] = reverse('job-detail', args=[job.pk])
+    return response
+
+class BookTreeView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAuthorOrCollaborator]
+
+    def get(self, request, pk):
+        try:
+            book = Book.objects.get(pk=pk)
+        except Book.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(request, book)
+
+        validators = book_validators(book)
+        return set_validators(not_modified(request, validators) or Response(build_book_tree(book)), validators)
+
+class BookChangesView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAuthorOrCollaborator]
+
+    def get(self, request, pk):
+        try:
+            book = Book.objects.get(pk=pk)
+        except Book.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(request, book)
+
+        since = request.query_params.get('since')
+        limit = request.query_params.get('limit', CHANGES_PAGE_SIZE)
+        try:
+            since = None if since is None else int(since)
+            limit = int(limit)
+        except ValueError:
+            return Response("'since' and 'limit' must be integers.", status=status.HTTP_400_BAD_REQUEST)
+        if (since is not None and since < 0) or not 1 <= limit <= CHANGES_PAGE_SIZE:
+            return Response(f"'since' cannot be negative and 'limit' between 1 and {CHANGES_PAGE_SIZE}.", status=status.HTTP_400_BAD_REQUEST)
+
+        # Without a cursor the client starts from the current state, e.g. the tree view
+        if since is None:
+            return Response({'cursor': current_cursor(book.pk), 'has_more': False, 'changes': []})
+        return Response(changes_since(book.pk, since, limit))
+
+class BookDuplicateView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAuthorOrCollaborator]
+
+    def post(self, request, pk):
+        try:
+            book = Book.objects.get(pk=pk)
+        except Book.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(request, book)
+
+        serializer = BookSerializer(data={'title': request.data.get('title') or f'Copy of {book.title}'[:255]}, fields=['title'])
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        title = serializer.validated_data['title']
+        copy_collaborators = str(request.data.get('collaborators', '')).lower() in ('1', 'true')
+
+        # The requesting user becomes the author of the copy; large books are copied in the background
+        limit = settings.BOOKS_SYNC_DUPLICATE_MAX_NODES
+        if Subsection.objects.filter(section__book=book)[:limit + 1].count() > limit:
+            job = enqueue('duplicate_book', request.user, {'book': book.pk, 'title': title, 'collaborators': copy_collaborators})
+            return job_accepted(job)
+
+        copy = duplicate_book(book, request.user, title=title, copy_collaborators=copy_collaborators)
+        return Response(BookSerializer(copy).data, status=status.HTTP_201_CREATED)
+
+class ExportMixin:
+    def stream_export(self, request, books, filename):
+        export_format = request.query_params.get('as', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            return Response(f"Unknown export format '{export_format}'.", status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(iter_export(books, export_format), content_type=export_content_type(export_format))
+        response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+        return response
+
+class BookExportView(ExportMixin, APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAuthorOrCollaborator]
+
+    def get(self, request, pk):
+        try:
+            book = Book.objects.get(pk=pk)
+        except Book.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(request, book)
+
+        return self.stream_export(request, Book.objects.filter(pk=book.pk), f'book-{book.pk}')
+
+class LibraryExportView(ExportMixin, APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        # Every book the user can access
+        return self.stream_export(request, Book.objects.accessible_to(request.user), 'library')
+
 class SectionListCreateView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
         book_id = request.data.get('book')
-        book = Book.objects.get(pk=book_id)
 
         # Check if the user is the author of the book
-        if request.user != book.author:
+        if resolve_book_role(request, book_id) != AUTHOR:
             return Response("Only the author can create sections for this book.", status=status.HTTP_403_FORBIDDEN)
 
         serializer = SectionSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            # The section and its change log entry are written together
+            with transaction.atomic():
+                serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class SectionBulkView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        try:
+            batch = parse_batch(request.data)
+        except BatchError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        response_status, results = bulk_sections(request, batch)
+        return Response(results, status=response_status)
+
 class SectionDetailView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsAuthorOrCollaborator]
 
     def get_object(self, pk):
         try:
-            return Section.objects.get(pk=pk)
+            section = Section.objects.select_related('book').get(pk=pk)
         except Section.DoesNotExist:
             raise Http404
+        self.check_object_permissions(self.request, section)
+        return section
+
+    def conflict(self, pk):
+        # The current state, for the client to reapply its change on
+        return Response(SectionSerializer(self.get_object(pk)).data, status=status.HTTP_409_CONFLICT)
 
     def get(self, request, pk):
         section = self.get_object(pk)
-        serializer = SectionSerializer(section)
-        return Response(serializer.data)
+        validators = book_validators(section.book)
+        return set_validators(not_modified(request, validators) or Response(SectionSerializer(section).data), validators)
 
     def put(self, request, pk):
+        # get_object checks that the user is the author or a collaborator of the book
         section = self.get_object(pk)
+        version = expected_version(request)
+        if version is not None:
+            # Saved with a single UPDATE that only applies to this version
+            section.version = version
 
-        # Check if the user is the author or a collaborator of the book
-        if request.user != section.book.author and request.user not in section.book.collaborators.all():
-            return Response("Only the author and collaborators can edit this section.", status=status.HTTP_403_FORBIDDEN)
-
-        serializer = SectionSerializer(section, data=request.data)
+        serializer = SectionSerializer(section, data=request.data, context={'request': request})
         if serializer.is_valid():
-            serializer.save()
+            try:
+                with transaction.atomic():
+                    serializer.save()
+            except VersionConflict:
+                return self.conflict(pk)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, pk):
         section = self.get_object(pk)
         
-        if request.user != section.book.author:
+        if resolve_book_role(request, section.book_id) != AUTHOR:
             return Response("Only the author can delete this section.", status=status.HTTP_403_FORBIDDEN)
 
-        section.delete()
+        delete_sections([section.pk])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+class SectionMoveView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAuthorOrCollaborator]
+
+    def get_object(self, pk):
+        try:
+            section = Section.objects.get(pk=pk)
+        except Section.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(self.request, section)
+        return section
+
+    def post(self, request, pk):
+        section = self.get_object(pk)
+
+        serializer = SectionMoveSerializer(data=request.data, context={'section': section})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # Only the moved section is written, see books/ordering.py
+        try:
+            section.move(**serializer.validated_data)
+        except VersionConflict:
+            return Response("The section was changed concurrently, try again.", status=status.HTTP_409_CONFLICT)
+        return Response(SectionSerializer(section).data)
+
 class SubsectionListCreateView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
         section_id = request.data.get('section')
-        section = Section.objects.get(pk=section_id)
-        book = section.book
+        book_id = Section.objects.filter(pk=section_id).values_list('book_id', flat=True).first()
 
         # Check if the user is the author of the book
-        if request.user != book.author:
+        if resolve_book_role(request, book_id) != AUTHOR:
             return Response("Only the author can create subsections for this book.", status=status.HTTP_403_FORBIDDEN)
 
         serializer = SubsectionSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class SubsectionBulkView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        try:
+            batch = parse_batch(request.data)
+        except BatchError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        response_status, results = bulk_subsections(request, batch)
+        return Response(results, status=response_status)
+
 class SubsectionDetailView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsAuthorOrCollaborator]
 
     def get_object(self, pk):
         try:
-            return Subsection.objects.get(pk=pk)
+            subsection = Subsection.objects.select_related('section__book').get(pk=pk)
         except Subsection.DoesNotExist:
             raise Http404
+        self.check_object_permissions(self.request, subsection)
+        return subsection
+
+    def conflict(self, pk):
+        # The current state, for the client to reapply its change on
+        return Response(SubsectionSerializer(self.get_object(pk)).data, status=status.HTTP_409_CONFLICT)
 
     def get(self, request, pk):
         subsection = self.get_object(pk)
-        serializer = SubsectionSerializer(subsection)
-        return Response(serializer.data)
+        validators = book_validators(subsection.section.book)
+        return set_validators(not_modified(request, validators) or Response(SubsectionSerializer(subsection).data), validators)
 
     def put(self, request, pk):
+        # get_object checks that the user is the author or a collaborator of the book
         subsection = self.get_object(pk)
-
-        # Check if the user is the author or a collaborator of the book
-        if request.user != subsection.section.book.author and request.user not in subsection.section.book.collaborators.all():
-            return Response("Only the author and collaborators can edit this subsection.", status=status.HTTP_403_FORBIDDEN)
+        version = expected_version(request)
+        if version is not None:
+            # Saved with a single UPDATE that only applies to this version
+            subsection.version = version
 
         serializer = SubsectionSerializer(subsection, data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            try:
+                with transaction.atomic():
+                    serializer.save()
+            except VersionConflict:
+                return self.conflict(pk)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, pk):
         subsection = self.get_object(pk)
-        if request.user != subsection.section.book.author:
+        if resolve_book_role(request, subsection.section.book_id) != AUTHOR:
             return Response("Only the author can delete this section.", status=status.HTTP_403_FORBIDDEN)
 
-        subsection.delete()
+        delete_subsections([subsection.pk])
         return Response(status=status.HTTP_204_NO_CONTENT)
     
 
 
+class SubsectionMoveView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAuthorOrCollaborator]
+
+    def get_object(self, pk):
+        try:
+            subsection = Subsection.objects.select_related('section').get(pk=pk)
+        except Subsection.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(self.request, subsection)
+        return subsection
+
+    def post(self, request, pk):
+        subsection = self.get_object(pk)
+
+        serializer = SubsectionMoveSerializer(data=request.data, context={'subsection': subsection})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # Moves the whole subtree in one transaction: the node itself, plus one UPDATE
+        # for the paths of its descendants (and one for their section if it changed)
+        try:
+            subsection.move(**serializer.validated_data)
+        except VersionConflict:
+            return Response("The subsection was changed concurrently, try again.", status=status.HTTP_409_CONFLICT)
+        return Response(SubsectionSerializer(subsection).data)
+
+class BookCollaboratorsView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAuthorOrCollaborator]
+
+    def get_object(self, pk):
+        try:
+            book = Book.objects.only('id', 'author_id').get(pk=pk)
+        except Book.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(self.request, book)
+        return book
+
+    def get(self, request, pk):
+        book = self.get_object(pk)
+        collaborators = User.objects.filter(collaborating_books=book).only('id', 'username')
+
+        paginator = CollaboratorCursorPagination()
+        page = paginator.paginate_queryset(collaborators, request, view=self)
+        return paginator.get_paginated_response(CollaboratorSerializer(page, many=True).data)
+
+    def post(self, request, pk):
+        book = self.get_object(pk)
+        if resolve_book_role(request, book.pk) != AUTHOR:
+            return Response("Only the author can change the collaborators of this book.", status=status.HTTP_403_FORBIDDEN)
+
+        if not isinstance(request.data, dict):
+            return Response('Expected an object with "add" and/or "remove" lists.', status=status.HTTP_400_BAD_REQUEST)
+        changes = {}
+        for operation in ('add', 'remove'):
+            changes[operation] = request.data.get(operation, [])
+            if not isinstance(changes[operation], list):
+                return Response(f'"{operation}" must be a list of user ids or usernames.', status=status.HTTP_400_BAD_REQUEST)
+        if len(changes['add']) + len(changes['remove']) > settings.BOOKS_BULK_MAX_ITEMS:
+            return Response(f'At most {settings.BOOKS_BULK_MAX_ITEMS} users can be changed at once.', status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'add': add_collaborators(book, changes['add']),
+            'remove': remove_collaborators(book, changes['remove']),
+        })
+
 class AddCollaboratorView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, book_id, user_id):
         # Ensure the user making the request is the book's author
-        book = Book.objects.get(pk=book_id)
-        if request.user != book.author:
+        if resolve_book_role(request, book_id) != AUTHOR:
             return Response("You do not have permission to add a collaborator.", status=status.HTTP_403_FORBIDDEN)
 
         # Add the specified user as a collaborator
-        user = User.objects.get(pk=user_id)
-        book.collaborators.add(user)
+        book = Book.objects.only('id', 'author_id').get(pk=book_id)
+        [result] = add_collaborators(book, [user_id])
+        if result['status'] == status.HTTP_404_NOT_FOUND:
+            return Response("User not found.", status=status.HTTP_404_NOT_FOUND)
+        if result['status'] == status.HTTP_400_BAD_REQUEST:
+            return Response(result['detail'], status=status.HTTP_400_BAD_REQUEST)
         return Response("Collaborator added.", status=status.HTTP_200_OK)
 
 class RemoveCollaboratorView(APIView):
@@ -184,11 +459,133 @@ class RemoveCollaboratorView(APIView):
 
     def post(self, request, book_id, user_id):
         # Ensure the user making the request is the book's author
-        book = Book.objects.get(pk=book_id)
-        if request.user != book.author:
+        if resolve_book_role(request, book_id) != AUTHOR:
             return Response("You do not have permission to remove a collaborator.", status=status.HTTP_403_FORBIDDEN)
 
         # Remove the specified user as a collaborator
-        user = User.objects.get(pk=user_id)
-        book.collaborators.remove(user)
+        book = Book.objects.only('id', 'author_id').get(pk=book_id)
+        [result] = remove_collaborators(book, [user_id])
+        if result['status'] == status.HTTP_404_NOT_FOUND:
+            return Response("User not found.", status=status.HTTP_404_NOT_FOUND)
         return Response("Collaborator removed.", status=status.HTTP_200_OK)
+
+class SearchView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    page_size = 20
+    max_page_size = 100
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            page_size = min(max(int(request.query_params.get('page_size', self.page_size)), 1), self.max_page_size)
+        except ValueError:
+            return Response("page and page_size must be integers.", status=status.HTTP_400_BAD_REQUEST)
+
+        # Fetch one extra row to know whether there is a next page without counting
+        documents = search_documents(request.user, query, limit=page_size + 1, offset=(page - 1) * page_size)
+        url = request.build_absolute_uri()
+        return Response({
+            'next': replace_query_param(url, 'page', page + 1) if len(documents) > page_size else None,
+            'previous': (replace_query_param(url, 'page', page - 1) if page > 2 else remove_query_param(url, 'page')) if page > 1 else None,
+            'results': [
+                {'type': document.kind, 'id': document.object_id, 'book': document.book_id, 'title': document.title}
+                for document in documents[:page_size]
+            ],
+        })
+
+class JobListCreateView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    max_warm_pages = 10
+
+    def get(self, request):
+        jobs = Job.objects.filter(user_id=request.user.pk).order_by('-id')[:50]
+        return Response(JobSerializer(jobs, many=True).data)
+
+    def post(self, request):
+        if not isinstance(request.data, dict):
+            return Response('Expected an object with a "kind".', status=status.HTTP_400_BAD_REQUEST)
+        kind = request.data.get('kind')
+        handlers = {
+            'export': self.export_payload,
+            'import': self.import_payload,
+            'delete_book': self.delete_book_payload,
+            'warm_cache': self.warm_cache_payload,
+        }
+        if kind not in handlers:
+            return Response(f"kind must be one of: {', '.join(handlers)}.", status=status.HTTP_400_BAD_REQUEST)
+
+        payload = handlers[kind](request)
+        if isinstance(payload, Response):
+            return payload
+        return job_accepted(enqueue(kind, request.user, payload))
+
+    def export_payload(self, request):
+        export_format = request.data.get('format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            return Response(f"Unknown export format '{export_format}'.", status=status.HTTP_400_BAD_REQUEST)
+        books = request.data.get('books') or []
+        if not isinstance(books, list) or not all(isinstance(book_id, int) for book_id in books):
+            return Response("books must be a list of book ids.", status=status.HTTP_400_BAD_REQUEST)
+        # Books the user cannot access are left out by the job itself
+        return {'format': export_format, 'books': books}
+
+    def import_payload(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response("A file to import is required.", status=status.HTTP_400_BAD_REQUEST)
+        import_format = request.data.get('format') or ('csv' if upload.name.endswith('.csv') else 'ndjson')
+        if import_format not in IMPORT_FORMATS:
+            return Response(f"Unknown import format '{import_format}'.", status=status.HTTP_400_BAD_REQUEST)
+
+        os.makedirs(settings.BOOKS_JOB_OUTPUT_DIR, exist_ok=True)
+        path = os.path.join(settings.BOOKS_JOB_OUTPUT_DIR, f'upload-{uuid.uuid4().hex}.{import_format}')
+        with open(path, 'wb') as destination:
+            for chunk in upload.chunks():
+                destination.write(chunk)
+        # The payload is shown to the client, the job finds the file in BOOKS_JOB_OUTPUT_DIR
+        return {'file': os.path.basename(path), 'format': import_format}
+
+    def delete_book_payload(self, request):
+        book_id = request.data.get('book')
+        if resolve_book_role(request, book_id) != AUTHOR:
+            return Response("Only the author can delete this book.", status=status.HTTP_403_FORBIDDEN)
+        return {'book': int(book_id)}
+
+    def warm_cache_payload(self, request):
+        try:
+            pages = min(max(int(request.data.get('pages', 1)), 1), self.max_warm_pages)
+        except (TypeError, ValueError):
+            return Response("pages must be an integer.", status=status.HTTP_400_BAD_REQUEST)
+        return {'url': request.build_absolute_uri(reverse('book-list-create')), 'pages': pages}
+
+class JobDetailView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_object(self, pk):
+        # Other users' jobs are reported as missing
+        try:
+            return Job.objects.get(pk=pk, user_id=self.request.user.pk)
+        except Job.DoesNotExist:
+            raise Http404
+
+    def get(self, request, pk):
+        return Response(JobSerializer(self.get_object(pk)).data)
+
+class JobResultView(JobDetailView):
+    def get(self, request, pk):
+        job = self.get_object(pk)
+        if job.status == Job.SUCCEEDED and (job.result or {}).get('expired'):
+            return Response("The result file is no longer available.", status=status.HTTP_410_GONE)
+        if job.status != Job.SUCCEEDED or not (job.result or {}).get('file'):
+            return Response("This job has no result file.", status=status.HTTP_404_NOT_FOUND)
+
+        export_format = job.result['format']
+        path = os.path.join(settings.BOOKS_JOB_OUTPUT_DIR, job.result['file'])
+        try:
+            result = open(path, 'rb')
+        except FileNotFoundError:
+            # Removed, or written to another host's BOOKS_JOB_OUTPUT_DIR
+            return Response("The result file is no longer available.", status=status.HTTP_410_GONE)
+        return FileResponse(result, as_attachment=True, filename=f'export-{job.pk}.{export_format}',
+                            content_type=export_content_type(export_format))